@@ -0,0 +1,460 @@
+"""
+Offline benchmarks for the VOD .strm Generator plugin.
+
+Runs without Dispatcharr. `render` exercises only the plugin's pure helpers;
+`catalog` installs stand-in `apps.vod` / `apps.m3u` modules backed by Django
+models on a throwaway SQLite database (Django must be installed), fills them
+with a synthetic catalog and runs real plugin actions against it.
+
+    python benchmark.py render --items 1000000
+    python benchmark.py catalog --movies 100000 --series 0
+    python benchmark.py catalog --movies 0 --series 5000 --episodes 60 --latency 0.2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import uuid
+from types import SimpleNamespace
+from typing import Any, Dict
+
+from plugin import Plugin
+
+
+def _episodes(count: int, series_count: int = 5000):
+    """Yield lightweight episode stand-ins with realistic, repeating titles."""
+    for i in range(count):
+        series = i % series_count
+        yield SimpleNamespace(
+            name=f"EN - Series {series} & Friends <Episode {i % 60 + 1}>",
+            description=f"Plot for episode {i} of \"Series {series}\" - it's a story.",
+            season_number=i // 60 % 10 + 1,
+            episode_number=i % 60 + 1,
+        )
+
+
+def bench_render(args) -> Dict[str, Any]:
+    """Render episode NFOs and episode filenames, reporting per-item cost."""
+    plugin = Plugin()
+    series = SimpleNamespace(name="EN - Benchmark Show", year=2024, description="A show & more")
+    category = "EN - Drama/Crime & Thriller (series)"
+
+    started = time.perf_counter()
+    rendered_bytes = 0
+    for episode in _episodes(args.items):
+        nfo = plugin._generate_episode_nfo(episode)
+        filename = plugin._sanitize_filename(plugin._clean_title(episode.name))
+        rendered_bytes += len(nfo) + len(filename)
+        if episode.episode_number == 1:
+            rendered_bytes += len(plugin._generate_tvshow_nfo(series, category))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "items": args.items,
+        "seconds": round(elapsed, 3),
+        "items_per_sec": round(args.items / elapsed) if elapsed else 0,
+        "usec_per_item": round(elapsed / args.items * 1e6, 3) if args.items else 0,
+        "rendered_mb": round(rendered_bytes / 1e6, 1),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Stand-in Dispatcharr environment
+# ---------------------------------------------------------------------------
+
+def install_standin_dispatcharr(db_path: str, latency: float = 0.0, seasons: int = 1, episodes: int = 60):
+    """Register fake apps.vod / apps.m3u modules with the fields the plugin uses.
+
+    ``refresh_series_episodes`` sleeps ``latency`` seconds per call (the
+    provider round trip) and then creates ``seasons`` x ``episodes`` episodes.
+    Returns a namespace with the model classes.
+    """
+    import django
+    from django.conf import settings as django_settings
+
+    if not django_settings.configured:
+        django_settings.configure(
+            DATABASES={"default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": db_path,
+                "OPTIONS": {"timeout": 60},
+            }},
+            INSTALLED_APPS=[],
+            USE_TZ=True,
+            TIME_ZONE="UTC",
+            DEFAULT_AUTO_FIELD="django.db.models.AutoField",
+        )
+        django.setup()
+    from django.db import connection, models
+    from django.utils import timezone
+
+    def module(name, package=False):
+        mod = types.ModuleType(name)
+        if package:
+            mod.__path__ = []
+        sys.modules[name] = mod
+        return mod
+
+    module("apps", package=True)
+    module("apps.vod", package=True)
+    module("apps.m3u", package=True)
+    vod_models = module("apps.vod.models")
+    vod_tasks = module("apps.vod.tasks")
+    m3u_models = module("apps.m3u.models")
+
+    def model(class_name, target, app_label, **fields):
+        fields["__module__"] = target.__name__
+        fields["Meta"] = type("Meta", (), {"app_label": app_label})
+        cls = type(class_name, (models.Model,), fields)
+        setattr(target, class_name, cls)
+        return cls
+
+    def media_fields():
+        return {
+            "uuid": models.UUIDField(default=uuid.uuid4, unique=True),
+            "name": models.CharField(max_length=255),
+            "description": models.TextField(null=True),
+            "year": models.IntegerField(null=True),
+            "rating": models.CharField(max_length=10, null=True),
+            "tmdb_id": models.CharField(max_length=50, null=True),
+            "imdb_id": models.CharField(max_length=50, null=True),
+            "custom_properties": models.JSONField(null=True),
+            "created_at": models.DateTimeField(auto_now_add=True),
+            "updated_at": models.DateTimeField(auto_now=True),
+        }
+
+    def relation_fields():
+        return {
+            "m3u_account": models.ForeignKey(M3UAccount, on_delete=models.CASCADE),
+            "custom_properties": models.JSONField(null=True),
+            "created_at": models.DateTimeField(auto_now_add=True),
+            "updated_at": models.DateTimeField(auto_now=True),
+        }
+
+    M3UAccount = model("M3UAccount", m3u_models, "m3u",
+                       name=models.CharField(max_length=255),
+                       priority=models.IntegerField(default=0))
+    VODCategory = model("VODCategory", vod_models, "vod", name=models.CharField(max_length=255))
+    Movie = model("Movie", vod_models, "vod", **media_fields())
+    Series = model("Series", vod_models, "vod", **media_fields())
+    episode_fields = media_fields()
+    del episode_fields["year"]
+    Episode = model("Episode", vod_models, "vod",
+                    series=models.ForeignKey(Series, on_delete=models.CASCADE, related_name="episodes"),
+                    season_number=models.IntegerField(null=True),
+                    episode_number=models.IntegerField(null=True),
+                    **episode_fields)
+    M3UMovieRelation = model("M3UMovieRelation", vod_models, "vod",
+                             movie=models.ForeignKey(Movie, on_delete=models.CASCADE),
+                             category=models.ForeignKey(VODCategory, null=True, on_delete=models.SET_NULL),
+                             stream_id=models.CharField(max_length=255),
+                             **relation_fields())
+    M3USeriesRelation = model("M3USeriesRelation", vod_models, "vod",
+                              series=models.ForeignKey(Series, on_delete=models.CASCADE),
+                              category=models.ForeignKey(VODCategory, null=True, on_delete=models.SET_NULL),
+                              external_series_id=models.CharField(max_length=255),
+                              last_episode_refresh=models.DateTimeField(null=True),
+                              **relation_fields())
+    M3UEpisodeRelation = model("M3UEpisodeRelation", vod_models, "vod",
+                               episode=models.ForeignKey(Episode, on_delete=models.CASCADE),
+                               stream_id=models.CharField(max_length=255),
+                               **relation_fields())
+
+    with connection.schema_editor() as editor:
+        for cls in (M3UAccount, VODCategory, Movie, Series, Episode,
+                    M3UMovieRelation, M3USeriesRelation, M3UEpisodeRelation):
+            editor.create_model(cls)
+    # Concurrent refresh workers write from several threads
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode=WAL")
+
+    write_lock = threading.Lock()
+    # Shared memory, so fetches made in shard processes (generation_processes) count too
+    calls = multiprocessing.Value("i", 0)
+
+    def refresh_series_episodes(account, series, external_series_id, episodes_data=None):
+        """Stand-in provider fetch: wait, then store the series' episodes."""
+        time.sleep(latency)
+        with calls.get_lock():
+            calls.value += 1
+        with write_lock:
+            if not Episode.objects.filter(series=series).exists():
+                Episode.objects.bulk_create([
+                    Episode(series=series, season_number=season, episode_number=number,
+                            name=f"EN - {series.name} S{season:02d}E{number:02d}",
+                            description=f"Episode {number} of \"{series.name}\" & more.")
+                    for season in range(1, seasons + 1)
+                    for number in range(1, episodes + 1)
+                ])
+            have = set(M3UEpisodeRelation.objects.filter(
+                m3u_account=account, episode__series=series
+            ).values_list("episode_id", flat=True))
+            M3UEpisodeRelation.objects.bulk_create([
+                M3UEpisodeRelation(m3u_account=account, episode_id=episode_id,
+                                   stream_id=f"{account.id}-{episode_id}")
+                for episode_id in Episode.objects.filter(series=series).values_list("id", flat=True)
+                if episode_id not in have
+            ])
+            for relation in M3USeriesRelation.objects.filter(m3u_account=account, series=series):
+                properties = relation.custom_properties or {}
+                properties["episodes_fetched"] = True
+                relation.custom_properties = properties
+                relation.last_episode_refresh = timezone.now()
+                relation.save(update_fields=["custom_properties", "last_episode_refresh", "updated_at"])
+
+    vod_tasks.refresh_series_episodes = refresh_series_episodes
+
+    # The plugin lists folders in module-level helpers that take no metrics, so
+    # directory listings are counted here (shared, like the provider fetches)
+    listings = multiprocessing.Value("q", 0)
+
+    def counted(listing):
+        def wrapper(*args, **kwargs):
+            with listings.get_lock():
+                listings.value += 1
+            return listing(*args, **kwargs)
+        return wrapper
+
+    os.scandir = counted(os.scandir)
+    os.listdir = counted(os.listdir)
+    return SimpleNamespace(
+        M3UAccount=M3UAccount, VODCategory=VODCategory, Movie=Movie, Series=Series,
+        Episode=Episode, M3UMovieRelation=M3UMovieRelation,
+        M3USeriesRelation=M3USeriesRelation, M3UEpisodeRelation=M3UEpisodeRelation,
+        refresh_calls=calls, dir_listings=listings,
+    )
+
+
+def populate_catalog(env, movies: int, series: int, accounts: int = 1, categories: int = 40):
+    """Create a synthetic catalog; every title is offered by every account."""
+    chunk = 5000
+    account_rows = [env.M3UAccount.objects.create(name=f"provider-{i + 1}", priority=accounts - i)
+                    for i in range(accounts)]
+    category_rows = env.VODCategory.objects.bulk_create([
+        env.VODCategory(name=f"EN - Genre {i} / Sub & Genre {i % 7} (movie)") for i in range(categories)
+    ])
+
+    def fill(item_model, relation_model, item_field, count, extra):
+        for start in range(0, count, chunk):
+            items = item_model.objects.bulk_create([
+                item_model(name=f"EN - Title {i} <{item_field}>", year=1970 + i % 55,
+                           description=f"Synthetic plot {i} with \"quotes\" & ampersands.",
+                           rating="7.1", tmdb_id=str(100000 + i))
+                for i in range(start, min(start + chunk, count))
+            ])
+            relation_model.objects.bulk_create([
+                relation_model(m3u_account=account, category=category_rows[item.id % categories],
+                               **{item_field: item}, **extra(account, item))
+                for item in items
+                for account in account_rows
+            ])
+
+    fill(env.Movie, env.M3UMovieRelation, "movie", movies,
+         lambda account, item: {"stream_id": f"{account.id}{item.id}"})
+    fill(env.Series, env.M3USeriesRelation, "series", series,
+         lambda account, item: {"external_series_id": str(item.id)})
+
+
+# ---------------------------------------------------------------------------
+# Process counters
+# ---------------------------------------------------------------------------
+
+def _proc_io() -> Dict[str, int]:
+    """read()/write()-family call counts from /proc (Linux only, empty elsewhere).
+
+    ``syscr``/``syscw`` don't include stat, open, mkdir or getdents calls; those
+    come from the plugin's own counters.
+    """
+    try:
+        with open("/proc/self/io") as handle:
+            fields = dict(line.split(": ") for line in handle.read().splitlines())
+        return {"syscr": int(fields["syscr"]), "syscw": int(fields["syscw"])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the kernel's peak RSS mark so each action reports its own peak."""
+    try:
+        with open("/proc/self/clear_refs", "w") as handle:
+            handle.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as handle:
+            for line in handle:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux and a whole-process high-water mark
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _shard_peak_rss_mb() -> float:
+    """Peak RSS of the largest child process so far (shard processes), 0 without any."""
+    return round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+
+
+class _QuietLogger:
+    """Logger stand-in that keeps errors and drops the per-item chatter."""
+
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+        self.errors = []
+
+    def _emit(self, level, msg, *args):
+        if self.verbose:
+            print(level, msg % args if args else msg)
+
+    def debug(self, msg, *args):
+        pass
+
+    def info(self, msg, *args):
+        self._emit("INFO", msg, *args)
+
+    def warning(self, msg, *args):
+        self._emit("WARNING", msg, *args)
+
+    def error(self, msg, *args):
+        self.errors.append(msg % args if args else msg)
+        self._emit("ERROR", msg, *args)
+
+
+# Result key holding the number of items an action handled
+ITEM_KEYS = {
+    "generate_movies": "processed",
+    "generate_series": "episodes_created",
+    "cleanup_movies": "deleted_folders",
+    "cleanup_series": "deleted",
+}
+
+
+def _action_items(action: str, result: dict) -> int:
+    if action == "sync_changes":
+        return (result.get("movies", {}).get("processed", 0)
+                + result.get("series", {}).get("episodes_created", 0))
+    return result.get(ITEM_KEYS.get(action, ""), 0) or 0
+
+
+def bench_catalog(args) -> list:
+    """Run plugin actions against a synthetic catalog and measure each one."""
+    if args.target == "tmpfs":
+        base = "/dev/shm"
+    elif args.target == "disk":
+        base = None  # tempfile default
+    else:
+        base = args.target
+    workdir = tempfile.mkdtemp(prefix="vod2mlib-bench-", dir=base)
+
+    try:
+        env = install_standin_dispatcharr(os.path.join(workdir, "catalog.sqlite3"),
+                                          latency=args.latency, seasons=args.seasons,
+                                          episodes=args.episodes)
+        started = time.perf_counter()
+        populate_catalog(env, args.movies, args.series, accounts=args.accounts)
+        print(f"catalog: {args.movies} movies, {args.series} series x {args.seasons * args.episodes} "
+              f"episodes, {args.accounts} account(s) in {time.perf_counter() - started:.1f}s "
+              f"under {workdir}")
+
+        settings = {
+            "root_folder": os.path.join(workdir, "Movies"),
+            "series_root_folder": os.path.join(workdir, "Series"),
+            "dispatcharr_url": "http://192.0.2.10:9191",
+            "batch_size": "all",
+            "series_batch_size": "all",
+            "run_in_background": False,
+        }
+        settings.update(json.loads(args.settings) if args.settings else {})
+
+        plugin = Plugin()
+        rows = []
+        for action in args.actions.split(","):
+            logger = _QuietLogger(verbose=args.verbose)
+            io_before = _proc_io()
+            peak_reset = _reset_peak_rss()
+            refresh_before = env.refresh_calls.value
+            listings_before = env.dir_listings.value
+            started = time.perf_counter()
+            result = plugin.run(action, {}, {"logger": logger, "settings": settings})
+            elapsed = time.perf_counter() - started
+            io_after = _proc_io()
+
+            items = _action_items(action, result)
+            counters = result.get("metrics", {}).get("counters", {})
+            rows.append({
+                "action": action,
+                "status": result.get("status"),
+                "items": items,
+                "seconds": round(elapsed, 2),
+                "items_per_sec": round(items / elapsed) if elapsed else 0,
+                "proc_read_calls": io_after["syscr"] - io_before["syscr"] if io_before else "n/a",
+                "proc_write_calls": io_after["syscw"] - io_before["syscw"] if io_before else "n/a",
+                "stat": counters.get("stat", 0),
+                "mkdir": counters.get("mkdir", 0),
+                "file_reads": counters.get("file_reads", 0),
+                "file_writes": counters.get("file_writes", 0),
+                "scandir": env.dir_listings.value - listings_before,
+                "peak_rss_mb": _peak_rss_mb() if peak_reset else f"{_peak_rss_mb()} (process)",
+                "refresh_calls": env.refresh_calls.value - refresh_before,
+                "stage_seconds": ", ".join(
+                    f"{stage} {values['seconds']}"
+                    for stage, values in result.get("metrics", {}).get("stages", {}).items()
+                ),
+                "errors": len(logger.errors),
+            })
+            if result.get("shards"):
+                rows[-1]["shard_rss_mb"] = _shard_peak_rss_mb()
+        return rows
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    render = sub.add_parser("render", help="per-item NFO/filename render cost")
+    render.add_argument("--items", type=int, default=1_000_000, help="episode NFOs to render")
+    render.set_defaults(func=bench_render)
+
+    catalog = sub.add_parser("catalog", help="run plugin actions against a synthetic catalog")
+    catalog.add_argument("--movies", type=int, default=100_000)
+    catalog.add_argument("--series", type=int, default=5_000)
+    catalog.add_argument("--seasons", type=int, default=1, help="seasons per series")
+    catalog.add_argument("--episodes", type=int, default=60, help="episodes per season")
+    catalog.add_argument("--accounts", type=int, default=1, help="providers offering every title")
+    catalog.add_argument("--latency", type=float, default=0.0,
+                         help="seconds each simulated provider episode fetch takes")
+    catalog.add_argument("--target", default="disk",
+                         help="'disk' (system temp dir), 'tmpfs' (/dev/shm) or a directory")
+    catalog.add_argument("--actions", default="generate_movies,generate_series,cleanup_movies,cleanup_series",
+                         help="comma-separated plugin actions, run in order")
+    catalog.add_argument("--settings", help="JSON object merged over the benchmark's plugin settings")
+    catalog.add_argument("--keep", action="store_true", help="keep the work directory")
+    catalog.add_argument("--verbose", action="store_true", help="print the plugin's log")
+    catalog.set_defaults(func=bench_catalog)
+
+    args = parser.parse_args(argv)
+    result = args.func(args)
+    for row in result if isinstance(result, list) else [result]:
+        print()
+        for key, value in row.items():
+            print(f"{key:>16}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
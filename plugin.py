@@ -6,10 +6,1454 @@ MIT License
 Copyright (c) 2025-2026 shedunraid
 https://github.com/shedunraid/VODVSCODE
 """
+import hashlib
+import json
+import multiprocessing
 import os
+import queue
+import random
 import re
-from typing import Dict, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, partial
+from itertools import chain
+from typing import Dict, Any, Optional
+from urllib.parse import quote, urlencode
+from urllib.request import Request, pathname2url, urlopen
+from concurrent.futures import ThreadPoolExecutor
+
+
+MANIFEST_FILENAME = ".vod2mlib_manifest.db"
+STATE_FILENAME = ".vod2mlib_state.json"
+STAGING_DIRNAME = ".vod2mlib_staging"
+
+# Text rendering: patterns are compiled once, and results for strings that
+# repeat across a catalog (titles, category names) are kept in bounded caches
+_LANGUAGE_PREFIX_RE = re.compile(r'^[A-Z]{2,3}\s*-\s*')
+_MEDIA_SUFFIX_RE = re.compile(r'\s*\((movie|series)\)\s*$', re.IGNORECASE)
+_GENRE_SEPARATOR_RE = re.compile(r'[/&,]')
+_INVALID_FILENAME_RE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+
+
+def _escape_xml(text) -> str:
+    """Escape special XML characters."""
+    if not text:
+        return ""
+    # Chained str.replace stays in C and returns the same object when a
+    # character is absent; measured faster than str.translate or re.sub here
+    return (str(text).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            .replace('"', '&quot;').replace("'", '&apos;'))
+
+
+@lru_cache(maxsize=65536)
+def _cached_clean_title(title: str) -> str:
+    # Remove common language prefixes: EN -, FR -, US -, etc.
+    return _LANGUAGE_PREFIX_RE.sub('', title, count=1).strip()
+
+
+@lru_cache(maxsize=4096)
+def _cached_genres(category_name: str) -> tuple:
+    # Remove common prefixes (EN -, FR -, US -, etc.)
+    genre_text = _LANGUAGE_PREFIX_RE.sub('', category_name, count=1)
+    
+    # Remove (movie) or (series) suffix
+    genre_text = _MEDIA_SUFFIX_RE.sub('', genre_text, count=1)
+    
+    # Split on common separators, capitalize first letter of each word
+    genres = tuple(
+        ' '.join(word.capitalize() for word in genre.split())
+        for genre in _GENRE_SEPARATOR_RE.split(genre_text)
+    )
+    return tuple(genre for genre in genres if genre) or ("Unknown",)
+
+
+@lru_cache(maxsize=4096)
+def _cached_genre_elements(category_name: str) -> str:
+    """Rendered <genre> lines for a category, ready to splice into an NFO."""
+    if not category_name:
+        return ""
+    return ''.join(f'\n    <genre>{_escape_xml(genre)}</genre>' for genre in _cached_genres(category_name))
+
+
+class GenerationManifest:
+    """SQLite record of every file the plugin generated under one root folder.
+
+    Rows are keyed by output path and carry the relation id, movie/episode
+    uuid and stream_id that produced them, plus a digest of the file content.
+    Each kind is loaded into memory on first use so skip checks are dict
+    lookups instead of filesystem probes, digests are loaded per folder, and
+    new rows are buffered and committed in batches.
+    """
+
+    FLUSH_EVERY = 500
+    DIGEST_FOLDERS_CACHED = 256
+
+    def __init__(self, root_folder: str, read_only: bool = False):
+        self.path = os.path.join(root_folder, MANIFEST_FILENAME)
+        self._lock = threading.Lock()
+        self._index = {}
+        self._digests = OrderedDict()
+        self._kind_digests = {}
+        self._pending = []
+        self.read_only = read_only
+        if read_only:
+            # Planning only looks: never create, migrate or write the file
+            self._conn = sqlite3.connect(f"file:{pathname2url(self.path)}?mode=ro", uri=True,
+                                         timeout=30, check_same_thread=False)
+            self._conn.execute("SELECT path, kind, folder, relation_id, stream_id, digest FROM items LIMIT 1")
+            return
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " path TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " folder TEXT NOT NULL,"
+            " relation_id INTEGER,"
+            " item_uuid TEXT,"
+            " stream_id TEXT,"
+            " updated_at REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(items)")}
+        if "digest" not in columns:
+            self._conn.execute("ALTER TABLE items ADD COLUMN digest TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS items_folder ON items (folder)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS items_relation ON items (kind, relation_id)")
+        self._conn.commit()
+    
+    @classmethod
+    def open(cls, root_folder: str, logger, read_only: bool = False) -> Optional["GenerationManifest"]:
+        """Open the manifest for a root folder, or return None if it is unusable.
+        
+        A read-only manifest that doesn't exist yet is None too; ``record`` must
+        not be called on a read-only manifest.
+        """
+        try:
+            if read_only:
+                if not os.path.exists(os.path.join(root_folder, MANIFEST_FILENAME)):
+                    return None
+                return cls(root_folder, read_only=True)
+            os.makedirs(root_folder, exist_ok=True)
+            return cls(root_folder)
+        except Exception as e:
+            logger.warning("Manifest unavailable (%s) - falling back to filesystem checks", e)
+            return None
+    
+    def _kind_index(self, kind: str) -> dict:
+        index = self._index.get(kind)
+        if index is None:
+            self._flush_locked()
+            index = {
+                row[0]: (row[1], row[2])
+                for row in self._conn.execute(
+                    "SELECT path, relation_id, stream_id FROM items WHERE kind = ?", (kind,)
+                )
+            }
+            self._index[kind] = index
+        return index
+    
+    def get(self, kind: str, path: str):
+        """Return (relation_id, stream_id) recorded for a path, or None."""
+        with self._lock:
+            return self._kind_index(kind).get(path)
+    
+    def has(self, kind: str, path: str) -> bool:
+        return self.get(kind, path) is not None
+    
+    def digest(self, folder: str, path: str) -> Optional[str]:
+        """Return the recorded content digest of a file, or None."""
+        with self._lock:
+            return self._folder_digests(folder).get(path)
+    
+    def kind_digest(self, kind: str, path: str) -> Optional[str]:
+        """Return the digest recorded for a path, loading the digests of a whole kind at once.
+        
+        Meant for kinds with one row per folder: a series row's digest is the
+        fingerprint of the episode list it was written from.
+        """
+        with self._lock:
+            digests = self._kind_digests.get(kind)
+            if digests is None:
+                self._flush_locked()
+                digests = dict(self._conn.execute(
+                    "SELECT path, digest FROM items WHERE kind = ? AND digest IS NOT NULL", (kind,)
+                ))
+                self._kind_digests[kind] = digests
+            return digests.get(path)
+    
+    def _folder_digests(self, folder: str) -> dict:
+        digests = self._digests.get(folder)
+        if digests is None:
+            digests = dict(self._conn.execute(
+                "SELECT path, digest FROM items WHERE folder = ? AND digest IS NOT NULL", (folder,)
+            ))
+            # Overlay rows not committed yet instead of flushing, which would
+            # turn every new folder into its own transaction
+            for path, _, pending_folder, _, _, _, digest, _ in self._pending:
+                if pending_folder == folder and digest is not None:
+                    digests[path] = digest
+            self._digests[folder] = digests
+            if len(self._digests) > self.DIGEST_FOLDERS_CACHED:
+                self._digests.popitem(last=False)
+        else:
+            self._digests.move_to_end(folder)
+        return digests
+    
+    def record(self, kind: str, path: str, folder: str, relation_id=None, item_uuid=None, stream_id=None, digest=None):
+        """Record a generated file or folder (committed on the next flush)."""
+        stream_id = str(stream_id) if stream_id is not None else None
+        with self._lock:
+            index = self._index.get(kind)
+            if index is not None:
+                index[path] = (relation_id, stream_id)
+            if digest is not None and folder in self._digests:
+                self._digests[folder][path] = digest
+            if digest is not None and kind in self._kind_digests:
+                self._kind_digests[kind][path] = digest
+            self._pending.append(
+                (path, kind, folder, relation_id, str(item_uuid) if item_uuid else None, stream_id, digest, time.time())
+            )
+            if len(self._pending) >= self.FLUSH_EVERY:
+                self._flush_locked()
+    
+    def entries(self, kind: str) -> list:
+        """Return (path, folder) for every recorded row of a kind."""
+        with self._lock:
+            self._flush_locked()
+            return self._conn.execute("SELECT path, folder FROM items WHERE kind = ?", (kind,)).fetchall()
+    
+    def forget_paths(self, paths):
+        """Drop the rows of individually deleted files."""
+        with self._lock:
+            self._flush_locked()
+            self._conn.executemany("DELETE FROM items WHERE path = ?", [(p,) for p in paths])
+            self._conn.commit()
+            self._index.clear()
+            self._digests.clear()
+            self._kind_digests.clear()
+    
+    def forget_folders(self, folders):
+        """Drop every row that lives under the given deleted movie or series folders."""
+        with self._lock:
+            self._flush_locked()
+            # Only the dropped rows leave the in-memory caches, so forgetting one
+            # folder in the middle of a run doesn't reload whole kinds
+            for folder in folders:
+                for path, kind in self._conn.execute("SELECT path, kind FROM items WHERE folder = ?", (folder,)):
+                    self._index.get(kind, {}).pop(path, None)
+                    self._kind_digests.get(kind, {}).pop(path, None)
+                self._digests.pop(folder, None)
+            self._conn.executemany("DELETE FROM items WHERE folder = ?", [(f,) for f in folders])
+            self._conn.commit()
+    
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+    
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO items"
+            " (path, kind, folder, relation_id, item_uuid, stream_id, digest, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            self._pending,
+        )
+        self._conn.commit()
+        self._pending = []
+    
+    def close(self):
+        with self._lock:
+            try:
+                self._flush_locked()
+            finally:
+                self._conn.close()
+
+
+class LibraryWriter:
+    """Writes rendered .strm/.nfo payloads, leaving files with unchanged content alone.
+    
+    The SHA-1 of every payload is compared with the digest recorded in the
+    manifest, or with the bytes already on disk when there is no recorded
+    digest. Only new or changed content is written, so media servers don't
+    rescan items that didn't change. Directories are created at most once per
+    run. Thread-safe; counts are kept per run.
+    
+    With a ``staging_root``, new item folders are built there and renamed into
+    the library once complete (see ``staged``), and files written into
+    existing folders replace the old ones in a single rename.
+    """
+    
+    def __init__(self, manifest: Optional[GenerationManifest] = None, metrics: Optional["RunMetrics"] = None,
+                 staging_root: Optional[str] = None):
+        self.manifest = manifest
+        self.metrics = metrics or RunMetrics()
+        self.staging_root = staging_root
+        self._lock = threading.Lock()
+        self._dirs = set()
+        self._fresh_dirs = set()
+        # Item folder -> its copy in the staging area, and the manifest rows held back until it is published.
+        # Only the thread building a folder touches its entries.
+        self._staged = {}
+        self._held = {}
+        self.counts = {"written": 0, "updated": 0, "unchanged": 0}
+        self.dirs_created = 0
+        self.published = 0
+    
+    def ensure_dir(self, path: str) -> bool:
+        """Make sure a directory exists, touching the filesystem only the first time per run.
+        
+        Returns True if this call created it.
+        """
+        with self._lock:
+            if path in self._dirs:
+                return False
+        try:
+            with self.metrics.timer("mkdir"):
+                os.makedirs(path)
+            created = True
+        except FileExistsError:
+            created = False
+        self.metrics.count("mkdir")
+        with self._lock:
+            self._dirs.add(path)
+            if created:
+                self._fresh_dirs.add(path)
+                self.dirs_created += 1
+        return created
+    
+    def write(self, path: str, content: str, folder: str, kind: str = "nfo",
+              relation_id=None, item_uuid=None, stream_id=None, verify: bool = False) -> str:
+        """Write a file if its content changed; returns "written", "updated" or "unchanged".
+        
+        ``folder`` is the movie/series folder the file belongs to (used by the manifest).
+        With ``verify``, a file whose recorded digest matches is still checked
+        for existence, so one deleted by hand is written again.
+        """
+        with self.metrics.timer("write"):
+            status = self._write(path, content, folder, kind, relation_id, item_uuid, stream_id, verify)
+        with self._lock:
+            self.counts[status] += 1
+        return status
+    
+    def classify(self, path: str, content: str, folder: str, verify: bool = False) -> str:
+        """Return what ``write`` would do with a payload ("written", "updated" or "unchanged") without writing."""
+        return self._compare(path, content.encode('utf-8'), folder, verify=verify)[2]
+    
+    def apply(self, operation: "PlanOperation") -> Optional[str]:
+        """Execute one create/update operation of a plan.
+        
+        File operations are written like ``write`` (so unchanged content is
+        still left alone); folder operations make the folder and, for series,
+        record it in the manifest. Returns the write status for files. Files of
+        an "update" operation are verified to still exist on disk.
+        """
+        if operation.content is None:
+            self.ensure_dir(self._disk_path(operation.path, operation.folder))
+            if operation.kind == "series" and self.manifest:
+                self._record("series", operation.path, operation.folder,
+                             operation.relation_id, operation.item_uuid, digest=operation.digest)
+            return None
+        return self.write(operation.path, operation.content, operation.folder, operation.kind,
+                          operation.relation_id, operation.item_uuid, operation.stream_id,
+                          verify=operation.op == "update")
+    
+    @contextmanager
+    def staged(self, folder: str):
+        """Build a new item folder in the staging area and move it into place with one rename.
+        
+        Everything written for ``folder`` inside the block goes to the staging
+        copy, and its manifest rows are only recorded once the rename succeeded,
+        so a failed item leaves neither files nor rows behind. Without a staging
+        root, or when the folder already exists, the block writes in place.
+        """
+        if self.staging_root is None or os.path.isdir(folder):
+            yield
+            return
+        
+        stage = tempfile.mkdtemp(dir=self.staging_root)
+        staged_folder = os.path.join(stage, os.path.basename(folder))
+        self._staged[folder] = staged_folder
+        self._held[folder] = []
+        try:
+            yield
+            # Items without any operation (e.g. a series with no episodes) have nothing to publish
+            if os.path.isdir(staged_folder):
+                with self.metrics.timer("publish"):
+                    os.rename(staged_folder, folder)
+                with self._lock:
+                    self.published += 1
+                self.metrics.record_change(folder, "created")
+            if self.manifest:
+                for row in self._held[folder]:
+                    self.manifest.record(*row)
+        finally:
+            del self._staged[folder]
+            del self._held[folder]
+            shutil.rmtree(stage, ignore_errors=True)
+    
+    def _disk_path(self, path: str, folder: str) -> str:
+        """Where a file or folder of ``folder`` is written: its staging copy while the folder is staged."""
+        staged_folder = self._staged.get(folder)
+        return path if staged_folder is None else staged_folder + path[len(folder):]
+    
+    def _record(self, kind, path, folder, relation_id, item_uuid, stream_id=None, digest=None):
+        """Record a manifest row, or hold it back while its folder is staged."""
+        held = self._held.get(folder)
+        if held is None:
+            self.manifest.record(kind, path, folder, relation_id, item_uuid, stream_id, digest)
+        else:
+            held.append((kind, path, folder, relation_id, item_uuid, stream_id, digest))
+    
+    def _compare(self, path: str, data: bytes, folder: str, disk_path: Optional[str] = None,
+                 verify: bool = False):
+        """Return (digest, recorded digest, status) for a payload.
+        
+        ``disk_path`` is where the file currently lives if that isn't ``path`` (a staged folder).
+        ``verify`` stats the file before trusting a matching recorded digest.
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        known = self.manifest.digest(folder, path) if self.manifest else None
+        disk_path = disk_path or path
+        if known == digest:
+            if not verify:
+                return digest, known, "unchanged"
+            self.metrics.count("stat")
+            if os.path.exists(disk_path):
+                return digest, known, "unchanged"
+            return digest, known, "written"
+        
+        existing = None
+        # Nothing to compare against in a directory this run just created
+        if known is None and os.path.dirname(disk_path) not in self._fresh_dirs:
+            self.metrics.count("file_reads")
+            try:
+                with open(disk_path, 'rb') as f:
+                    existing = f.read()
+            except FileNotFoundError:
+                pass
+        if existing == data:
+            return digest, known, "unchanged"
+        return digest, known, "written" if known is None and existing is None else "updated"
+    
+    def _write(self, path, content, folder, kind, relation_id, item_uuid, stream_id, verify=False) -> str:
+        data = content.encode('utf-8')
+        disk_path = self._disk_path(path, folder)
+        digest, known, status = self._compare(path, data, folder, disk_path, verify)
+        if status != "unchanged":
+            if self.staging_root is None or disk_path != path:
+                with open(disk_path, 'wb') as f:
+                    f.write(data)
+            else:
+                # A file in a live folder: write it in the staging area and swap it in,
+                # so readers never see it half-written and a crash leaves nothing behind
+                # (a unique name rather than mkstemp, which would make the file owner-only)
+                temp_path = os.path.join(self.staging_root, f"{uuid.uuid4().hex}.tmp")
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            self.metrics.count("file_writes")
+            self.metrics.count("bytes_written", len(data))
+            # Staged folders are reported once they are published
+            if folder not in self._staged:
+                self.metrics.record_change(folder, "created" if folder in self._fresh_dirs else "modified")
+        
+        if self.manifest and known != digest:
+            self._record(kind, path, folder, relation_id, item_uuid, stream_id, digest)
+        return status
+
+
+class LibrarySnapshot:
+    """In-memory view of what already exists under a root folder, built in one pass.
+    
+    Used for skip checks when there is no manifest: one os.scandir of the root
+    plus one per item folder (spread over a thread pool) up front, instead of
+    an exists()/listdir() round trip per item while generating.
+    """
+    
+    def __init__(self):
+        self.movie_files = set()
+        self.series_folders = set()
+        self.episode_counts = {}  # Series folder -> .strm files in its Season folders
+    
+    def has(self, kind: str, path: str) -> bool:
+        if kind == "series":
+            return path in self.series_folders
+        return path in self.movie_files
+    
+    @classmethod
+    def scan(cls, root_folder: str, kind: str, workers: int, logger,
+             count_episodes: bool = False, shard: Optional["Shard"] = None) -> "LibrarySnapshot":
+        """Scan a movies ("movie") or series ("series") root folder.
+        
+        With ``count_episodes`` the Season folders of every series are listed
+        too, to count its episode files. A shard only scans its own folders.
+        """
+        started = time.monotonic()
+        snapshot = cls()
+        try:
+            with os.scandir(root_folder) as entries:
+                folders = [entry.path for entry in entries
+                           if entry.is_dir() and (shard is None or shard.holds(entry.name))]
+        except FileNotFoundError:
+            return snapshot
+        
+        if kind == "series":
+            scan_folder = _scan_series_episodes if count_episodes else cls._series_has_seasons
+        else:
+            scan_folder = cls._strm_files
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for folder, found in zip(folders, executor.map(scan_folder, folders)):
+                if kind == "series":
+                    # Episode lists are None for folders without Season folders
+                    if count_episodes and found is not None:
+                        snapshot.series_folders.add(folder)
+                        snapshot.episode_counts[folder] = len(found)
+                    elif not count_episodes and found:
+                        snapshot.series_folders.add(folder)
+                else:
+                    snapshot.movie_files.update(found)
+        
+        logger.info("Library snapshot: %d folders scanned in %.1fs", len(folders), time.monotonic() - started)
+        return snapshot
+    
+    @staticmethod
+    def _strm_files(folder: str) -> list:
+        try:
+            with os.scandir(folder) as entries:
+                return [entry.path for entry in entries if entry.name.endswith('.strm')]
+        except OSError:
+            return []
+    
+    @staticmethod
+    def _series_has_seasons(folder: str) -> bool:
+        try:
+            with os.scandir(folder) as entries:
+                return any(entry.name.startswith("Season") and entry.is_dir() for entry in entries)
+        except OSError:
+            return False
+
+
+# One step of a plan. ``op`` is create, update, delete, skip or fetch (a series
+# whose episodes the provider hasn't delivered yet); ``content`` is None for folders.
+# ``digest`` is only set on series records: the fingerprint of their episode list.
+PlanOperation = namedtuple(
+    "PlanOperation", "op kind path folder content relation_id item_uuid stream_id digest",
+    defaults=(None, None, None, None, None)
+)
+
+
+class LibraryPlan:
+    """Counts of what applying a plan would do, kept per operation and kind.
+    
+    Planning renders content and compares it with the manifest or the files
+    on disk, but never writes. Operations are tallied as they are added (with
+    the bytes creates and updates would write); only the first few paths of
+    each operation are kept, so planning a huge catalog stays cheap.
+    """
+    
+    OPERATIONS = ("create", "update", "delete", "skip", "fetch")
+    SAMPLES = 10
+    
+    def __init__(self):
+        self.counts = {op: {} for op in self.OPERATIONS}
+        self.bytes = {"create": 0, "update": 0}
+        self.samples = {op: [] for op in self.OPERATIONS}
+    
+    def add(self, operation: PlanOperation):
+        kinds = self.counts[operation.op]
+        kinds[operation.kind] = kinds.get(operation.kind, 0) + 1
+        if operation.op in self.bytes and operation.content is not None:
+            self.bytes[operation.op] += len(operation.content.encode('utf-8'))
+        if len(self.samples[operation.op]) < self.SAMPLES:
+            self.samples[operation.op].append(operation.path)
+    
+    def total(self, op: str) -> int:
+        return sum(self.counts[op].values())
+    
+    def as_dict(self) -> dict:
+        return {
+            "counts": {op: dict(kinds) for op, kinds in self.counts.items() if kinds},
+            "estimated_bytes": self.bytes["create"] + self.bytes["update"],
+            "samples": {op: paths for op, paths in self.samples.items() if paths},
+        }
+
+
+def _scan_movie_folder(folder: str) -> Optional[dict]:
+    """List a movie folder once: its entry names and .strm/.nfo counts, or None without a .strm."""
+    try:
+        with os.scandir(folder) as entries:
+            names = []
+            counts = {"strm": 0, "nfo": 0}
+            has_subdirs = False
+            for entry in entries:
+                names.append(entry.name)
+                if entry.name.endswith('.strm'):
+                    counts["strm"] += 1
+                elif entry.name.endswith('.nfo'):
+                    counts["nfo"] += 1
+                if entry.is_dir(follow_symlinks=False):
+                    has_subdirs = True
+    except OSError:
+        return None
+    if not counts["strm"]:
+        return None
+    # Names of plain files let deletion skip listing the folder again
+    counts["names"] = None if has_subdirs else names
+    return counts
+
+
+def _scan_series_episodes(folder: str) -> Optional[list]:
+    """Return the .strm paths in a series folder's Season folders, or None if it has none."""
+    try:
+        with os.scandir(folder) as entries:
+            seasons = [entry.path for entry in entries if entry.name.startswith("Season") and entry.is_dir()]
+        if not seasons:
+            return None
+        paths = []
+        for season in seasons:
+            with os.scandir(season) as entries:
+                paths.extend(entry.path for entry in entries if entry.name.endswith('.strm'))
+        return paths
+    except OSError:
+        return None  # Treated as not generated, so nothing in it is deleted
+
+
+def _episode_fingerprint(count: int, last_id) -> str:
+    """Fingerprint of a series' episode list: how many relations it has and the newest relation id."""
+    return f"{count}:{last_id}"
+
+
+def _remove_folder(folder: str, names: Optional[list] = None) -> dict:
+    """Delete a folder tree and count the .strm/.nfo files removed.
+    
+    ``names`` are the folder's (file-only) entries if the caller already listed
+    it; otherwise the tree is walked with scandir.
+    """
+    counts = {"strm": 0, "nfo": 0}
+    if names is None:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_counts = _remove_folder(entry.path)
+                    counts["strm"] += sub_counts["strm"]
+                    counts["nfo"] += sub_counts["nfo"]
+                else:
+                    os.unlink(entry.path)
+                    if entry.name.endswith('.strm'):
+                        counts["strm"] += 1
+                    elif entry.name.endswith('.nfo'):
+                        counts["nfo"] += 1
+    else:
+        for name in names:
+            try:
+                os.unlink(os.path.join(folder, name))
+            except FileNotFoundError:
+                continue
+            if name.endswith('.strm'):
+                counts["strm"] += 1
+            elif name.endswith('.nfo'):
+                counts["nfo"] += 1
+    try:
+        os.rmdir(folder)
+    except OSError:
+        # Something was added since the scan - remove whatever is left
+        shutil.rmtree(folder)
+    return counts
+
+
+def _close_db_connection():
+    """Release the calling thread's Django DB connection (worker threads are not reused)."""
+    try:
+        from django.db import connection
+        connection.close()
+    except Exception:
+        pass
+
+
+class Shard(namedtuple("Shard", "index count provider_slots ids", defaults=(None,))):
+    """One of ``count`` slices of a sharded run: the titles whose folder name hashes to ``index``.
+    
+    Titles that share a folder name always land in the same slice, so the
+    first of them still wins like in a single-process run. ``provider_slots``
+    maps M3U account ids to semaphores shared by every shard process.
+    ``ids`` are the relation ids the parent assigned to this slice, in id order.
+    """
+    
+    __slots__ = ()
+    
+    @staticmethod
+    def slot(folder_name: str, count: int) -> int:
+        return zlib.crc32(folder_name.encode('utf-8')) % count
+    
+    def holds(self, folder_name: str) -> bool:
+        return self.slot(folder_name, self.count) == self.index
+
+
+class RowProjection:
+    """Selected columns of a relation query, fetched as namedtuples.
+    
+    ``values_list()`` skips building the relation and its joined model
+    instances, and only the listed columns cross the wire. Columns in
+    ``nfo_columns`` are only selected when NFO files are rendered; otherwise
+    they read as None.
+    """
+    
+    def __init__(self, name: str, columns: dict, nfo_columns: Optional[dict] = None):
+        nfo_columns = nfo_columns or {}
+        self.row = namedtuple(name, [*columns, *nfo_columns], defaults=(None,) * len(nfo_columns))
+        self.columns = list(columns.values())
+        self.all_columns = self.columns + list(nfo_columns.values())
+    
+    def fetch(self, query, nfo: bool = False) -> list:
+        """Evaluate a queryset (or a slice of one) into rows."""
+        row = self.row
+        return [row(*values) for values in query.values_list(*(self.all_columns if nfo else self.columns))]
+
+
+# What the generators read from each relation (row attribute -> ORM lookup)
+_MOVIE_ROWS = RowProjection("MovieRow", {
+    "id": "id",
+    "stream_id": "stream_id",
+    "category_name": "category__name",
+    "movie_id": "movie_id",
+    "name": "movie__name",
+    "year": "movie__year",
+    "uuid": "movie__uuid",
+}, nfo_columns={
+    "description": "movie__description",
+    "rating": "movie__rating",
+    "tmdb_id": "movie__tmdb_id",
+    "imdb_id": "movie__imdb_id",
+})
+_SERIES_ROWS = RowProjection("SeriesRow", {
+    "id": "id",
+    "m3u_account_id": "m3u_account_id",
+    "account_name": "m3u_account__name",
+    "series_id": "series_id",
+    "category_name": "category__name",
+    "episodes_fetched": "custom_properties__episodes_fetched",
+    "last_fetched": "last_episode_refresh",
+    "name": "series__name",
+    "year": "series__year",
+    "uuid": "series__uuid",
+}, nfo_columns={
+    "description": "series__description",
+})
+# Just enough of a relation to name its folder, for assigning relations to shards
+_MOVIE_KEYS = RowProjection("MovieKey", {
+    "id": "id",
+    "movie_id": "movie_id",
+    "name": "movie__name",
+    "year": "movie__year",
+})
+_SERIES_KEYS = RowProjection("SeriesKey", {
+    "id": "id",
+    "series_id": "series_id",
+    "name": "series__name",
+    "year": "series__year",
+})
+_EPISODE_ROWS = RowProjection("EpisodeRow", {
+    "id": "id",
+    "stream_id": "stream_id",
+    "m3u_account_id": "m3u_account_id",
+    "series_id": "episode__series_id",
+    "uuid": "episode__uuid",
+    "name": "episode__name",
+    "season_number": "episode__season_number",
+    "episode_number": "episode__episode_number",
+}, nfo_columns={
+    "description": "episode__description",
+})
+
+
+class StagedPipeline:
+    """Worker-thread stages joined by bounded queues.
+    
+    Every stage has its own worker count, so a slow stage (e.g. provider
+    calls) only occupies its own threads while the other stages keep draining
+    their queues. Stage functions receive a list of job dicts (up to
+    ``batch_size`` taken from the queue at once, waiting up to ``linger``
+    seconds to fill it) and update them in place. A stage function may return
+    the list of jobs to forward instead (e.g. when it hands a job to another
+    worker), or be a generator that yields each job as soon as it is finished;
+    returning None forwards the whole batch. Jobs marked ``done``
+    pass through the remaining stages untouched. Finished jobs are collected
+    with ``get()``/``poll()`` in completion order.
+    """
+    
+    _CLOSE = object()
+    
+    def __init__(self, queue_size: int = 64):
+        self.queue_size = queue_size
+        self._stages = []
+        self._queues = []
+        self._threads = []
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+    
+    def add_stage(self, name: str, func, workers: int = 1, batch_size: int = 1, linger: float = 0.0):
+        self._stages.append((name, func, max(1, workers), max(1, batch_size), linger))
+    
+    def start(self):
+        self._queues = [queue.Queue(maxsize=self.queue_size) for _ in self._stages]
+        self._running = [stage[2] for stage in self._stages]
+        for index, (name, _, workers, _, _) in enumerate(self._stages):
+            for n in range(workers):
+                thread = threading.Thread(target=self._work, args=(index,), name=f"{name}-{n + 1}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+    
+    def put(self, job: dict):
+        """Feed a job into the first stage (blocks while that stage's queue is full)."""
+        self._queues[0].put(job)
+    
+    def get(self) -> dict:
+        """Wait for the next finished job."""
+        return self._results.get()
+    
+    def poll(self) -> list:
+        """Return the jobs that have finished so far without waiting."""
+        finished = []
+        while True:
+            try:
+                finished.append(self._results.get_nowait())
+            except queue.Empty:
+                return finished
+    
+    def close(self):
+        """Signal that no more jobs will be put; stages shut down once drained."""
+        for _ in range(self._stages[0][2]):
+            self._queues[0].put(self._CLOSE)
+    
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+    
+    def _take(self, inbox, batch_size: int, linger: float):
+        """Take up to batch_size jobs from a queue; returns (jobs, closed)."""
+        job = inbox.get()
+        if job is self._CLOSE:
+            return [], True
+        jobs = [job]
+        deadline = time.monotonic() + linger
+        while len(jobs) < batch_size:
+            try:
+                job = inbox.get(timeout=max(0.0, deadline - time.monotonic())) if linger else inbox.get_nowait()
+            except queue.Empty:
+                break
+            if job is self._CLOSE:
+                return jobs, True
+            jobs.append(job)
+        return jobs, False
+    
+    def _forward(self, index: int, job: dict):
+        if index + 1 < len(self._stages):
+            self._queues[index + 1].put(job)
+        else:
+            self._results.put(job)
+    
+    def _work(self, index: int):
+        _, func, _, batch_size, linger = self._stages[index]
+        inbox = self._queues[index]
+        try:
+            closed = False
+            while not closed:
+                jobs, closed = self._take(inbox, batch_size, linger)
+                active = [job for job in jobs if not job.get("done")]
+                forward = [job for job in jobs if job.get("done")]
+                if active:
+                    sent = set()
+                    try:
+                        handled = func(active)
+                        if handled is not None and not isinstance(handled, list):
+                            # Generator stage: pass each job on as soon as it is yielded
+                            for job in handled:
+                                sent.add(id(job))
+                                self._forward(index, job)
+                            handled = []
+                    except Exception as e:
+                        handled = None
+                        for job in active:
+                            job.setdefault("error", str(e))
+                            job["done"] = True
+                    forward.extend(
+                        [job for job in active if id(job) not in sent] if handled is None else handled
+                    )
+                for job in forward:
+                    self._forward(index, job)
+        finally:
+            _close_db_connection()
+            with self._lock:
+                self._running[index] -= 1
+                last = self._running[index] == 0
+            # The last worker out tells every worker of the next stage to finish
+            if last and index + 1 < len(self._stages):
+                for _ in range(self._stages[index + 1][2]):
+                    self._queues[index + 1].put(self._CLOSE)
+
+
+class ProviderUnavailable(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+
+class ProviderGate:
+    """Per-account connection limits, retry with backoff and a circuit breaker.
+    
+    Each M3U account gets at most ``max_connections`` concurrent calls. Jobs
+    that find their account saturated are parked here rather than blocking a
+    worker; the worker that frees the slot picks the next parked job up, so
+    other accounts keep their full throughput. Failed calls are retried with
+    exponential backoff plus jitter, and after ``failure_threshold``
+    consecutive failures an account is short-circuited for ``cooldown``
+    seconds before a single trial call is let through again. In a sharded run,
+    ``shared_slots`` (a semaphore per account) hold the limit across processes.
+    """
+    
+    backoff = 2.0
+    max_backoff = 60.0
+    failure_threshold = 5
+    cooldown = 300.0
+    
+    def __init__(self, max_connections: int = 2, retries: int = 3, shared_slots: Optional[dict] = None):
+        self.max_connections = max(1, max_connections)
+        self.retries = max(0, retries)
+        self.shared_slots = shared_slots or {}
+        self._lock = threading.Lock()
+        self._active = {}
+        self._parked = {}
+        self._failures = {}
+        self._open_until = {}
+    
+    def claim(self, account_id, job) -> bool:
+        """Take a connection slot for a job, or park the job if the account is saturated."""
+        with self._lock:
+            if self._active.get(account_id, 0) < self.max_connections:
+                self._active[account_id] = self._active.get(account_id, 0) + 1
+                return True
+            self._parked.setdefault(account_id, deque()).append(job)
+            return False
+    
+    def release(self, account_id):
+        """Free a slot; returns the next parked job for the account (keeping the slot) or None."""
+        with self._lock:
+            parked = self._parked.get(account_id)
+            if parked:
+                return parked.popleft()
+            self._active[account_id] -= 1
+            return None
+    
+    def is_open(self, account_id) -> bool:
+        with self._lock:
+            return self._open_until.get(account_id, 0) > time.monotonic()
+    
+    def call(self, account_id, func):
+        """Run a provider call with retries, honouring the account's circuit breaker."""
+        attempt = 0
+        while True:
+            if self.is_open(account_id):
+                raise ProviderUnavailable(f"Provider for account {account_id} is failing - paused for a few minutes")
+            try:
+                with self.shared_slots.get(account_id) or nullcontext():
+                    result = func()
+            except Exception:
+                self._record_failure(account_id)
+                if attempt >= self.retries:
+                    raise
+                # Exponential backoff with jitter so retries don't arrive in lockstep
+                delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+                time.sleep(delay / 2 + random.uniform(0, delay / 2))
+                attempt += 1
+                continue
+            with self._lock:
+                self._failures[account_id] = 0
+            return result
+    
+    def _record_failure(self, account_id):
+        with self._lock:
+            failures = self._failures.get(account_id, 0) + 1
+            self._failures[account_id] = failures
+            if failures >= self.failure_threshold:
+                self._open_until[account_id] = time.monotonic() + self.cooldown
+                # Let one trial call through after the cooldown
+                self._failures[account_id] = self.failure_threshold - 1
+
+
+class SeriesUpdateQueue:
+    """Background updates of series that are already generated.
+    
+    Two kinds of job come through here: stale-while-revalidate (a series whose
+    episodes were fetched longer than the TTL ago is generated or skipped from
+    what the database already has, then fetched again and rewritten) and
+    incremental syncs (episodes were added since the series was written, so
+    only those are written). At most ``limit`` of these jobs are in the
+    pipeline at once, so they never crowd out series that still need
+    generating; the rest wait for a slot. ``revalidations`` caps how many
+    stale series one run fetches again (None for no cap); the others are
+    deferred and stay stale for a later run. Used from the run's main thread only.
+    """
+    
+    def __init__(self, pipeline: StagedPipeline, limit: int, revalidations: Optional[int] = None):
+        self.pipeline = pipeline
+        self.limit = max(1, limit)
+        self.revalidations = revalidations
+        self.deferred = 0
+        self.waiting = deque()
+        self.active = 0
+        self.closed = False
+    
+    def add(self, job: dict):
+        if self.closed:
+            return
+        if job.get("revalidate") and self.revalidations is not None:
+            if self.revalidations <= 0:
+                self.deferred += 1
+                return
+            self.revalidations -= 1
+        job["update"] = True
+        self.waiting.append(job)
+        self._top_up()
+    
+    def finished(self):
+        """Account for an update job that left the pipeline."""
+        self.active -= 1
+        self._top_up()
+    
+    def cancel(self) -> int:
+        """Drop updates that haven't started; returns how many."""
+        self.closed = True
+        dropped = len(self.waiting)
+        self.waiting.clear()
+        return dropped
+    
+    def _top_up(self):
+        while self.waiting and self.active < self.limit:
+            self.pipeline.put(self.waiting.popleft())
+            self.active += 1
+
+
+class RunMetrics:
+    """Stage timers, counters and per-account provider latency histograms for one run.
+    
+    Also carries the run's progress and cancellation flag, which background
+    jobs report and set, and the library folders the run changed, for media
+    server notifications. Thread-safe. Stage time is summed over every thread
+    that worked on the stage, so parallel stages can add up to more than the
+    run's wall time.
+    """
+    
+    LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    
+    def __init__(self, action: str = ""):
+        self.action = action
+        self.started = time.time()
+        self._clock = time.perf_counter()
+        self.duration = None
+        self._lock = threading.Lock()
+        self.stages = {}  # stage -> [seconds, calls]
+        self.counters = {}
+        self.latency = {}  # account -> [bucket counts..., count, sum, max]
+        self.total = 0
+        self.unit = "items"
+        self._done = lambda: 0
+        self._progress_clock = self._clock
+        self._cancel = threading.Event()
+        self.changes = {}  # Item folder -> "created", "modified" or "deleted"
+    
+    @contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - started)
+    
+    def add_time(self, stage: str, seconds: float, calls: int = 1):
+        with self._lock:
+            totals = self.stages.setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += calls
+    
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def observe_refresh(self, account: str, seconds: float):
+        """Record one provider episode fetch for an account."""
+        with self._lock:
+            entry = self.latency.get(account)
+            if entry is None:
+                entry = self.latency[account] = [0] * len(self.LATENCY_BUCKETS) + [0, 0.0, 0.0]
+            for i, bound in enumerate(self.LATENCY_BUCKETS):
+                if seconds <= bound:
+                    entry[i] += 1
+            entry[-3] += 1
+            entry[-2] += seconds
+            entry[-1] = max(entry[-1], seconds)
+    
+    def record_change(self, folder: str, change: str):
+        """Note that an item folder was created, modified or deleted in this run.
+        
+        A folder deleted and then written again counts as modified; a folder
+        created in this run stays created whatever happens to it next, short of deletion.
+        """
+        with self._lock:
+            previous = self.changes.get(folder)
+            if previous is None or change == "deleted":
+                self.changes[folder] = change
+            elif previous == "deleted":
+                self.changes[folder] = "modified"
+    
+    def merge(self, data: dict, changes: Optional[dict] = None):
+        """Add another run's ``as_dict()`` (and ``changes``) to this one (a shard process of the same run)."""
+        for folder, change in (changes or {}).items():
+            self.record_change(folder, change)
+        buckets = len(self.LATENCY_BUCKETS)
+        with self._lock:
+            for stage, values in data["stages"].items():
+                totals = self.stages.setdefault(stage, [0.0, 0])
+                totals[0] += values["seconds"]
+                totals[1] += values["calls"]
+            for name, value in data["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for account, hist in data["refresh_latency"].items():
+                entry = self.latency.setdefault(account, [0] * buckets + [0, 0.0, 0.0])
+                for i, count in enumerate(hist["buckets"].values()):
+                    entry[i] += count
+                entry[-3] += hist["count"]
+                entry[-2] += hist["sum_seconds"]
+                entry[-1] = max(entry[-1], hist["max_seconds"])
+    
+    def set_total(self, total: int, unit: str, done):
+        """Start (or restart, e.g. movies then series in a sync) progress tracking.
+        
+        ``done`` is a callable returning how many of ``total`` are finished; it is
+        read whenever progress is polled, so hot loops don't have to report it.
+        """
+        with self._lock:
+            self.total = total
+            self.unit = unit
+            self._done = done
+            self._progress_clock = time.perf_counter()
+    
+    def progress(self) -> dict:
+        """Done/total, throughput and ETA of the current phase."""
+        with self._lock:
+            done, total, unit = self._done(), self.total, self.unit
+            elapsed = time.perf_counter() - self._progress_clock
+        rate = done / elapsed if elapsed > 0 else 0.0
+        return {
+            "done": done,
+            "total": total,
+            "unit": unit,
+            "percent": round(100.0 * done / total, 1) if total else None,
+            "per_second": round(rate, 2),
+            "eta_seconds": round((total - done) / rate) if rate and total > done else None,
+        }
+    
+    def cancel(self):
+        self._cancel.set()
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+    
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._clock
+    
+    def as_dict(self) -> dict:
+        """Plain-data view for the action result."""
+        buckets = len(self.LATENCY_BUCKETS)
+        with self._lock:
+            return {
+                "duration_seconds": round(self.duration if self.duration is not None
+                                          else time.perf_counter() - self._clock, 3),
+                "stages": {
+                    stage: {"seconds": round(seconds, 3), "calls": calls}
+                    for stage, (seconds, calls) in self.stages.items()
+                },
+                "counters": dict(self.counters),
+                "refresh_latency": {
+                    account: {
+                        "count": entry[-3],
+                        "sum_seconds": round(entry[-2], 3),
+                        "max_seconds": round(entry[-1], 3),
+                        # Cumulative, like Prometheus "le" buckets
+                        "buckets": dict(zip((str(b) for b in self.LATENCY_BUCKETS), entry[:buckets])),
+                    }
+                    for account, entry in self.latency.items()
+                },
+            }
+    
+    def write_textfile(self, directory: str) -> str:
+        """Write the run as a Prometheus textfile (node_exporter textfile collector format).
+        
+        One file per action, replaced atomically so the collector never reads a partial file.
+        """
+        data = self.as_dict()
+        action = self.action
+        label = f'action="{action}"'
+        lines = [
+            "# HELP vod2mlib_run_duration_seconds Wall time of the last run.",
+            "# TYPE vod2mlib_run_duration_seconds gauge",
+            f"vod2mlib_run_duration_seconds{{{label}}} {data['duration_seconds']}",
+            "# HELP vod2mlib_run_timestamp_seconds Start time of the last run.",
+            "# TYPE vod2mlib_run_timestamp_seconds gauge",
+            f"vod2mlib_run_timestamp_seconds{{{label}}} {self.started:.0f}",
+            "# HELP vod2mlib_stage_seconds Time spent per stage in the last run (summed over threads).",
+            "# TYPE vod2mlib_stage_seconds gauge",
+        ]
+        lines += [f'vod2mlib_stage_seconds{{{label},stage="{stage}"}} {values["seconds"]}'
+                  for stage, values in data["stages"].items()]
+        lines += [
+            "# HELP vod2mlib_stage_calls Stage invocations in the last run.",
+            "# TYPE vod2mlib_stage_calls gauge",
+        ]
+        lines += [f'vod2mlib_stage_calls{{{label},stage="{stage}"}} {values["calls"]}'
+                  for stage, values in data["stages"].items()]
+        lines += [
+            "# HELP vod2mlib_events Filesystem and provider events in the last run.",
+            "# TYPE vod2mlib_events gauge",
+        ]
+        lines += [f'vod2mlib_events{{{label},event="{name}"}} {value}'
+                  for name, value in data["counters"].items()]
+        if data["refresh_latency"]:
+            lines += [
+                "# HELP vod2mlib_refresh_latency_seconds Provider episode fetch latency in the last run.",
+                "# TYPE vod2mlib_refresh_latency_seconds histogram",
+            ]
+            for account, hist in data["refresh_latency"].items():
+                account_label = f'{label},account="{self._label_value(account)}"'
+                for bound, count in hist["buckets"].items():
+                    lines.append(f'vod2mlib_refresh_latency_seconds_bucket{{{account_label},le="{bound}"}} {count}')
+                lines.append(f'vod2mlib_refresh_latency_seconds_bucket{{{account_label},le="+Inf"}} {hist["count"]}')
+                lines.append(f'vod2mlib_refresh_latency_seconds_sum{{{account_label}}} {hist["sum_seconds"]}')
+                lines.append(f'vod2mlib_refresh_latency_seconds_count{{{account_label}}} {hist["count"]}')
+        
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"vod2mlib_{action}.prom")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+        return path
+    
+    @staticmethod
+    def _label_value(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MediaServerNotifier:
+    """Tells Jellyfin/Emby or Plex which library folders changed, instead of a full library scan.
+    
+    The folders a run changed are coalesced first: a folder under a changed
+    parent is dropped, and a root folder with more than ``max_paths`` changes
+    is refreshed as a whole. Paths are then translated to the server's view
+    (``path_map``) and sent as path-scoped refresh requests, at most ``rate``
+    requests per second. Jellyfin/Emby get the folders in batches through
+    ``/Library/Media/Updated``; Plex gets one partial scan per folder of the
+    library section that contains it.
+    """
+    
+    BATCH_SIZE = 100  # Jellyfin/Emby folders per request
+    UPDATE_TYPES = {"created": "Created", "modified": "Modified", "deleted": "Deleted"}
+    
+    def __init__(self, server_type: str, url: str, token: str, path_map: Optional[list] = None,
+                 rate: float = 2.0, max_paths: int = 500, timeout: float = 10.0):
+        self.server_type = server_type
+        self.url = url.rstrip("/")
+        self.token = token
+        # Longest plugin prefix first, so nested mappings win
+        self.path_map = sorted(path_map or (), key=lambda pair: len(pair[0]), reverse=True)
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.max_paths = max_paths
+        self.timeout = timeout
+        self._next_request = 0.0
+    
+    @staticmethod
+    def parse_path_map(value: str) -> list:
+        """Parse "plugin path=server path" pairs separated by commas or new lines."""
+        pairs = []
+        for entry in re.split(r'[,\n]', value or ""):
+            if "=" in entry:
+                local, remote = entry.split("=", 1)
+                if local.strip() and remote.strip():
+                    pairs.append((local.strip().rstrip("/"), remote.strip().rstrip("/")))
+        return pairs
+    
+    def coalesce(self, changes: dict, roots: list) -> dict:
+        """Reduce ``{folder: change}`` to the smallest set of folders worth refreshing."""
+        roots = [root.rstrip("/") for root in roots]
+        by_root = {}
+        for folder, change in changes.items():
+            root = next((root for root in roots if folder.startswith(root + "/")), None)
+            if root is None:
+                continue
+            # Plex can only rescan a path that still exists: a deleted folder becomes its parent
+            if change == "deleted" and self.server_type == "plex":
+                folder, change = os.path.dirname(folder), "modified"
+            by_root.setdefault(root, {})[folder] = change
+        
+        coalesced = {}
+        for root, folders in by_root.items():
+            if len(folders) > self.max_paths or root in folders:
+                coalesced[root] = "modified"
+                continue
+            for folder, change in folders.items():
+                parent = os.path.dirname(folder)
+                while parent != root and parent not in folders:
+                    parent = os.path.dirname(parent)
+                if parent == root:
+                    coalesced[folder] = change
+        return coalesced
+    
+    def notify(self, changes: dict, roots: list, logger) -> dict:
+        """Send refresh requests for the changed folders; returns {"paths", "requests", "errors"}."""
+        folders = self.coalesce(changes, roots)
+        stats = {"paths": len(folders), "requests": 0, "errors": 0}
+        if not folders:
+            return stats
+        updates = sorted((self.server_path(folder), change) for folder, change in folders.items())
+        
+        if self.server_type == "plex":
+            sections = self._plex_sections()
+            for path, _ in updates:
+                section = next((key for key, location in sections if path == location or
+                                path.startswith(location.rstrip("/") + "/")), None)
+                if section is None:
+                    logger.warning("No Plex library section contains %s", path)
+                    stats["errors"] += 1
+                    continue
+                query = urlencode({"path": path}, quote_via=quote)
+                self._send(f"/library/sections/{section}/refresh?{query}", None, stats, logger)
+        else:
+            for start in range(0, len(updates), self.BATCH_SIZE):
+                body = {"Updates": [{"Path": path, "UpdateType": self.UPDATE_TYPES[change]}
+                                    for path, change in updates[start:start + self.BATCH_SIZE]]}
+                self._send("/Library/Media/Updated", body, stats, logger)
+        return stats
+    
+    def server_path(self, folder: str) -> str:
+        """A plugin path as the media server sees it."""
+        for local, remote in self.path_map:
+            if folder == local or folder.startswith(local + "/"):
+                return remote + folder[len(local):]
+        return folder
+    
+    def _plex_sections(self) -> list:
+        """(section key, location path) pairs of the Plex server's libraries."""
+        data = json.loads(self._request("/library/sections", None))
+        return [
+            (str(directory["key"]), location["path"])
+            for directory in data.get("MediaContainer", {}).get("Directory", [])
+            for location in directory.get("Location", [])
+        ]
+    
+    def _send(self, path: str, body, stats: dict, logger):
+        try:
+            self._request(path, body)
+        except Exception as e:
+            logger.warning("Media server refresh failed: %s", e)
+            stats["errors"] += 1
+        stats["requests"] += 1
+    
+    def _request(self, path: str, body):
+        """One HTTP call, spaced out to the configured rate; returns the response body."""
+        delay = self._next_request - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_request = time.monotonic() + self.interval
+        
+        if self.server_type == "plex":
+            headers = {"X-Plex-Token": self.token, "Accept": "application/json"}
+        else:
+            headers = {"X-Emby-Token": self.token}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        request = Request(self.url + path, data=data, headers=headers, method="POST" if data else "GET")
+        with urlopen(request, timeout=self.timeout) as response:
+            return response.read()
+
+
+class BackgroundJob:
+    """A plugin action running on its own thread, polled by the job status action."""
+    
+    def __init__(self, action: str, metrics: RunMetrics):
+        self.id = uuid.uuid4().hex[:8]
+        self.action = action
+        self.metrics = metrics
+        self.state = "running"
+        self.result = None
+        self.started = time.time()
+        self.finished = None
+        self.thread = None
+    
+    @property
+    def running(self) -> bool:
+        return self.state in ("running", "cancelling")
+    
+    def summary(self) -> dict:
+        summary = {
+            "job_id": self.id,
+            "action": self.action,
+            "state": self.state,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": self.metrics.progress(),
+        }
+        if self.result is not None:
+            summary["result"] = {key: value for key, value in self.result.items() if key != "metrics"}
+        return summary
+    
+    def describe(self) -> str:
+        """One line for the action message, e.g. "generate_series 3f2a9c1e: running - 120/5000 series ..."."""
+        text = f"{self.action} {self.id}: {self.state}"
+        if self.running:
+            progress = self.metrics.progress()
+            if progress["total"]:
+                text += f" - {progress['done']}/{progress['total']} {progress['unit']} ({progress['percent']}%)"
+            text += f", {progress['per_second']}/s"
+            if progress["eta_seconds"] is not None:
+                text += f", ETA {_format_duration(progress['eta_seconds'])}"
+        elif self.result is not None:
+            text += f" - {self.result.get('message')}"
+        return text
+
+
+# Background jobs started in this process, newest last (shared by Plugin instances)
+_JOBS = OrderedDict()
+_JOBS_LOCK = threading.Lock()
+_JOBS_KEPT = 20
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def _format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
 
 
 class Plugin:
@@ -19,6 +1463,18 @@ class Plugin:
     version = "1.3.0"
     description = """• Convert Dispatcharr VODs to media library format (.strm files).        • SETUP: Map a host folder to /VODS in your Dispatcharr container (e.g., /mnt/media:/VODS).        • Configure root folders in plugin settings (/VODS/Movies and /VODS/Series by default).        • USAGE: Click 'Scan for VODs' to see totals.        • Use 'Generate Movie/Series .strm Files' with batch sizes (start small like 10 to test).        • Episodes auto-fetch per series as needed.        • Repeat clicks until complete - smart skip logic prevents duplicates.        • TIMING: Movies are fast (~30 sec per 250).        • Series OPTIMIZED: REAL THREADING! 50-70% faster with 3 parallel workers (10 series: 120s → ~50s)!        • Use batch of 1 for testing.        • NOTE: If you get errors, do a full browser refresh (Ctrl+F5 / Cmd+Shift+R) and try again.        • If you like this plugin please donate: https://paypal.me/shedunraid"""
     
+    # Long-running actions started as background jobs (unless Run in Background is off)
+    background_actions = ("generate_movies", "generate_series", "sync_changes", "plan_changes",
+                          "reconcile_library", "cleanup_movies", "cleanup_series")
+    
+    # Series refreshed/loaded/written together when processing "all"
+    series_chunk_size = 25
+    # Relations fetched per keyset page when streaming "all"
+    stream_chunk_size = 2000
+    # Relations that failed in earlier batches retried per click, and how many are remembered
+    batch_retries = 10
+    batch_retry_limit = 1000
+    
     fields = [
         {
             "id": "root_folder",
@@ -64,25 +1520,178 @@ class Plugin:
             "help_text": "Create .nfo metadata files for movies"
         },
         {
-            "id": "series_batch_size",
-            "label": "Batch Size (Series)",
-            "type": "select",
-            "default": "10",
-            "options": [
-                {"value": "1", "label": "1 series (testing)"},
-                {"value": "5", "label": "5 series"},
-                {"value": "10", "label": "10 series"},
-                {"value": "25", "label": "25 series"},
-                {"value": "all", "label": "All series (slow!)"}
-            ],
-            "help_text": "Series to process (episodes auto-fetched for each)"
+            "id": "account_priority",
+            "label": "Provider Priority",
+            "type": "string",
+            "default": "",
+            "help_text": "Comma-separated M3U account names (or ids), highest first. Titles offered by several providers are generated once, from the first listed account (then by each account's own priority)."
+        },
+        {
+            "id": "movie_writer_workers",
+            "label": "Movie Writer Threads",
+            "type": "number",
+            "default": 8,
+            "help_text": "How many movie folders are written at once (raise for network storage, lower for slow local disks)"
+        },
+        {
+            "id": "cleanup_workers",
+            "label": "Cleanup Threads",
+            "type": "number",
+            "default": 8,
+            "help_text": "How many folders the cleanup actions scan and delete at once (raise for network storage)"
+        },
+        {
+            "id": "generation_processes",
+            "label": "Generation Processes",
+            "type": "number",
+            "default": 1,
+            "help_text": "Split 'All' and Sync runs over this many processes to use more CPU cores (Linux). Each process takes the titles whose folder name hashes to it; 1 = everything in the plugin's own process"
+        },
+        {
+            "id": "series_batch_size",
+            "label": "Batch Size (Series)",
+            "type": "select",
+            "default": "10",
+            "options": [
+                {"value": "1", "label": "1 series (testing)"},
+                {"value": "5", "label": "5 series"},
+                {"value": "10", "label": "10 series"},
+                {"value": "25", "label": "25 series"},
+                {"value": "all", "label": "All series (slow!)"}
+            ],
+            "help_text": "Series to process (episodes auto-fetched for each)"
+        },
+        {
+            "id": "generate_series_nfo",
+            "label": "Generate Series NFO Files",
+            "type": "checkbox",
+            "default": True,
+            "help_text": "Create .nfo metadata files for series and episodes"
+        },
+        {
+            "id": "series_refresh_workers",
+            "label": "Series Refresh Workers",
+            "type": "number",
+            "default": 3,
+            "help_text": "Series whose episodes are fetched from providers at the same time (network)"
+        },
+        {
+            "id": "episode_cache_ttl_hours",
+            "label": "Episode Cache TTL (hours)",
+            "type": "number",
+            "default": 24,
+            "help_text": "Fetch a series' episode list from its provider again once it is this old, so running shows get new episodes (0 = fetch once, never again). Stale series are written from the episodes already known and refreshed in the background"
+        },
+        {
+            "id": "incremental_series",
+            "label": "Add New Episodes to Generated Series",
+            "type": "checkbox",
+            "default": True,
+            "help_text": "Compare each generated series' episode list with what was written and add only the missing episode files, instead of skipping the whole series"
+        },
+        {
+            "id": "provider_max_connections",
+            "label": "Max Connections per Provider",
+            "type": "number",
+            "default": 2,
+            "help_text": "Episode fetches allowed at the same time against one M3U account (keeps IPTV providers from throttling or banning you)"
+        },
+        {
+            "id": "provider_retries",
+            "label": "Provider Retries",
+            "type": "number",
+            "default": 3,
+            "help_text": "Retries for a failed episode fetch (exponential backoff). A provider that keeps failing is paused for 5 minutes."
+        },
+        {
+            "id": "series_load_workers",
+            "label": "Series Episode Load Workers",
+            "type": "number",
+            "default": 1,
+            "help_text": "Parallel database queries loading episodes (each query covers several series)"
+        },
+        {
+            "id": "series_render_workers",
+            "label": "Series Render Workers",
+            "type": "number",
+            "default": 2,
+            "help_text": "Threads building file names and NFO contents"
+        },
+        {
+            "id": "series_write_workers",
+            "label": "Series Write Workers",
+            "type": "number",
+            "default": 4,
+            "help_text": "Series whose files are written to disk at the same time (raise for network storage)"
+        },
+        {
+            "id": "use_manifest",
+            "label": "Use Generation Manifest",
+            "type": "checkbox",
+            "default": True,
+            "help_text": "Track generated files in a small database under each root folder so skip checks don't have to probe the filesystem (much faster on network storage)"
+        },
+        {
+            "id": "staged_publish",
+            "label": "Publish Completed Folders Only",
+            "type": "checkbox",
+            "default": False,
+            "help_text": "Build new movie/series folders in a hidden staging folder under the root and move each into the library in one rename once it is complete, so media servers never scan half-written folders"
+        },
+        {
+            "id": "run_in_background",
+            "label": "Run in Background",
+            "type": "checkbox",
+            "default": True,
+            "help_text": "Start generate/sync/cleanup actions as background jobs that return immediately (follow them with Job Status), so long runs don't hit browser or proxy timeouts"
+        },
+        {
+            "id": "media_server_type",
+            "label": "Media Server Notifications",
+            "type": "select",
+            "default": "none",
+            "options": [
+                {"value": "none", "label": "Off"},
+                {"value": "jellyfin", "label": "Jellyfin"},
+                {"value": "emby", "label": "Emby"},
+                {"value": "plex", "label": "Plex"}
+            ],
+            "help_text": "After each run, ask the media server to rescan only the folders that were created, updated or deleted, instead of the whole library"
+        },
+        {
+            "id": "media_server_url",
+            "label": "Media Server URL",
+            "type": "string",
+            "default": "",
+            "help_text": "e.g. http://192.168.99.11:8096 (Jellyfin), http://192.168.99.11:8096/emby (Emby) or http://192.168.99.11:32400 (Plex)"
+        },
+        {
+            "id": "media_server_token",
+            "label": "Media Server API Key / Token",
+            "type": "string",
+            "default": "",
+            "help_text": "Jellyfin/Emby API key, or X-Plex-Token"
+        },
+        {
+            "id": "media_server_path_map",
+            "label": "Media Server Path Mapping",
+            "type": "string",
+            "default": "",
+            "help_text": "Optional, if the media server sees the library under other paths: plugin path=server path, comma-separated (e.g. /VODS/Movies=/media/movies)"
+        },
+        {
+            "id": "media_server_rate_limit",
+            "label": "Max Refresh Requests per Second",
+            "type": "number",
+            "default": 2,
+            "help_text": "Spacing between refresh requests sent to the media server"
         },
         {
-            "id": "generate_series_nfo",
-            "label": "Generate Series NFO Files",
-            "type": "checkbox",
-            "default": True,
-            "help_text": "Create .nfo metadata files for series and episodes"
+            "id": "metrics_textfile_dir",
+            "label": "Metrics Textfile Directory",
+            "type": "string",
+            "default": "",
+            "help_text": "Optional. After each run, write its stage timings and counters to <dir>/vod2mlib_<action>.prom for the Prometheus node_exporter textfile collector"
         }
     ]
     
@@ -102,6 +1711,21 @@ class Plugin:
             "label": "Generate Series .strm Files",
             "description": "Fetch episodes + create .strm files (auto-fetch per series)"
         },
+        {
+            "id": "sync_changes",
+            "label": "Sync Changes",
+            "description": "Only process movies and series added or changed since the last sync"
+        },
+        {
+            "id": "plan_changes",
+            "label": "Plan Changes (Dry Run)",
+            "description": "Count what Generate (All) and Remove Orphans would create, update and delete, without writing anything"
+        },
+        {
+            "id": "reconcile_library",
+            "label": "Remove Orphans",
+            "description": "Delete only the movies, series and episodes whose titles are no longer in Dispatcharr"
+        },
         {
             "id": "cleanup_movies",
             "label": "Clean Up Movies",
@@ -111,6 +1735,21 @@ class Plugin:
             "id": "cleanup_series",
             "label": "Clean Up Series",
             "description": "⚠️ Remove all series folders and .strm files"
+        },
+        {
+            "id": "job_status",
+            "label": "Job Status",
+            "description": "Show progress, speed and ETA of the running background job (and recent finished ones)"
+        },
+        {
+            "id": "cancel_job",
+            "label": "Cancel Job",
+            "description": "Stop the running background job after the items it is working on (batch runs resume from there)"
+        },
+        {
+            "id": "reset_batch_position",
+            "label": "Reset Batch Position",
+            "description": "Make the next movie and series batches start from the beginning of the catalog again"
         }
     ]
     
@@ -124,18 +1763,187 @@ class Plugin:
         logger.info("Action: %s", action)
         logger.info("=" * 60)
         
+        if action == "job_status":
+            return self._job_status(params or {}, logger)
+        elif action == "cancel_job":
+            return self._cancel_job(params or {}, logger)
+        elif action in self.background_actions and settings.get("run_in_background", True):
+            return self._start_job(action, settings, logger)
+        
+        return self._execute(action, settings, logger, RunMetrics(action))
+    
+    def _execute(self, action: str, settings: Dict[str, Any], logger, metrics: RunMetrics):
+        """Run an action to completion and attach its metrics to the result."""
         if action == "scan_all_vods":
-            return self._scan_all_vods(settings, logger)
+            result = self._scan_all_vods(settings, logger)
         elif action == "generate_movies":
-            return self._generate_movies(settings, logger)
+            result = self._generate_movies(settings, logger, metrics=metrics)
         elif action == "generate_series":
-            return self._generate_series(settings, logger)
+            result = self._generate_series(settings, logger, metrics=metrics)
+        elif action == "sync_changes":
+            result = self._sync_changes(settings, logger, metrics=metrics)
         elif action == "cleanup_movies":
-            return self._cleanup_movies(settings, logger)
+            result = self._cleanup_movies(settings, logger, metrics=metrics)
         elif action == "cleanup_series":
-            return self._cleanup_series(settings, logger)
+            result = self._cleanup_series(settings, logger, metrics=metrics)
+        elif action == "reconcile_library":
+            result = self._reconcile_library(settings, logger, metrics=metrics)
+        elif action == "plan_changes":
+            result = self._plan_changes(settings, logger, metrics=metrics)
+        elif action == "reset_batch_position":
+            result = self._reset_batch_position(settings, logger)
+        else:
+            return {"status": "error", "message": f"Unknown action: {action}"}
+        
+        self._notify_media_server(metrics, result, settings, logger)
+        self._report_metrics(metrics, result, settings, logger)
+        return result
+    
+    def _notify_media_server(self, metrics: RunMetrics, result: dict, settings: Dict[str, Any], logger):
+        """Ask the configured media server to rescan only the folders this run changed."""
+        server_type = settings.get("media_server_type", "none")
+        if server_type in ("", "none") or not metrics.changes:
+            return
+        url = (settings.get("media_server_url") or "").strip()
+        if not url:
+            logger.warning("Media server notifications need a Media Server URL - skipped")
+            return
+        
+        notifier = MediaServerNotifier(
+            server_type, url, (settings.get("media_server_token") or "").strip(),
+            MediaServerNotifier.parse_path_map(settings.get("media_server_path_map", "")),
+            rate=self._int_setting(settings, "media_server_rate_limit", 2)
+        )
+        roots = [settings.get("root_folder", "/VODS/Movies"), settings.get("series_root_folder", "/VODS/Series")]
+        try:
+            with metrics.timer("notify"):
+                stats = notifier.notify(dict(metrics.changes), roots, logger)
+        except Exception as e:
+            logger.error("Media server notification failed: %s", e)
+            stats = {"paths": 0, "requests": 0, "errors": 1}
+        metrics.count("notify_requests", stats["requests"])
+        logger.info("Media server: %d changed folders sent in %d requests (%d failed)",
+                    stats["paths"], stats["requests"], stats["errors"])
+        result["media_server"] = stats
+    
+    def _start_job(self, action: str, settings: Dict[str, Any], logger):
+        """Start an action on a background thread and return its job id straight away."""
+        with _JOBS_LOCK:
+            running = [job for job in _JOBS.values() if job.running]
+            if running:
+                return {
+                    "status": "error",
+                    "message": f"Job {running[0].id} ({running[0].action}) is still running - "
+                               f"check Job Status or use Cancel Job",
+                    "job_id": running[0].id
+                }
+            job = BackgroundJob(action, RunMetrics(action))
+            _JOBS[job.id] = job
+            while len(_JOBS) > _JOBS_KEPT:
+                _JOBS.popitem(last=False)
+        
+        job.thread = threading.Thread(
+            target=self._run_job, args=(job, settings, logger), name=f"vod2mlib-{job.id}", daemon=True
+        )
+        job.thread.start()
+        logger.info("Started background job %s", job.id)
+        return {
+            "status": "ok",
+            "message": f"Started {action} as job {job.id} - use Job Status to follow progress",
+            "job_id": job.id
+        }
+    
+    def _run_job(self, job: "BackgroundJob", settings: Dict[str, Any], logger):
+        try:
+            job.result = self._execute(job.action, settings, logger, job.metrics)
+            if job.metrics.cancelled:
+                job.state = "cancelled"
+            else:
+                job.state = "completed" if job.result.get("status") == "ok" else "failed"
+        except Exception as e:
+            logger.error("Job %s failed: %s", job.id, e)
+            job.result = {"status": "error", "message": f"Job error: {e}"}
+            job.state = "failed"
+        finally:
+            job.finished = time.time()
+            _close_db_connection()
+            logger.info("Job %s %s", job.id, job.state)
+    
+    def _find_jobs(self, params: dict) -> Optional[list]:
+        """Jobs named by params["job_id"], or every job this process knows (newest first).
+        
+        Returns None if ``job_id`` is given but isn't a string.
+        """
+        job_id = params.get("job_id") or ""
+        if not isinstance(job_id, str):
+            return None
+        with _JOBS_LOCK:
+            jobs = list(reversed(_JOBS.values()))
+        job_id = job_id.strip()
+        if job_id:
+            jobs = [job for job in jobs if job.id == job_id]
+        return jobs
+    
+    def _job_status(self, params: dict, logger):
+        """Report progress, throughput and ETA of background jobs."""
+        jobs = self._find_jobs(params)
+        if jobs is None:
+            return {"status": "error", "message": "job_id must be a string"}
+        if not jobs:
+            return {"status": "ok", "message": "No background jobs", "jobs": []}
+        
+        # Running jobs first, then the most recent finished ones
+        shown = [job for job in jobs if job.running] + [job for job in jobs if not job.running][:5]
+        for job in shown:
+            logger.info(job.describe())
+        return {
+            "status": "ok",
+            "message": " | ".join(job.describe() for job in shown),
+            "jobs": [job.summary() for job in shown]
+        }
+    
+    def _cancel_job(self, params: dict, logger):
+        """Ask running background jobs to stop after the items they are working on."""
+        jobs = self._find_jobs(params)
+        if jobs is None:
+            return {"status": "error", "message": "job_id must be a string"}
+        running = [job for job in jobs if job.running]
+        if not running:
+            return {"status": "ok", "message": "No running job to cancel"}
+        
+        for job in running:
+            job.metrics.cancel()
+            job.state = "cancelling"
+            logger.info("Cancelling job %s (%s)", job.id, job.action)
+        return {
+            "status": "ok",
+            "message": f"Cancelling {', '.join(job.id for job in running)} - "
+                       f"items in progress are finished first",
+            "job_ids": [job.id for job in running]
+        }
+    
+    def _report_metrics(self, metrics: "RunMetrics", result: dict, settings: Dict[str, Any], logger):
+        """Attach the run's metrics to the result, log stage timings and export the textfile."""
+        metrics.finish()
+        data = metrics.as_dict()
+        result["metrics"] = data
+        
+        if data["stages"]:
+            logger.info("")
+            logger.info("Timing (%.1fs total, stage times summed over threads):", data["duration_seconds"])
+            for stage, values in sorted(data["stages"].items(), key=lambda item: -item[1]["seconds"]):
+                logger.info("  %-12s %8.2fs  (%d calls)", stage, values["seconds"], values["calls"])
+            for account, hist in data["refresh_latency"].items():
+                logger.info("  refresh %s: %d calls, avg %.2fs, max %.2fs", account, hist["count"],
+                            hist["sum_seconds"] / hist["count"], hist["max_seconds"])
         
-        return {"status": "error", "message": f"Unknown action: {action}"}
+        textfile_dir = (settings.get("metrics_textfile_dir") or "").strip()
+        if textfile_dir:
+            try:
+                path = metrics.write_textfile(textfile_dir)
+                logger.info("Metrics written to %s", path)
+            except OSError as e:
+                logger.warning("Could not write metrics textfile: %s", e)
     
     def _scan_all_vods(self, settings: Dict[str, Any], logger):
         """Scan and show total movies and series available."""
@@ -171,12 +1979,33 @@ class Plugin:
             logger.error("Scan failed: %s", e)
             return {"status": "error", "message": f"Scan error: {e}"}
     
-    def _generate_movies(self, settings: Dict[str, Any], logger):
-        """Generate movie .strm files according to batch size."""
+    def _sync_changes(self, settings: Dict[str, Any], logger, metrics: Optional[RunMetrics] = None):
+        """Process only movie and series relations added or changed since the last sync."""
+        metrics = metrics or RunMetrics("sync_changes")
+        movies = self._generate_movies(settings, logger, sync=True, metrics=metrics)
+        series = self._generate_series(settings, logger, sync=True, metrics=metrics)
+        
+        status = "ok" if movies.get("status") == "ok" and series.get("status") == "ok" else "error"
+        return {
+            "status": status,
+            "message": f"Movies: {movies.get('message')} | Series: {series.get('message')}",
+            "movies": movies,
+            "series": series
+        }
+    
+    def _generate_movies(self, settings: Dict[str, Any], logger, sync: bool = False,
+                         metrics: Optional[RunMetrics] = None, shard: Optional[Shard] = None):
+        """Generate movie .strm files according to batch size (or only changes when syncing).
+        
+        With ``shard`` only that slice of the catalog is generated (in a shard process).
+        """
+        metrics = metrics or RunMetrics("generate_movies")
         root_folder = settings.get("root_folder", "/VODS/Movies")
         dispatcharr_url = settings.get("dispatcharr_url", "http://192.168.99.11:9191").rstrip("/")
-        batch_size = settings.get("batch_size") or "250"
+        batch_size = "all" if sync else (settings.get("batch_size") or "250")
         generate_nfo = settings.get("generate_nfo", True)
+        use_manifest = settings.get("use_manifest", True)
+        writer_workers = self._int_setting(settings, "movie_writer_workers", 8)
         
         # Validate URL is not localhost
         if "localhost" in dispatcharr_url.lower() or "127.0.0.1" in dispatcharr_url:
@@ -199,6 +2028,8 @@ class Plugin:
         logger.info("  Dispatcharr URL: %s", dispatcharr_url)
         logger.info("  Batch Size: %s", batch_size)
         logger.info("  Generate NFO: %s", "Yes" if generate_nfo else "No")
+        logger.info("  Manifest: %s", "Yes" if use_manifest else "No")
+        logger.info("  Writer Threads: %d", writer_workers)
         logger.info("")
         
         # Import Django models
@@ -212,7 +2043,8 @@ class Plugin:
         # Get total count first
         logger.info("Scanning database...")
         try:
-            total_count = M3UMovieRelation.objects.count()
+            with metrics.timer("query"):
+                total_count = M3UMovieRelation.objects.count()
             logger.info("Total VODs in database: %d", total_count)
             logger.info("")
         except Exception as e:
@@ -223,21 +2055,49 @@ class Plugin:
         logger.info("Querying movies for this batch...")
         try:
             # Get movies with their M3U relations
-            query = M3UMovieRelation.objects.select_related('movie', 'm3u_account', 'category')
-            filtered_count = query.count()
+            query = M3UMovieRelation.objects.all()
+            # One relation per movie, from the preferred provider
+            query = self._preferred_relations(query, M3UMovieRelation, "movie", settings)
+            
+            if sync:
+                watermark, new_watermark = self._read_watermark(root_folder, "movies", M3UMovieRelation)
+                query = self._changed_since(query, watermark, "movie")
+            with metrics.timer("query"):
+                filtered_count = query.count()
+            # Only the columns the files need, as plain rows instead of model instances
+            fetch_rows = partial(_MOVIE_ROWS.fetch, nfo=generate_nfo)
+            
+            if sync and not filtered_count:
+                if not shard:
+                    self._write_watermark(root_folder, "movies", new_watermark)
+                logger.info("No movie changes since last sync")
+                return {"status": "ok", "message": "No movie changes since last sync", "processed": 0}
             
             if batch_size == "all":
-                movie_relations = list(query)
-                logger.info("Processing ALL %d movies", filtered_count)
+                # Stream in keyset pages so memory stays flat however big the catalog is
+                if shard and shard.ids is not None:
+                    movie_relations = self._iter_assigned(query, shard.ids, metrics, fetch_rows)
+                else:
+                    movie_relations = self._iter_relations(query, metrics=metrics, fetch=fetch_rows)
+                relation_total = filtered_count
+                logger.info("Processing ALL %d movies (streaming %d at a time)", filtered_count, self.stream_chunk_size)
                 target_batch = filtered_count
             else:
                 target_batch = int(batch_size)
-                # Fetch 3x batch size to account for skips
-                fetch_size = min(target_batch * 3, filtered_count)
-                movie_relations = list(query[:fetch_size])
-                logger.info("Fetching %d movies to process batch of %d", fetch_size, target_batch)
+                # Resume after the last movie the previous batch examined, paging in id order,
+                # after a few of the movies that failed in earlier batches
+                retry_rows, retry_later = self._batch_retries(query, root_folder, "movies", fetch_rows, metrics, logger)
+                query, cursor, relation_total = self._resume_batch(
+                    query, root_folder, "movies", filtered_count, metrics, logger
+                )
+                if not cursor:
+                    retry_rows, retry_later = [], []  # Starting over visits them anyway
+                movie_relations = chain(retry_rows, self._iter_relations(
+                    query, min(self.stream_chunk_size, target_batch * 3), metrics, fetch_rows
+                ))
+                logger.info("Processing batch of %d from %d remaining movies", target_batch, relation_total)
             
-            if not movie_relations:
+            if not relation_total:
                 logger.warning("No movies found in database!")
                 return {
                     "status": "ok",
@@ -245,7 +2105,7 @@ class Plugin:
                     "processed": 0
                 }
             
-            logger.info("Found %d movies to process", len(movie_relations))
+            logger.info("Found %d movies to process", relation_total)
             logger.info("")
             
         except Exception as e:
@@ -261,90 +2121,126 @@ class Plugin:
             logger.error("Failed to create root folder: %s", e)
             return {"status": "error", "message": f"Folder creation error: {e}"}
         
-        # Process movies until we've created the target batch
-        created_strm = 0
-        created_nfo = 0
-        skipped = 0
-        errors = 0
+        staging_root = self._staging_root(root_folder, settings, shard, logger)
+        processes = 1 if shard else self._shard_processes(settings, batch_size, logger)
+        if processes > 1:
+            result = self._generate_sharded("movies", settings, logger, sync, metrics, processes, query,
+                                            relation_total)
+            if sync and result["status"] == "ok" and not result.get("errors") and not result["cancelled"]:
+                self._write_watermark(root_folder, "movies", new_watermark)
+            self._release_staging_root(staging_root)
+            return result
+        
+        manifest = GenerationManifest.open(root_folder, logger) if use_manifest else None
+        writer = LibraryWriter(manifest, metrics, staging_root)
+        # Without a manifest, "All" and sync runs scan the library once instead of probing
+        # every movie; a batch only looks at a few, so it probes them one by one
+        if manifest or batch_size != "all":
+            snapshot = None
+        else:
+            with metrics.timer("snapshot"):
+                snapshot = LibrarySnapshot.scan(root_folder, "movie", writer_workers, logger, shard=shard)
+        
+        # Process movies until we've created the target batch. Skip checks and batch
+        # counting stay in this thread; folder/.strm/.nfo writes go to a bounded pool.
+        counts = {"created_strm": 0, "created_nfo": 0, "skipped": 0, "errors": 0, "failed_ids": []}
         processed = 0
+        last_examined = None  # Relation id the batch cursor can move past
+        exhausted = False
+        in_flight = 0
+        queued = deque()  # (idx, job, future) in submission order so the log stays ordered
+        claimed_paths = set()  # .strm paths written (or being written) this run, so duplicates skip like existing files
+        max_queued = writer_workers * 4
         
-        logger.info("Processing movies:")
+        logger.info("Processing movies with %d writer threads:", writer_workers)
         logger.info("-" * 60)
+        # Progress counts created movies towards a batch, or examined movies for "all"
+        metrics.set_total(min(target_batch, relation_total), "movies",
+                          lambda: counts["created_strm"] if batch_size != "all" else processed)
         
-        for idx, relation in enumerate(movie_relations, 1):
-            processed += 1
-            movie = relation.movie
-            stream_id = relation.stream_id
-            
-            # Build movie name with year (clean language prefix)
-            raw_name = movie.name or f"Unknown Movie {movie.id}"
-            movie_name = self._clean_title(raw_name)
-            year = movie.year
-            
-            if year:
-                folder_name = f"{self._sanitize_filename(movie_name)} ({year})"
-                strm_filename = f"{self._sanitize_filename(movie_name)} ({year}).strm"
-            else:
-                folder_name = self._sanitize_filename(movie_name)
-                strm_filename = f"{self._sanitize_filename(movie_name)}.strm"
-            
-            # Create movie folder and paths
-            movie_folder = os.path.join(root_folder, folder_name)
-            strm_path = os.path.join(movie_folder, strm_filename)
-            
-            # Check if already processed
-            if os.path.exists(strm_path):
-                skipped += 1
-                if idx % 50 == 1 or idx <= 10:
-                    logger.info("")
-                    logger.info("[%d/%d] %s - Already exists, skipping", idx, len(movie_relations), movie_name)
-                continue
-            
-            # Stop if we've created enough for this batch (unless processing all)
-            if batch_size != "all" and created_strm >= target_batch:
-                logger.info("")
-                logger.info("Batch complete! Created %d movies.", target_batch)
-                break
-            
-            # Build proxy URL
-            proxy_url = f"{dispatcharr_url}/proxy/vod/movie/{movie.uuid}?stream_id={stream_id}"
-            
-            # Log every 50th movie to avoid spam
-            if idx % 50 == 1 or idx <= 10:
-                logger.info("")
-                logger.info("[%d/%d] %s", idx, len(movie_relations), movie_name)
-                logger.info("  Year: %s", year if year else "Unknown")
-                logger.info("  Folder: %s", folder_name)
-                logger.info("  UUID: %s", movie.uuid)
-                logger.info("  Stream ID: %s", stream_id)
-            
-            try:
-                # Create folder
-                os.makedirs(movie_folder, exist_ok=True)
-                
-                # Write .strm file
-                with open(strm_path, 'w', encoding='utf-8') as f:
-                    f.write(proxy_url)
-                created_strm += 1
-                
-                # Write .nfo file if enabled
-                if generate_nfo:
-                    nfo_filename = strm_filename.replace('.strm', '.nfo')
-                    nfo_path = os.path.join(movie_folder, nfo_filename)
+        try:
+            with ThreadPoolExecutor(max_workers=writer_workers) as executor:
+                for idx, relation in enumerate(movie_relations, 1):
+                    if metrics.cancelled:
+                        logger.warning("Cancelled - finishing the movies already queued")
+                        break
+                    
+                    movie_name, folder_name, movie_folder, strm_path = self._movie_paths(relation, root_folder)
+                    if shard and not shard.holds(folder_name):
+                        continue
+                    processed += 1
+                    stream_id = relation.stream_id
+                    job = {
+                        "relation": relation,
+                        "movie_name": movie_name,
+                        "folder_name": folder_name,
+                        "movie_folder": movie_folder,
+                        "strm_path": strm_path,
+                        "log": idx % 50 == 1 or idx <= 10  # Log every 50th movie to avoid spam
+                    }
                     
-                    category_name = relation.category.name if relation.category else ""
-                    nfo_content = self._generate_nfo(movie, category_name)
+                    # Relations that existed at the last sync are only returned because they changed - rewrite them
+                    force = sync and watermark and relation.id <= watermark["last_id"]
                     
-                    with open(nfo_path, 'w', encoding='utf-8') as f:
-                        f.write(nfo_content)
-                    created_nfo += 1
-                
-                if idx % 50 == 1 or idx <= 10:
-                    logger.info("  ✓ Created: .strm%s", " + .nfo" if generate_nfo else "")
+                    # Check if already processed (manifest first, filesystem only on a miss)
+                    if strm_path in claimed_paths or (
+                        not force and self._is_generated(manifest, snapshot, "movie", strm_path, movie_folder,
+                                                         relation.id, relation.uuid, stream_id, metrics)
+                    ):
+                        counts["skipped"] += 1
+                        job["skipped"] = True
+                        queued.append((idx, job, None))
+                        last_examined = relation.id
+                        continue
+                    
+                    # Stop if we've created enough for this batch (unless processing all). Writes still
+                    # in flight count towards the target, and so do failures (retried on later clicks),
+                    # so a click never walks the whole catalog when everything fails
+                    if batch_size != "all":
+                        while queued and counts["created_strm"] + counts["errors"] + in_flight >= target_batch:
+                            in_flight -= self._finish_movie_write(queued.popleft(), counts, relation_total, logger)
+                        if counts["created_strm"] + counts["errors"] >= target_batch:
+                            logger.info("")
+                            logger.info("Batch complete! Created %d movies.", target_batch)
+                            break
+                    last_examined = relation.id
+                    
+                    # Plan the folder/.strm/.nfo here; the writer pool applies the plan
+                    with metrics.timer("render"):
+                        job["operations"] = self._plan_movie(relation, movie_folder, strm_path, dispatcharr_url,
+                                                             generate_nfo, "update" if force else "create")
+                    
+                    queued.append((idx, job, executor.submit(self._write_movie_files, job, writer)))
+                    claimed_paths.add(strm_path)
+                    in_flight += 1
+                    while len(queued) > max_queued:
+                        in_flight -= self._finish_movie_write(queued.popleft(), counts, relation_total, logger)
+                else:
+                    exhausted = True
                 
-            except Exception as e:
-                logger.error("  ✗ Error: %s", e)
-                errors += 1
+                while queued:
+                    in_flight -= self._finish_movie_write(queued.popleft(), counts, relation_total, logger)
+        except Exception as e:
+            # Pages are queried lazily as the loop asks for them, so database errors surface here
+            logger.error("Database query failed: %s", e)
+            return {"status": "error", "message": f"Database error: {e}"}
+        finally:
+            if manifest:
+                manifest.close()
+            if not shard:
+                self._release_staging_root(staging_root)
+        
+        created_strm = counts["created_strm"]
+        created_nfo = counts["created_nfo"]
+        skipped = counts["skipped"]
+        errors = counts["errors"]
+        
+        # Only advance the watermark when nothing failed, so failed items are retried next sync
+        if sync and errors == 0 and not metrics.cancelled and not shard:
+            self._write_watermark(root_folder, "movies", new_watermark)
+        if batch_size != "all":
+            self._save_cursor(root_folder, "movies", cursor, last_examined, counts["failed_ids"] + retry_later,
+                              exhausted, logger)
         
         logger.info("")
         logger.info("=" * 60)
@@ -355,6 +2251,11 @@ class Plugin:
         if generate_nfo:
             logger.info("  .nfo created:   %d", created_nfo)
         logger.info("  Skipped:        %d", skipped)
+        logger.info("  Files written:  %d new, %d updated, %d unchanged",
+                    writer.counts["written"], writer.counts["updated"], writer.counts["unchanged"])
+        logger.info("  Folders made:   %d", writer.dirs_created)
+        if staging_root:
+            logger.info("  Published:      %d folders", writer.published)
         logger.info("  Errors:         %d", errors)
         logger.info("=" * 60)
         logger.info("")
@@ -363,24 +2264,101 @@ class Plugin:
         summary_msg = f"Created {created_strm} .strm files"
         if generate_nfo:
             summary_msg += f" + {created_nfo} .nfo files"
+        if metrics.cancelled:
+            summary_msg = f"Cancelled - {summary_msg}"
         
         return {
             "status": "ok",
             "message": summary_msg,
+            "cancelled": metrics.cancelled,
             "total_in_db": total_count,
             "processed": processed,
             "created_strm": created_strm,
             "created_nfo": created_nfo if generate_nfo else 0,
             "skipped": skipped,
+            "files_written": writer.counts["written"],
+            "files_updated": writer.counts["updated"],
+            "files_unchanged": writer.counts["unchanged"],
+            "dirs_created": writer.dirs_created,
+            "folders_published": writer.published,
             "errors": errors
         }
     
-    def _generate_series(self, settings: Dict[str, Any], logger):
-        """Generate series .strm files with episodes using parallel processing."""
+    def _write_movie_files(self, job, writer):
+        """Apply one movie's planned folder, .strm and optional .nfo (runs in the writer pool)."""
+        result = {"strm": False, "nfo": False}
+        try:
+            # Files with unchanged content are left alone by the writer, and not counted
+            with writer.staged(job["movie_folder"]):
+                for operation in job["operations"]:
+                    if writer.apply(operation) not in ("written", "updated"):
+                        continue
+                    if operation.kind == "movie":
+                        result["strm"] = True
+                    elif operation.kind == "nfo":
+                        result["nfo"] = True
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+    
+    def _finish_movie_write(self, entry, counts, relation_total, logger) -> int:
+        """Collect one queued movie (in submission order), update counters and log it.
+        
+        Returns 1 if the entry was a write that was in flight, 0 for a skip.
+        """
+        idx, job, future = entry
+        if future is None:
+            if job["log"]:
+                logger.info("")
+                logger.info("[%d/%d] %s - Already exists, skipping", idx, relation_total, job["movie_name"])
+            return 0
+        
+        result = future.result()
+        relation = job["relation"]
+        if result["strm"]:
+            counts["created_strm"] += 1
+        if result["nfo"]:
+            counts["created_nfo"] += 1
+        
+        if job["log"]:
+            logger.info("")
+            logger.info("[%d/%d] %s", idx, relation_total, job["movie_name"])
+            logger.info("  Year: %s", relation.year if relation.year else "Unknown")
+            logger.info("  Folder: %s", job["folder_name"])
+            logger.info("  UUID: %s", relation.uuid)
+            logger.info("  Stream ID: %s", relation.stream_id)
+        
+        if "error" in result:
+            logger.error("  ✗ Error: %s", result["error"])
+            counts["errors"] += 1
+            counts["failed_ids"].append(relation.id)
+        elif job["log"]:
+            if result["strm"] or result["nfo"]:
+                logger.info("  ✓ Created: %s", " + ".join(kind for kind in (".strm", ".nfo") if result[kind[1:]]))
+            else:
+                logger.info("  ✓ Unchanged")
+        return 1
+    
+    def _generate_series(self, settings: Dict[str, Any], logger, sync: bool = False,
+                         metrics: Optional[RunMetrics] = None, shard: Optional[Shard] = None):
+        """Generate series .strm files with episodes using parallel processing.
+        
+        With ``shard`` only that slice of the catalog is generated (in a shard process).
+        """
+        metrics = metrics or RunMetrics("generate_series")
         series_root = settings.get("series_root_folder", "/VODS/Series")
         dispatcharr_url = settings.get("dispatcharr_url", "http://192.168.99.11:9191").rstrip("/")
-        batch_size = settings.get("series_batch_size") or "10"
+        batch_size = "all" if sync else (settings.get("series_batch_size") or "10")
         generate_nfo = settings.get("generate_series_nfo", True)
+        use_manifest = settings.get("use_manifest", True)
+        refresh_workers = self._int_setting(settings, "series_refresh_workers", 3)
+        load_workers = self._int_setting(settings, "series_load_workers", 1)
+        render_workers = self._int_setting(settings, "series_render_workers", 2)
+        write_workers = self._int_setting(settings, "series_write_workers", 4)
+        provider_connections = self._int_setting(settings, "provider_max_connections", 2)
+        provider_retries = self._int_setting(settings, "provider_retries", 3, minimum=0)
+        cache_ttl_hours = self._int_setting(settings, "episode_cache_ttl_hours", 24, minimum=0)
+        incremental = settings.get("incremental_series", True)
         
         # Validate URL
         if "localhost" in dispatcharr_url.lower() or "127.0.0.1" in dispatcharr_url:
@@ -392,35 +2370,71 @@ class Plugin:
         logger.info("  Dispatcharr URL: %s", dispatcharr_url)
         logger.info("  Batch Size: %s", batch_size)
         logger.info("  Generate NFO: %s", "Yes" if generate_nfo else "No")
-        logger.info("  Threading: ENABLED (3 workers)")
+        logger.info("  Manifest: %s", "Yes" if use_manifest else "No")
+        logger.info("  Pipeline Workers: refresh %d / load %d / render %d / write %d",
+                    refresh_workers, load_workers, render_workers, write_workers)
+        logger.info("  Provider Limits: %d connections per account, %d retries", provider_connections, provider_retries)
+        logger.info("  Episode Cache TTL: %s", f"{cache_ttl_hours}h" if cache_ttl_hours else "never expires")
+        logger.info("  Add New Episodes: %s", "Yes" if incremental else "No")
         logger.info("")
         
         try:
-            from apps.vod.models import M3USeriesRelation
+            from django.utils import timezone
+            from apps.vod.models import M3USeriesRelation, M3UEpisodeRelation
         except ImportError as e:
             logger.error("Failed to import models: %s", e)
             return {"status": "error", "message": f"Import error: {e}"}
         
         # Get series
         try:
-            query = M3USeriesRelation.objects.select_related('series', 'm3u_account', 'category')
-            total_count = query.count()
+            query = M3USeriesRelation.objects.all()
+            # One relation per series, from the preferred provider
+            query = self._preferred_relations(query, M3USeriesRelation, "series", settings)
+            
+            if sync:
+                watermark, new_watermark = self._read_watermark(
+                    series_root, "series", M3USeriesRelation, M3UEpisodeRelation
+                )
+                query = self._changed_since(query, watermark, "series", M3UEpisodeRelation)
+            with metrics.timer("query"):
+                total_count = query.count()
+            # Only the columns the files need, as plain rows instead of model instances
+            fetch_rows = partial(_SERIES_ROWS.fetch, nfo=generate_nfo)
+            
+            if sync and not total_count:
+                if not shard:
+                    self._write_watermark(series_root, "series", new_watermark)
+                logger.info("No series changes since last sync")
+                return {"status": "ok", "message": "No series changes since last sync", "series_processed": 0}
             
             if batch_size == "all":
-                series_relations = list(query)
-                logger.info("Processing ALL %d series", total_count)
+                # Stream in keyset pages so memory stays flat however big the catalog is
+                if shard and shard.ids is not None:
+                    series_relations = self._iter_assigned(query, shard.ids, metrics, fetch_rows)
+                else:
+                    series_relations = self._iter_relations(query, metrics=metrics, fetch=fetch_rows)
+                relation_total = total_count
+                logger.info("Processing ALL %d series (streaming %d at a time)", total_count, self.stream_chunk_size)
                 target_batch = total_count
             else:
                 target_batch = int(batch_size)
-                # Fetch enough to account for skips
-                fetch_size = min(target_batch * 3, total_count)
-                series_relations = list(query[:fetch_size])
-                logger.info("Fetching %d series to process batch of %d", fetch_size, target_batch)
+                # Resume after the last series the previous batch examined, paging in id order,
+                # after a few of the series that failed in earlier batches
+                retry_rows, retry_later = self._batch_retries(query, series_root, "series", fetch_rows, metrics, logger)
+                query, cursor, relation_total = self._resume_batch(
+                    query, series_root, "series", total_count, metrics, logger
+                )
+                if not cursor:
+                    retry_rows, retry_later = [], []  # Starting over visits them anyway
+                series_relations = chain(retry_rows, self._iter_relations(
+                    query, min(self.stream_chunk_size, target_batch * 3), metrics, fetch_rows
+                ))
+                logger.info("Processing batch of %d from %d remaining series", target_batch, relation_total)
             
-            if not series_relations:
+            if not relation_total:
                 return {"status": "ok", "message": "No series found"}
             
-            logger.info("Found %d series to process", len(series_relations))
+            logger.info("Found %d series to process", relation_total)
             logger.info("")
         except Exception as e:
             logger.error("Query failed: %s", e)
@@ -432,241 +2446,1133 @@ class Plugin:
         except Exception as e:
             return {"status": "error", "message": f"Folder creation error: {e}"}
         
-        # Process series with ThreadPoolExecutor (3 workers for safety)
-        created_strm = 0
-        created_nfo = 0
-        errors = 0
-        series_created = 0
-        skipped = 0
+        staging_root = self._staging_root(series_root, settings, shard, logger)
+        processes = 1 if shard else self._shard_processes(settings, batch_size, logger)
+        if processes > 1:
+            result = self._generate_sharded("series", settings, logger, sync, metrics, processes, query,
+                                            relation_total)
+            if sync and result["status"] == "ok" and not result.get("errors") and not result["cancelled"]:
+                self._write_watermark(series_root, "series", new_watermark)
+            self._release_staging_root(staging_root)
+            return result
+        
+        manifest = GenerationManifest.open(series_root, logger) if use_manifest else None
+        writer = LibraryWriter(manifest, metrics, staging_root)
+        # Without a manifest, "All" and sync runs scan the library once instead of listing
+        # every series folder; a batch only looks at a few, so it lists them one by one
+        if manifest or batch_size != "all":
+            snapshot = None
+        else:
+            with metrics.timer("snapshot"):
+                snapshot = LibrarySnapshot.scan(series_root, "series", write_workers, logger,
+                                                count_episodes=incremental, shard=shard)
+        
+        # Skip checks and batch counting stay in this thread; series that need work go
+        # through the refresh -> load -> render -> write pipeline
+        counts = {"series_created": 0, "skipped": 0, "created_strm": 0, "created_nfo": 0, "errors": 0, "done": 0,
+                  "failed_ids": [], "revalidated": 0, "revalidation_errors": 0,
+                  "series_updated": 0, "update_errors": 0}
+        in_flight = 0
+        last_examined = None  # Relation id the batch cursor can move past
+        exhausted = False
+        claimed_folders = set()  # Series folders handled this run (titles can share a folder name)
         
-        logger.info("Processing series with 3 parallel workers:")
+        logger.info("Processing series (workers: refresh %d, load %d, render %d, write %d):",
+                    refresh_workers, load_workers, render_workers, write_workers)
         logger.info("-" * 60)
         
-        max_workers = 3
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit tasks for series that need processing
-            futures = {}
-            submitted = 0
-            
+        pipeline = StagedPipeline(queue_size=self.series_chunk_size * 2)
+        gate = ProviderGate(max_connections=provider_connections, retries=provider_retries,
+                            shared_slots=shard.provider_slots if shard else None)
+        pipeline.add_stage(
+            "refresh",
+            partial(self._refresh_stage, gate=gate, ordering=self._account_ordering(settings),
+                    generate_nfo=generate_nfo, metrics=metrics),
+            refresh_workers
+        )
+        # The load stage waits briefly so one query covers several series
+        pipeline.add_stage("load", partial(self._load_stage, generate_nfo=generate_nfo, metrics=metrics), load_workers,
+                           batch_size=self.series_chunk_size, linger=0.2)
+        pipeline.add_stage(
+            "render",
+            partial(self._render_stage, dispatcharr_url=dispatcharr_url, generate_nfo=generate_nfo, metrics=metrics),
+            render_workers
+        )
+        pipeline.add_stage("write", partial(self._write_stage, writer=writer), write_workers)
+        pipeline.start()
+        # A batch refetches at most as many stale series as it creates, so a small
+        # batch doesn't wait on the provider for every generated series it walks past
+        updates = SeriesUpdateQueue(pipeline, refresh_workers * provider_connections,
+                                    revalidations=target_batch if batch_size != "all" else None)
+        unchecked = []  # Generated series waiting for their episode lists to be compared
+        cache_ttl = cache_ttl_hours * 3600
+        now = timezone.now()
+        # Progress counts created series towards a batch, or examined series for "all"
+        metrics.set_total(min(target_batch, relation_total), "series",
+                          lambda: counts["series_created"] if batch_size != "all" else counts["done"])
+        
+        try:
             for series_rel in series_relations:
-                # Stop submitting if we already have enough created
-                if batch_size != "all" and series_created >= target_batch:
+                if metrics.cancelled:
+                    logger.warning("Cancelled - finishing the series already in the pipeline")
                     break
+                # Stop once we've created enough for this batch. Series still in the pipeline
+                # count towards the target, and so do failures (retried on later clicks); series
+                # that are merely skipped don't.
+                if batch_size != "all":
+                    while in_flight and counts["series_created"] + counts["errors"] + in_flight >= target_batch:
+                        in_flight -= self._tally_series_result(pipeline.get(), counts, relation_total, logger,
+                                                               updates)
+                    if counts["series_created"] + counts["errors"] >= target_batch:
+                        break
+                last_examined = series_rel.id
                 
-                # Submit the processing task
-                future = executor.submit(
-                    self._process_single_series,
-                    series_rel,
-                    dispatcharr_url,
-                    generate_nfo,
-                    series_root,
-                    logger
-                )
-                futures[future] = series_rel
-                submitted += 1
-            
-            logger.info("Submitted %d series for parallel processing...", submitted)
-            logger.info("")
-            
-            # Process results as they complete
-            for idx, future in enumerate(as_completed(futures), 1):
-                series_rel = futures[future]
+                series_name, series_folder = self._series_paths(series_rel, series_root)
+                if shard and not shard.holds(os.path.basename(series_folder)):
+                    continue
+                # Relations that existed at the last sync are only returned because they changed
+                force = bool(sync and watermark and series_rel.id <= watermark["last_id"])
                 
-                try:
-                    result = future.result()
-                    
-                    if result.get("skipped"):
-                        skipped += 1
-                        logger.info("[%d/%d] %s", idx, submitted, result["message"])
-                    elif result.get("created"):
-                        series_created += 1
-                        created_strm += result["episodes"]
-                        created_nfo += result["nfo_files"]
-                        logger.info("[%d/%d] %s", idx, submitted, result["message"])
-                    else:
-                        # No episodes or other issue
-                        logger.info("[%d/%d] %s", idx, submitted, result["message"])
-                    
-                    if "error" in result:
-                        errors += 1
-                    
-                    # Stop if we've created enough
-                    if batch_size != "all" and series_created >= target_batch:
-                        logger.info("")
-                        logger.info("Batch target reached! Waiting for in-progress tasks...")
-                        
-                except Exception as e:
-                    logger.error("[%d/%d] Error processing series: %s", idx, submitted, e)
-                    errors += 1
+                cache_state = self._episode_cache_state(series_rel, cache_ttl, now)
+                
+                # Check if already processed (has Season folders with content)
+                claimed = series_folder in claimed_folders
+                if claimed or (
+                    not force and self._series_generated(manifest, snapshot, series_folder, series_rel, metrics)
+                ):
+                    counts["skipped"] += 1
+                    counts["done"] += 1
+                    logger.info("[%d/%d] %s - Already processed", counts["done"], relation_total, series_name)
+                    if claimed:
+                        continue
+                    claimed_folders.add(series_folder)
+                    # Its episode list is past the TTL: fetch it again in the background
+                    if cache_state == "stale":
+                        updates.add(self._series_update(series_rel, series_name, series_folder, revalidate=True))
+                    elif incremental:
+                        # Compared a page at a time, so checking costs one query per page
+                        unchecked.append((series_rel, series_name, series_folder))
+                        if len(unchecked) >= self.series_chunk_size:
+                            for job in self._changed_series(unchecked, manifest, snapshot, metrics):
+                                updates.add(job)
+                            unchecked = []
+                    continue
+                
+                claimed_folders.add(series_folder)
+                pipeline.put({
+                    "series_rel": series_rel,
+                    "series_name": series_name,
+                    "series_folder": series_folder,
+                    "op": "update" if force else "create",
+                    "stale": cache_state == "stale"
+                })
+                in_flight += 1
+                
+                for job in pipeline.poll():
+                    in_flight -= self._tally_series_result(job, counts, relation_total, logger, updates)
+            else:
+                exhausted = True
+            if unchecked and not metrics.cancelled:
+                for job in self._changed_series(unchecked, manifest, snapshot, metrics):
+                    updates.add(job)
+        except Exception as e:
+            # Pages are queried lazily as the loop asks for them, so database errors surface here
+            logger.error("Database query failed: %s", e)
+            return {"status": "error", "message": f"Database error: {e}"}
+        finally:
+            # Updates keep being queued while the last series finish
+            while in_flight or updates.active:
+                if metrics.cancelled:
+                    updates.cancel()
+                in_flight -= self._tally_series_result(pipeline.get(), counts, relation_total, logger, updates)
+            pipeline.close()
+            pipeline.join()
+            if manifest:
+                manifest.close()
+            if not shard:
+                self._release_staging_root(staging_root)
+        
+        series_created = counts["series_created"]
+        skipped = counts["skipped"]
+        created_strm = counts["created_strm"]
+        created_nfo = counts["created_nfo"]
+        errors = counts["errors"]
+        
+        if sync and errors == 0 and not metrics.cancelled and not shard:
+            self._write_watermark(series_root, "series", new_watermark)
+        if batch_size != "all":
+            self._save_cursor(series_root, "series", cursor, last_examined, counts["failed_ids"] + retry_later,
+                              exhausted, logger)
         
         logger.info("")
         logger.info("=" * 60)
         logger.info("SUMMARY:")
         logger.info("  Series created: %d", series_created)
         logger.info("  Series skipped: %d", skipped)
+        logger.info("  Series refreshed: %d (%d failed)", counts["revalidated"], counts["revalidation_errors"])
+        if updates.deferred:
+            logger.info("  Stale series left for a later run: %d", updates.deferred)
+        logger.info("  Series with new episodes: %d (%d failed)", counts["series_updated"], counts["update_errors"])
         logger.info("  Episodes created: %d", created_strm)
         if generate_nfo:
             logger.info("  NFO files created: %d", created_nfo)
+        logger.info("  Files written: %d new, %d updated, %d unchanged",
+                    writer.counts["written"], writer.counts["updated"], writer.counts["unchanged"])
+        logger.info("  Folders created: %d", writer.dirs_created)
+        if staging_root:
+            logger.info("  Folders published: %d", writer.published)
         logger.info("  Errors: %d", errors)
         logger.info("=" * 60)
         
         summary_msg = f"Created {series_created} series with {created_strm} episodes"
         if generate_nfo:
             summary_msg += f" + {created_nfo} NFO files"
+        if metrics.cancelled:
+            summary_msg = f"Cancelled - {summary_msg}"
+        
+        return {
+            "status": "ok",
+            "message": summary_msg,
+            "cancelled": metrics.cancelled,
+            "series_processed": series_created,
+            "series_refreshed": counts["revalidated"],
+            "refresh_errors": counts["revalidation_errors"],
+            "series_updated": counts["series_updated"],
+            "update_errors": counts["update_errors"],
+            "episodes_created": created_strm,
+            "nfo_created": created_nfo if generate_nfo else 0,
+            "files_written": writer.counts["written"],
+            "files_updated": writer.counts["updated"],
+            "files_unchanged": writer.counts["unchanged"],
+            "dirs_created": writer.dirs_created,
+            "folders_published": writer.published,
+            "errors": errors
+        }
+    
+    def _staging_root(self, root_folder: str, settings: Dict[str, Any], shard: Optional[Shard], logger) -> Optional[str]:
+        """Return the staging folder new item folders are built in, or None to write in place.
+        
+        It lives under the root folder, so publishing is a rename on the same
+        filesystem. Leftovers of an interrupted run are removed first (by the
+        parent only, before any shard starts).
+        """
+        if not settings.get("staged_publish", False):
+            return None
+        staging_root = os.path.join(root_folder, STAGING_DIRNAME)
+        if shard is None and os.path.isdir(staging_root):
+            logger.info("Removing unfinished folders from the staging area")
+            shutil.rmtree(staging_root, ignore_errors=True)
+        os.makedirs(staging_root, exist_ok=True)
+        return staging_root
+    
+    def _release_staging_root(self, staging_root: Optional[str]):
+        """Remove the staging folder once the run left nothing in it.
+        
+        Only called by the parent, after every shard finished, so no shard
+        loses the folder while it still builds items there.
+        """
+        if staging_root:
+            try:
+                os.rmdir(staging_root)
+            except OSError:
+                pass  # Not empty (e.g. a failed item) - the next run clears it
+    
+    def _shard_processes(self, settings: Dict[str, Any], batch_size: str, logger) -> int:
+        """Return how many processes to split this run over (1 = no sharding)."""
+        processes = min(self._int_setting(settings, "generation_processes", 1), os.cpu_count() or 1)
+        if processes <= 1:
+            return 1
+        if batch_size != "all":
+            logger.info("Generation processes only apply to All and Sync runs - running this batch in one process")
+            return 1
+        if "fork" not in multiprocessing.get_all_start_methods():
+            logger.warning("Generation processes need fork (Linux) - running in one process")
+            return 1
+        return processes
+    
+    def _generate_sharded(self, kind: str, settings: Dict[str, Any], logger, sync: bool, metrics: RunMetrics,
+                          processes: int, query, total: int) -> dict:
+        """Run a movies/series generation as one forked process per shard and merge their results.
+        
+        The parent assigns the relations of ``query`` to shards once, by folder
+        name; each shard then fetches and renders only its own, so CPU-bound
+        rendering uses several cores. The parent forwards cancellation, sums
+        the shards' progress and folds their metrics into ``metrics``.
+        """
+        if kind == "movies":
+            generate, root_folder = self._generate_movies, settings.get("root_folder", "/VODS/Movies")
+        else:
+            generate, root_folder = self._generate_series, settings.get("series_root_folder", "/VODS/Series")
+        logger.info("Splitting %d %s over %d processes", total, kind, processes)
+        
+        if settings.get("use_manifest", True):
+            # Create or migrate the manifest once, before the shards open it at the same time
+            manifest = GenerationManifest.open(root_folder, logger)
+            if manifest:
+                manifest.close()
+        
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        cancel = context.Event()
+        progress = context.Array('q', processes, lock=False)
+        provider_slots = self._provider_slots(context, settings) if kind == "series" else None
+        metrics.set_total(total, kind, lambda: sum(progress))
+        assigned = self._assign_shards(kind, query, root_folder, processes, metrics, logger)
+        
+        # The children must open their own database connections
+        _close_db_connection()
+        workers = {}
+        for index in range(processes):
+            shard = Shard(index, processes, provider_slots, assigned[index])
+            worker = context.Process(
+                target=self._run_shard, args=(generate, settings, logger, sync, shard, results, cancel, progress),
+                name=f"vod2mlib-{kind}-{index}", daemon=True
+            )
+            worker.start()
+            workers[index] = worker
+        
+        shard_results = {}
+        while len(shard_results) < processes:
+            if metrics.cancelled:
+                cancel.set()
+            try:
+                index, result, shard_metrics, shard_changes = results.get(timeout=0.5)
+            except queue.Empty:
+                # A shard killed before reporting (e.g. out of memory) counts as failed
+                for index, worker in workers.items():
+                    if index not in shard_results and worker.exitcode not in (None, 0):
+                        logger.error("Shard %d exited with code %s", index, worker.exitcode)
+                        shard_results[index] = {"status": "error", "errors": 1,
+                                                "message": f"process exited with code {worker.exitcode}"}
+                continue
+            shard_results[index] = result
+            metrics.merge(shard_metrics, shard_changes)
+        for worker in workers.values():
+            worker.join()
+        
+        result = self._merge_shard_results(kind, [shard_results[index] for index in range(processes)], settings)
+        logger.info("")
+        logger.info("All %d shards finished: %s", processes, result["message"])
+        return result
+    
+    def _assign_shards(self, kind: str, query, root_folder: str, processes: int, metrics: RunMetrics, logger) -> list:
+        """Split the relation ids of a sharded run over its shards by folder name.
+        
+        One pass over just the columns that name a folder, so titles are cleaned
+        once for the whole run and the shards fetch nothing they don't render.
+        """
+        started = time.monotonic()
+        assigned = [array('q') for _ in range(processes)]
+        projection = _MOVIE_KEYS if kind == "movies" else _SERIES_KEYS
+        for row in self._iter_relations(query, metrics=metrics, fetch=projection.fetch):
+            if kind == "movies":
+                folder_name = self._movie_paths(row, root_folder)[1]
+            else:
+                folder_name = os.path.basename(self._series_paths(row, root_folder)[1])
+            assigned[Shard.slot(folder_name, processes)].append(row.id)
+        logger.info("Assigned %d %s to %d shards in %.1fs", sum(len(ids) for ids in assigned), kind, processes,
+                    time.monotonic() - started)
+        return assigned
+    
+    def _run_shard(self, generate, settings: Dict[str, Any], logger, sync: bool, shard: Shard,
+                   results, cancel, progress):
+        """Body of a shard process: generate one slice and send the result and metrics to the parent."""
+        metrics = RunMetrics(generate.__name__.lstrip("_"))
+        threading.Thread(target=self._watch_shard, args=(metrics, shard, cancel, progress), daemon=True).start()
+        try:
+            result = generate(settings, logger, sync=sync, metrics=metrics, shard=shard)
+        except Exception as e:
+            logger.error("Shard %d failed: %s", shard.index, e)
+            result = {"status": "error", "message": str(e), "errors": 1}
+        finally:
+            _close_db_connection()
+        metrics.finish()
+        progress[shard.index] = metrics.progress()["done"]
+        results.put((shard.index, result, metrics.as_dict(), metrics.changes))
+    
+    def _watch_shard(self, metrics: RunMetrics, shard: Shard, cancel, progress):
+        """Thread in a shard process: publish its progress and pass the parent's cancel on."""
+        while metrics.duration is None:
+            if cancel.wait(0.5):
+                metrics.cancel()
+                return
+            progress[shard.index] = metrics.progress()["done"]
+    
+    def _provider_slots(self, context, settings: Dict[str, Any]) -> dict:
+        """One semaphore per M3U account, so the connection limit holds across shard processes."""
+        from apps.m3u.models import M3UAccount
+        
+        connections = self._int_setting(settings, "provider_max_connections", 2)
+        return {
+            account_id: context.BoundedSemaphore(connections)
+            for account_id in M3UAccount.objects.values_list('id', flat=True)
+        }
+    
+    def _merge_shard_results(self, kind: str, results: list, settings: Dict[str, Any]) -> dict:
+        """Combine the shards' result dicts into the shape a single-process run returns."""
+        merged = {"status": "ok", "message": "", "cancelled": False}
+        failures = []
+        for index, result in enumerate(results):
+            if result.get("status") != "ok":
+                failures.append(f"shard {index}: {result.get('message')}")
+            for key, value in result.items():
+                if key == "cancelled":
+                    merged[key] = merged[key] or value
+                elif key == "total_in_db":
+                    merged[key] = value  # The whole catalog, the same in every shard
+                elif isinstance(value, int) and key not in ("status", "message"):
+                    merged[key] = merged.get(key, 0) + value
+        
+        # Same wording as the single-process summaries
+        if kind == "movies":
+            message = f"Created {merged.get('created_strm', 0)} .strm files"
+            if settings.get("generate_nfo", True):
+                message += f" + {merged.get('created_nfo', 0)} .nfo files"
+        else:
+            message = f"Created {merged.get('series_processed', 0)} series with {merged.get('episodes_created', 0)} episodes"
+            if settings.get("generate_series_nfo", True):
+                message += f" + {merged.get('nfo_created', 0)} NFO files"
+        if merged["cancelled"]:
+            message = f"Cancelled - {message}"
+        if failures:
+            merged["status"] = "error"
+            message += " - " + "; ".join(failures)
+        merged["message"] = message
+        merged["shards"] = len(results)
+        return merged
+    
+    def _int_setting(self, settings: Dict[str, Any], key: str, default: int, minimum: int = 1) -> int:
+        """Read a numeric setting, falling back to the default for blank or invalid values."""
+        value = settings.get(key)
+        if value is None or value == "":
+            return default
+        try:
+            return max(minimum, int(value))
+        except (TypeError, ValueError):
+            return default
+    
+    def _preferred_relations(self, query, relation_model, item_field: str, settings: Dict[str, Any]):
+        """Keep only one relation per movie/series: the one from the preferred account.
+        
+        Accounts listed in the Provider Priority setting win in that order, then
+        the account's own priority, then the oldest relation.
+        """
+        from django.db.models import OuterRef, Subquery
+        
+        best = relation_model.objects.filter(
+            **{item_field: OuterRef(item_field)}
+        ).order_by(*self._account_ordering(settings)).values('id')[:1]
+        return query.filter(id=Subquery(best))
+    
+    def _account_ordering(self, settings: Dict[str, Any]) -> list:
+        """Build the ORDER BY used to pick the preferred provider relation."""
+        from django.db.models import Case, F, IntegerField, Q, Value, When
+        
+        ordering = []
+        preferred = [name.strip() for name in (settings.get("account_priority") or "").split(",") if name.strip()]
+        if preferred:
+            whens = []
+            for rank, name in enumerate(preferred):
+                condition = Q(m3u_account__name__iexact=name)
+                if name.isdigit():
+                    condition |= Q(m3u_account_id=int(name))
+                whens.append(When(condition, then=Value(rank)))
+            ordering.append(Case(*whens, default=Value(len(preferred)), output_field=IntegerField()).asc())
+        ordering += [F('m3u_account__priority').desc(nulls_last=True), 'id']
+        return ordering
+    
+    def _iter_relations(self, query, chunk_size: int = None, metrics: Optional[RunMetrics] = None, fetch=list):
+        """Iterate a relation queryset in id order using keyset pagination.
+        
+        Only one page of rows is alive at a time, unlike list(query). ``fetch``
+        turns a page queryset into rows (e.g. a RowProjection's fetch); rows
+        need an ``id``.
+        """
+        chunk_size = chunk_size or self.stream_chunk_size
+        metrics = metrics or RunMetrics()
+        query = query.order_by('id')
+        last_id = None
+        while True:
+            page_query = query if last_id is None else query.filter(id__gt=last_id)
+            with metrics.timer("query"):
+                page = fetch(page_query[:chunk_size])
+            yield from page
+            if len(page) < chunk_size:
+                return
+            last_id = page[-1].id
+    
+    def _iter_assigned(self, query, ids, metrics: RunMetrics, fetch):
+        """Iterate the rows of a relation queryset with the given ids (ascending), a page of ids per query."""
+        for start in range(0, len(ids), self.stream_chunk_size):
+            page_ids = ids[start:start + self.stream_chunk_size].tolist()
+            with metrics.timer("query"):
+                page = fetch(query.filter(id__in=page_ids).order_by('id'))
+            yield from page
+    
+    def _resume_batch(self, query, root_folder: str, key: str, total: int, metrics, logger):
+        """Narrow a batch query to relations after the persisted cursor.
+        
+        Returns (query, cursor, remaining). Once the cursor has passed the last
+        relation the batch starts over from the beginning.
+        """
+        cursor = self._load_state(root_folder).get(f"{key}_cursor") or 0
+        if not cursor:
+            return query, 0, total
+        
+        resumed = query.filter(id__gt=cursor)
+        with metrics.timer("query"):
+            remaining = resumed.count()
+        if not remaining:
+            logger.info("Reached the end of the catalog - starting over from the beginning")
+            return query, 0, total
+        logger.info("Resuming after relation id %d (%d of %d left)", cursor, remaining, total)
+        return resumed, cursor, remaining
+    
+    def _batch_retries(self, query, root_folder: str, key: str, fetch, metrics, logger):
+        """Return (rows to retry now, ids left for later clicks) of relations that failed in earlier batches.
+        
+        At most ``batch_retries`` are retried per click; relations that are gone
+        from the query are dropped.
+        """
+        retry = self._load_state(root_folder).get(f"{key}_retry") or []
+        if not retry:
+            return [], []
+        with metrics.timer("query"):
+            rows = fetch(query.filter(id__in=retry[:self.batch_retries]).order_by('id'))
+        logger.info("Retrying %d relations that failed in earlier batches (%d more waiting)",
+                    len(rows), len(retry[self.batch_retries:]))
+        return rows, retry[self.batch_retries:]
+    
+    def _save_cursor(self, root_folder: str, key: str, cursor: int, last_examined, failed_ids: list,
+                     exhausted: bool, logger):
+        """Persist where the next batch run resumes, and which relations it retries first.
+        
+        The cursor moves past failed relations; they are kept in a retry list
+        instead (up to ``batch_retry_limit``). Once the whole catalog has been
+        examined the cursor wraps to the start, and the next pass visits them
+        anyway.
+        """
+        # Retried relations lie before the cursor, so a click that only retried keeps it
+        new_cursor = max(cursor, last_examined or 0)
+        retry = sorted(set(failed_ids))[:self.batch_retry_limit]
+        if exhausted:
+            new_cursor, retry = 0, []
+        try:
+            self._save_state(root_folder, {f"{key}_cursor": new_cursor, f"{key}_retry": retry})
+        except OSError as e:
+            logger.warning("Could not save batch position: %s", e)
+    
+    def _movie_paths(self, relation, root_folder: str):
+        """Return (clean movie name, folder name, folder path, .strm path) for a movie row."""
+        # Build movie name with year (clean language prefix)
+        raw_name = relation.name or f"Unknown Movie {relation.movie_id}"
+        movie_name = self._clean_title(raw_name)
+        year = relation.year
+        
+        safe_name = self._sanitize_filename(movie_name)
+        folder_name = f"{safe_name} ({year})" if year else safe_name
+        movie_folder = os.path.join(root_folder, folder_name)
+        return movie_name, folder_name, movie_folder, os.path.join(movie_folder, f"{folder_name}.strm")
+    
+    def _episode_path(self, series_name: str, series_folder: str, episode):
+        """Return (season folder, file path without extension) for an episode."""
+        season_num = episode.season_number or 0
+        episode_num = episode.episode_number or 0
+        season_folder = os.path.join(series_folder, f"Season {season_num:02d}")
+        
+        # Build episode filename
+        episode_title = episode.name or ""
+        if episode_title:
+            clean_title = self._clean_title(episode_title)
+            filename = f"{series_name} - S{season_num:02d}E{episode_num:02d} - {clean_title}"
+        else:
+            filename = f"{series_name} - S{season_num:02d}E{episode_num:02d}"
+        
+        return season_folder, os.path.join(season_folder, self._sanitize_filename(filename))
+    
+    def _series_paths(self, series_rel, series_root: str):
+        """Return (clean series name, series folder path) for a series row."""
+        # Clean series name
+        raw_name = series_rel.name or f"Unknown Series {series_rel.series_id}"
+        series_name = self._clean_title(raw_name)
+        year = series_rel.year
+        
+        if year:
+            series_folder_name = f"{self._sanitize_filename(series_name)} ({year})"
+        else:
+            series_folder_name = self._sanitize_filename(series_name)
+        
+        return series_name, os.path.join(series_root, series_folder_name)
+    
+    def _plan_movie(self, relation, movie_folder: str, strm_path: str, dispatcharr_url: str,
+                    generate_nfo: bool, op: str = "create") -> list:
+        """Return the operations that generate one movie: its folder, .strm and optional .nfo."""
+        proxy_url = f"{dispatcharr_url}/proxy/vod/movie/{relation.uuid}?stream_id={relation.stream_id}"
+        operations = [
+            PlanOperation(op, "folder", movie_folder, movie_folder),
+            PlanOperation(op, "movie", strm_path, movie_folder, proxy_url,
+                          relation.id, relation.uuid, relation.stream_id),
+        ]
+        if generate_nfo:
+            nfo_content = self._generate_nfo(relation, relation.category_name or "")
+            operations.append(PlanOperation(op, "nfo", strm_path[:-len('.strm')] + '.nfo', movie_folder, nfo_content))
+        return operations
+    
+    def _plan_series_files(self, series_rel, series_name: str, series_folder: str, episodes: list,
+                           dispatcharr_url: str, generate_nfo: bool, op: str = "create",
+                           existing: Optional[set] = None, tvshow: bool = True,
+                           fingerprint: Optional[str] = None) -> list:
+        """Return the operations that generate one series.
+        
+        Folders come first, then tvshow.nfo and the episode files by season;
+        the last operation records the series (with the fingerprint of its
+        episode list), so a series that failed half way is not taken as
+        generated. Episodes whose .strm path is in ``existing`` are left out.
+        """
+        folders = [PlanOperation(op, "folder", series_folder, series_folder)]
+        files = []
+        
+        # Generate tvshow.nfo if enabled
+        if generate_nfo and tvshow:
+            tvshow_nfo = self._generate_tvshow_nfo(series_rel, series_rel.category_name or "")
+            files.append(PlanOperation(op, "nfo", os.path.join(series_folder, "tvshow.nfo"), series_folder, tvshow_nfo))
+        
+        # Process episodes by season
+        for episode in episodes:
+            season_folder, base_path = self._episode_path(series_name, series_folder, episode)
+            if existing and f"{base_path}.strm" in existing:
+                continue
+            if season_folder != folders[-1].path:
+                folders.append(PlanOperation(op, "folder", season_folder, series_folder))
+            
+            # .strm file
+            proxy_url = f"{dispatcharr_url}/proxy/vod/episode/{episode.uuid}?stream_id={episode.stream_id}"
+            files.append(PlanOperation(op, "episode", f"{base_path}.strm", series_folder, proxy_url,
+                                       episode.id, episode.uuid, episode.stream_id))
+            
+            # Episode .nfo if enabled
+            if generate_nfo:
+                files.append(PlanOperation(op, "nfo", f"{base_path}.nfo", series_folder,
+                                           self._generate_episode_nfo(episode)))
+        
+        record = PlanOperation(op, "series", series_folder, series_folder, None, series_rel.id, series_rel.uuid,
+                               digest=fingerprint)
+        return folders + files + [record]
+    
+    def _tally_series_result(self, job, counts, relation_total, logger,
+                             updates: Optional[SeriesUpdateQueue] = None) -> int:
+        """Update the run counters from a series that left the pipeline and log it.
+        
+        Returns 1 for a generation job, 0 for a background update.
+        """
+        if job.get("update"):
+            updates.finished()
+            if job.get("revalidate"):
+                if "error" in job:
+                    counts["revalidation_errors"] += 1
+                    logger.warning("[refresh] %s - ✗ Could not refresh episodes: %s", job["series_name"], job["error"])
+                elif job.get("created"):
+                    counts["revalidated"] += 1
+                    logger.info("[refresh] %s - ✓ Refreshed, %d new or changed episodes", job["series_name"], job["episodes"])
+            elif "error" in job:
+                counts["update_errors"] += 1
+                logger.warning("[update] %s - ✗ Could not add new episodes: %s", job["series_name"], job["error"])
+            elif job.get("episodes"):
+                counts["series_updated"] += 1
+                counts["created_strm"] += job["episodes"]
+                counts["created_nfo"] += job["nfo_files"]
+                logger.info("[update] %s - ✓ Added %d new episodes", job["series_name"], job["episodes"])
+            return 0
+        
+        # Written from a stale episode list: fetch it again and rewrite what changed
+        if job.get("stale") and updates and "error" not in job and not job.get("cancelled"):
+            updates.add(self._series_update(job["series_rel"], job["series_name"], job["series_folder"],
+                                            revalidate=True))
+        counts["done"] += 1
+        if job.get("created"):
+            counts["series_created"] += 1
+            counts["created_strm"] += job["episodes"]
+            counts["created_nfo"] += job["nfo_files"]
+        if "error" in job:
+            counts["errors"] += 1
+        if "error" in job or job.get("cancelled"):
+            # Retried by a later batch
+            counts["failed_ids"].append(job["series_rel"].id)
+        message = job.get("message") or f"{job['series_name']} - ✗ Error: {job.get('error')}"
+        logger.info("[%d/%d] %s", counts["done"], relation_total, message)
+        return 1
+    
+    def _refresh_stage(self, jobs, gate, ordering, generate_nfo, metrics):
+        """Pipeline stage: fetch episodes from providers (network-bound).
+        
+        A job whose account is at its connection limit is parked with the gate
+        instead of blocking this worker; the worker that frees the account's
+        slot runs and forwards it. Jobs are yielded as soon as they are fetched.
+        When a fetch fails or finds no episodes, the job moves on to the series'
+        next-ranked relation from another account (see ``_fallback_relation``).
+        """
+        pending = deque(jobs)
+        while pending:
+            job = pending.popleft()
+            if metrics.cancelled:
+                self._cancel_series(job)
+                yield job
+                continue
+            if not self._needs_refresh(job):
+                yield job
+                continue
+            
+            account_id = job["series_rel"].m3u_account_id
+            if not gate.claim(account_id, job):
+                continue
+            while job is not None:
+                if metrics.cancelled:
+                    self._cancel_series(job)
+                    yield job
+                else:
+                    series_rel = job["series_rel"]
+                    error = None
+                    try:
+                        gate.call(account_id, partial(self._refresh_episodes, series_rel, metrics))
+                    except Exception as e:
+                        error = e
+                    if error is None and self._has_episodes(series_rel):
+                        yield job
+                    else:
+                        # Background updates stay with the relation their series was written from
+                        fallback = None if job.get("update") else self._fallback_relation(
+                            job, gate, ordering, generate_nfo
+                        )
+                        if fallback is not None:
+                            # Picked up by this worker once the account's slot is free
+                            metrics.count("provider_fallbacks")
+                            job["series_rel"] = fallback
+                            pending.append(job)
+                        else:
+                            if error is not None:
+                                self._fail_series(job, error)
+                            yield job
+                job = gate.release(account_id)
+    
+    def _has_episodes(self, series_rel) -> bool:
+        """Check whether a series' provider delivered any episode relations."""
+        from apps.vod.models import M3UEpisodeRelation
+        
+        return M3UEpisodeRelation.objects.filter(
+            m3u_account_id=series_rel.m3u_account_id, episode__series_id=series_rel.series_id
+        ).exists()
+    
+    def _fallback_relation(self, job, gate, ordering, generate_nfo):
+        """Return the series' next-ranked relation from an account the job hasn't tried, or None.
+        
+        Relations are ranked like the preferred one, except that accounts whose
+        circuit breaker is open come last.
+        """
+        from apps.vod.models import M3USeriesRelation
+        
+        series_rel = job["series_rel"]
+        tried = job.setdefault("tried_accounts", set())
+        tried.add(series_rel.m3u_account_id)
+        candidates = _SERIES_ROWS.fetch(
+            M3USeriesRelation.objects.filter(series_id=series_rel.series_id)
+            .exclude(m3u_account_id__in=tried).order_by(*ordering),
+            nfo=generate_nfo
+        )
+        if not candidates:
+            return None
+        # Stable, so the account ranking holds among the healthy and among the failing
+        candidates.sort(key=lambda row: gate.is_open(row.m3u_account_id))
+        return candidates[0]
+    
+    def _needs_refresh(self, job) -> bool:
+        """Check whether a series' episodes have to be fetched from its provider before writing."""
+        return bool(job.get("revalidate")) or not job["series_rel"].episodes_fetched
+    
+    def _episode_cache_state(self, series_rel, ttl: int, now) -> str:
+        """Return "missing", "fresh" or "stale" for a series' fetched episode list.
         
-        return {
-            "status": "ok",
-            "message": summary_msg,
-            "series_processed": series_created,
-            "episodes_created": created_strm,
-            "nfo_created": created_nfo if generate_nfo else 0,
-            "errors": errors
-        }
+        A list is stale once it is ``ttl`` seconds old (never with a ttl of 0);
+        one fetched before fetch times were kept counts as stale.
+        """
+        if not series_rel.episodes_fetched:
+            return "missing"
+        if not ttl:
+            return "fresh"
+        fetched = series_rel.last_fetched
+        if fetched is None or (now - fetched).total_seconds() >= ttl:
+            return "stale"
+        return "fresh"
+    
+    def _series_update(self, series_rel, series_name: str, series_folder: str, **fields) -> dict:
+        """Return a background update job for an already generated series."""
+        job = {"series_rel": series_rel, "series_name": series_name, "series_folder": series_folder, "op": "update"}
+        job.update(fields)
+        return job
+    
+    def _changed_series(self, candidates: list, manifest, snapshot, metrics) -> list:
+        """Return incremental update jobs for the generated series whose episode list changed.
+        
+        ``candidates`` are (series_rel, series_name, series_folder). One query
+        fingerprints all their episode lists. With a manifest, the fingerprint
+        is compared with the one recorded when the series was written and only
+        newer relations are loaded; without one, the episode count is compared
+        with the .strm files on disk (from the snapshot, or listed per series
+        in batch runs) and episodes already there are left out.
+        """
+        with metrics.timer("query"):
+            fingerprints = self._episode_fingerprints([series_rel for series_rel, _, _ in candidates])
+        jobs = []
+        for series_rel, series_name, series_folder in candidates:
+            count, last_id = fingerprints.get((series_rel.m3u_account_id, series_rel.series_id), (0, None))
+            if not count:
+                continue
+            fingerprint = _episode_fingerprint(count, last_id)
+            if manifest:
+                recorded = manifest.kind_digest("series", series_folder)
+                if recorded == fingerprint:
+                    continue
+                # Written before fingerprints were kept: every episode is compared once
+                fields = {"since_id": int(recorded.split(":")[1]) if recorded else None}
+            else:
+                if snapshot is not None:
+                    on_disk = snapshot.episode_counts.get(series_folder, 0)
+                else:
+                    metrics.count("stat")
+                    on_disk = len(_scan_series_episodes(series_folder) or ())
+                if on_disk >= count:
+                    continue
+                fields = {"skip_existing": True}
+            jobs.append(self._series_update(series_rel, series_name, series_folder, incremental=True,
+                                            fingerprint=fingerprint, **fields))
+        return jobs
     
-    def _process_single_series(self, series_rel, dispatcharr_url, generate_nfo, series_root, logger):
-        """Process a single series - fetches episodes and creates files (thread-safe)."""
+    def _episode_fingerprints(self, series_rels) -> dict:
+        """Count the episode relations of a batch of series (and find the newest) with one query.
+        
+        Returns (count, highest relation id) keyed by (account id, series id).
+        """
+        from django.db.models import Count, Max
         from apps.vod.models import M3UEpisodeRelation
+        
+        wanted = {(rel.m3u_account_id, rel.series_id) for rel in series_rels}
+        if not wanted:
+            return {}
+        # Filtered on the series alone so the query walks the series index;
+        # counts of other accounts' relations are dropped below
+        rows = M3UEpisodeRelation.objects.filter(
+            episode__series_id__in={series_id for _, series_id in wanted}
+        ).values('m3u_account_id', 'episode__series_id').annotate(
+            episode_count=Count('id'), last_id=Max('id')
+        ).order_by()
+        fingerprints = {}
+        for row in rows:
+            key = (row['m3u_account_id'], row['episode__series_id'])
+            if key in wanted:
+                fingerprints[key] = (row['episode_count'], row['last_id'])
+        return fingerprints
+    
+    def _refresh_episodes(self, series_rel, metrics):
+        """Fetch a series' episodes from its provider."""
+        from django.utils import timezone
+        from apps.vod.models import M3USeriesRelation
         from apps.vod.tasks import refresh_series_episodes
         
-        series = series_rel.series
+        # The refresh task takes model instances; only series being fetched load them
+        relation = M3USeriesRelation.objects.select_related('series', 'm3u_account').get(id=series_rel.id)
+        started = time.perf_counter()
+        try:
+            refresh_series_episodes(
+                account=relation.m3u_account,
+                series=relation.series,
+                external_series_id=relation.external_series_id
+            )
+            # Starts the episode cache TTL (update() leaves updated_at, and so Sync, alone)
+            M3USeriesRelation.objects.filter(id=series_rel.id).update(last_episode_refresh=timezone.now())
+        except Exception:
+            metrics.count("refresh_failures")
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.add_time("refresh", elapsed)
+            metrics.observe_refresh(series_rel.account_name or str(series_rel.m3u_account_id), elapsed)
+    
+    def _load_stage(self, jobs, generate_nfo, metrics):
+        """Pipeline stage: load episode rows for every queued series with one query.
         
-        # Clean series name
-        raw_name = series.name or f"Unknown Series {series.id}"
-        series_name = self._clean_title(raw_name)
-        year = series.year
+        Incremental updates only load the relations newer than the ones their
+        series was written from.
+        """
+        since = {
+            (job["series_rel"].m3u_account_id, job["series_rel"].series_id): job["since_id"]
+            for job in jobs if job.get("since_id")
+        }
+        with metrics.timer("load"):
+            episodes_by_series = self._load_batch_episodes([job["series_rel"] for job in jobs], generate_nfo, since)
+        for job in jobs:
+            series_rel = job["series_rel"]
+            episodes = episodes_by_series.get((series_rel.m3u_account_id, series_rel.series_id), [])
+            job["episodes"] = episodes
+            if episodes and "fingerprint" not in job:
+                job["fingerprint"] = _episode_fingerprint(len(episodes), max(episode.id for episode in episodes))
+    
+    def _load_batch_episodes(self, series_rels, generate_nfo: bool = False, since: Optional[dict] = None) -> dict:
+        """Fetch episode rows for a batch of series in one query.
         
-        if year:
-            series_folder_name = f"{self._sanitize_filename(series_name)} ({year})"
-        else:
-            series_folder_name = self._sanitize_filename(series_name)
+        Returns lists keyed by (account id, series id), sorted by season and
+        episode number. ``since`` maps some of those keys to a relation id;
+        only newer relations are returned for them.
+        """
+        from django.db.models import F, Q
+        from apps.vod.models import M3UEpisodeRelation
+        
+        wanted = {(rel.m3u_account_id, rel.series_id) for rel in series_rels}
+        grouped = {}
+        if not wanted:
+            return grouped
         
-        series_folder = os.path.join(series_root, series_folder_name)
+        episodes = M3UEpisodeRelation.objects.filter(
+            m3u_account_id__in={account_id for account_id, _ in wanted},
+            episode__series_id__in={series_id for _, series_id in wanted}
+        ).order_by(
+            F('episode__season_number').asc(nulls_first=True),
+            F('episode__episode_number').asc(nulls_first=True),
+            'id'
+        )
+        if since:
+            older = Q()
+            for (account_id, series_id), last_id in since.items():
+                older |= Q(m3u_account_id=account_id, episode__series_id=series_id, id__lte=last_id)
+            episodes = episodes.exclude(older)
         
-        # Check if already processed (has Season folders with content)
-        if os.path.exists(series_folder):
+        for episode_rel in _EPISODE_ROWS.fetch(episodes, generate_nfo):
+            key = (episode_rel.m3u_account_id, episode_rel.series_id)
+            # The account/series filters can match pairs outside the batch
+            if key in wanted:
+                grouped.setdefault(key, []).append(episode_rel)
+        
+        return grouped
+    
+    def _render_stage(self, jobs, dispatcharr_url, generate_nfo, metrics):
+        """Pipeline stage: build folder list, file names and .strm/.nfo contents (CPU-bound)."""
+        for job in jobs:
             try:
-                has_seasons = any(
-                    item.startswith("Season") and os.path.isdir(os.path.join(series_folder, item))
-                    for item in os.listdir(series_folder)
-                )
-                if has_seasons:
-                    return {
-                        "created": False,
-                        "skipped": True,
-                        "series_name": series_name,
-                        "episodes": 0,
-                        "nfo_files": 0,
-                        "message": f"{series_name} - Already processed"
-                    }
-            except:
-                pass  # If error checking, process anyway
+                with metrics.timer("render"):
+                    self._render_series(job, dispatcharr_url, generate_nfo)
+            except Exception as e:
+                self._fail_series(job, e)
+    
+    def _render_series(self, job, dispatcharr_url, generate_nfo):
+        """Plan every folder and file of one series into job["operations"].
         
-        try:
-            # Fetch episodes for this series
-            custom_props = series_rel.custom_properties or {}
-            if not custom_props.get('episodes_fetched', False):
-                refresh_series_episodes(
-                    account=series_rel.m3u_account,
-                    series=series_rel.series,
-                    external_series_id=series_rel.external_series_id
-                )
-            
-            # Get episodes for this series
-            episodes = M3UEpisodeRelation.objects.filter(
-                m3u_account=series_rel.m3u_account
-            ).select_related('episode')
-            
-            # Filter to only episodes belonging to this series
-            episodes = [ep for ep in episodes if ep.episode.series and ep.episode.series.id == series.id]
-            
-            # Sort by season and episode number
-            episodes = sorted(episodes, key=lambda ep: (ep.episode.season_number or 0, ep.episode.episode_number or 0))
-            
-            episode_count = len(episodes)
-            
-            if episode_count == 0:
-                return {
-                    "created": False,
-                    "skipped": False,
-                    "series_name": series_name,
-                    "episodes": 0,
-                    "nfo_files": 0,
-                    "message": f"{series_name} - No episodes found"
-                }
-            
-            # Create series folder
-            os.makedirs(series_folder, exist_ok=True)
-            
-            nfo_count = 0
-            
-            # Generate tvshow.nfo if enabled
-            if generate_nfo:
-                tvshow_nfo_path = os.path.join(series_folder, "tvshow.nfo")
-                category_name = series_rel.category.name if series_rel.category else ""
-                tvshow_content = self._generate_tvshow_nfo(series, category_name)
-                with open(tvshow_nfo_path, 'w', encoding='utf-8') as f:
-                    f.write(tvshow_content)
-                nfo_count += 1
-            
-            # Process episodes by season
-            for episode_rel in episodes:
-                episode = episode_rel.episode
-                season_num = episode.season_number or 0
-                episode_num = episode.episode_number or 0
-                
-                # Create season folder
-                season_folder_name = f"Season {season_num:02d}"
-                season_folder = os.path.join(series_folder, season_folder_name)
-                os.makedirs(season_folder, exist_ok=True)
-                
-                # Build episode filename
-                episode_title = episode.name or ""
-                if episode_title:
-                    clean_title = self._clean_title(episode_title)
-                    filename = f"{series_name} - S{season_num:02d}E{episode_num:02d} - {clean_title}"
-                else:
-                    filename = f"{series_name} - S{season_num:02d}E{episode_num:02d}"
-                
-                filename = self._sanitize_filename(filename)
-                
-                # Create .strm file
-                strm_path = os.path.join(season_folder, f"{filename}.strm")
-                proxy_url = f"{dispatcharr_url}/proxy/vod/episode/{episode.uuid}?stream_id={episode_rel.stream_id}"
-                
-                with open(strm_path, 'w', encoding='utf-8') as f:
-                    f.write(proxy_url)
-                
-                # Create episode .nfo if enabled
-                if generate_nfo:
-                    nfo_path = os.path.join(season_folder, f"{filename}.nfo")
-                    episode_nfo_content = self._generate_episode_nfo(episode)
-                    with open(nfo_path, 'w', encoding='utf-8') as f:
-                        f.write(episode_nfo_content)
-                    nfo_count += 1
-            
-            return {
-                "created": True,
-                "skipped": False,
-                "series_name": series_name,
-                "episodes": episode_count,
-                "nfo_files": nfo_count,
-                "message": f"{series_name} - ✓ Created {episode_count} episodes"
-            }
-            
-        except Exception as e:
-            return {
+        Incremental updates plan only the episodes not written yet, and still
+        record the series when there are none, to keep its new fingerprint.
+        """
+        episodes = job.pop("episodes")
+        incremental = job.get("incremental", False)
+        
+        if not episodes and not incremental:
+            job.update({
                 "created": False,
                 "skipped": False,
-                "series_name": series_name,
                 "episodes": 0,
                 "nfo_files": 0,
-                "error": str(e),
-                "message": f"{series_name} - ✗ Error: {e}"
-            }
+                "message": f"{job['series_name']} - No episodes found",
+                "done": True
+            })
+            return
+        
+        # Without a manifest, the files already on disk are the ones not to write
+        existing = set(_scan_series_episodes(job["series_folder"]) or ()) if job.get("skip_existing") else None
+        job["operations"] = self._plan_series_files(
+            job["series_rel"], job["series_name"], job["series_folder"], episodes,
+            dispatcharr_url, generate_nfo, job["op"],
+            existing=existing, tvshow=not incremental, fingerprint=job.get("fingerprint")
+        )
+    
+    def _write_stage(self, jobs, writer):
+        """Pipeline stage: create folders and write rendered files (disk-bound)."""
+        for job in jobs:
+            try:
+                self._write_series_files(job, writer)
+            except Exception as e:
+                self._fail_series(job, e)
+    
+    def _write_series_files(self, job, writer):
+        """Apply one series' plan (unchanged files are left alone); the series is recorded last.
+        
+        Only files that were actually written or updated are counted.
+        """
+        episode_count = 0
+        nfo_count = 0
+        with writer.staged(job["series_folder"]):
+            for operation in job.pop("operations"):
+                if writer.apply(operation) not in ("written", "updated"):
+                    continue
+                if operation.kind == "episode":
+                    episode_count += 1
+                elif operation.kind == "nfo":
+                    nfo_count += 1
+        
+        # A series rewritten by a sync whose files all came out the same wasn't created
+        unchanged = job.get("op") == "update" and not job.get("update") and not (episode_count or nfo_count)
+        job.update({
+            "created": not unchanged,
+            "skipped": False,
+            "episodes": episode_count,
+            "nfo_files": nfo_count,
+            "message": f"{job['series_name']} - " + ("Unchanged" if unchanged else f"✓ Created {episode_count} episodes")
+        })
+    
+    def _fail_series(self, job, error):
+        """Mark a series job as failed so the remaining stages pass it through."""
+        job.update({
+            "created": False,
+            "skipped": False,
+            "episodes": 0,
+            "nfo_files": 0,
+            "error": str(error),
+            "message": f"{job['series_name']} - ✗ Error: {error}",
+            "done": True
+        })
+    
+    def _cancel_series(self, job):
+        """Drop a series that hasn't been fetched yet because the run was cancelled."""
+        job.update({
+            "created": False,
+            "skipped": False,
+            "episodes": 0,
+            "nfo_files": 0,
+            "cancelled": True,
+            "message": f"{job['series_name']} - Cancelled",
+            "done": True
+        })
+    
+    def _is_generated(self, manifest, snapshot, kind, path, folder, relation_id, item_uuid, stream_id,
+                      metrics: Optional[RunMetrics] = None) -> bool:
+        """Check if a file was already generated, consulting the manifest or snapshot before the filesystem."""
+        if manifest and manifest.has(kind, path):
+            return True
+        if snapshot is not None:
+            return snapshot.has(kind, path)
+        if metrics:
+            metrics.count("stat")
+        if not os.path.exists(path):
+            return False
+        # Generated before the manifest existed - adopt it so the next run skips the probe
+        if manifest:
+            manifest.record(kind, path, folder, relation_id, item_uuid, stream_id)
+        return True
+    
+    def _series_generated(self, manifest, snapshot, series_folder: str, series_rel,
+                          metrics: Optional[RunMetrics] = None) -> bool:
+        """Check if a series folder already has Season folders, consulting the manifest or snapshot first."""
+        if manifest and manifest.has("series", series_folder):
+            return True
+        if snapshot is not None:
+            return snapshot.has("series", series_folder)
+        if metrics:
+            metrics.count("stat")
+        if not os.path.exists(series_folder):
+            return False
+        try:
+            has_seasons = any(
+                item.startswith("Season") and os.path.isdir(os.path.join(series_folder, item))
+                for item in os.listdir(series_folder)
+            )
+        except:
+            return False  # If error checking, process anyway
+        # Generated before the manifest existed - adopt it so the next run skips the listdir
+        if has_seasons and manifest:
+            manifest.record("series", series_folder, series_folder, series_rel.id, series_rel.uuid)
+        return has_seasons
+    
+    def _read_watermark(self, root_folder: str, key: str, relation_model, episode_model=None):
+        """Return (stored watermark or None, watermark to store after this run).
+        
+        The new watermark is captured before querying, so anything that changes
+        while the run is in progress is picked up again by the next sync.
+        """
+        from django.db.models import Max
+        from django.utils import timezone
+        
+        stored = self._load_state(root_folder).get(f"{key}_watermark")
+        new_watermark = {
+            "last_id": relation_model.objects.aggregate(max_id=Max('id'))['max_id'] or 0,
+            "since": timezone.now().isoformat()
+        }
+        if episode_model is not None:
+            new_watermark["last_episode_id"] = episode_model.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        return stored, new_watermark
+    
+    def _write_watermark(self, root_folder: str, key: str, watermark: dict):
+        self._save_state(root_folder, {f"{key}_watermark": watermark})
+    
+    def _changed_since(self, query, watermark, item_field: str, episode_model=None):
+        """Narrow a relation queryset to rows added or changed since the watermark."""
+        from datetime import datetime
+        from django.db.models import Q
+        
+        if not watermark:
+            return query  # First sync covers the whole catalog
+        
+        since = datetime.fromisoformat(watermark["since"])
+        changed = (
+            Q(id__gt=watermark["last_id"])
+            | Q(updated_at__gt=since)
+            | Q(**{f"{item_field}__updated_at__gt": since})
+        )
+        if episode_model is not None:
+            # Series whose episode relations were added or refreshed also count as changed
+            changed_series = episode_model.objects.filter(
+                Q(id__gt=watermark.get("last_episode_id", 0)) | Q(updated_at__gt=since)
+            ).values('episode__series_id')
+            changed |= Q(series_id__in=changed_series)
+        return query.filter(changed)
+    
+    def _reset_batch_position(self, settings: Dict[str, Any], logger):
+        """Forget where the last movie and series batches stopped."""
+        roots = [
+            (settings.get("root_folder", "/VODS/Movies"), "movies"),
+            (settings.get("series_root_folder", "/VODS/Series"), "series"),
+        ]
+        for root_folder, key in roots:
+            try:
+                self._clear_cursor(root_folder, key, logger)
+            except OSError as e:
+                logger.error("Failed to reset %s batch position: %s", key, e)
+                return {"status": "error", "message": f"Reset error: {e}"}
+        
+        return {"status": "ok", "message": "Next batches start from the beginning"}
+    
+    def _clear_cursor(self, root_folder: str, key: str, logger):
+        state = self._load_state(root_folder)
+        if state.get(f"{key}_cursor") or state.get(f"{key}_retry"):
+            self._save_state(root_folder, {f"{key}_cursor": 0, f"{key}_retry": []})
+            logger.info("Reset %s batch position", key)
+    
+    def _load_state(self, root_folder: str) -> dict:
+        """Load the plugin's persisted state (sync watermarks etc.) for a root folder."""
+        try:
+            with open(os.path.join(root_folder, STATE_FILENAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
     
-    def _cleanup_movies(self, settings: Dict[str, Any], logger):
+    def _save_state(self, root_folder: str, updates: dict):
+        """Merge updates into the persisted state file (written atomically)."""
+        state = self._load_state(root_folder)
+        state.update(updates)
+        path = os.path.join(root_folder, STATE_FILENAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, path)
+    
+    def _cleanup_movies(self, settings: Dict[str, Any], logger, metrics: Optional[RunMetrics] = None):
         """Clean up all generated movie .strm files and folders."""
+        metrics = metrics or RunMetrics("cleanup_movies")
         root_folder = settings.get("root_folder", "/VODS/Movies")
+        workers = self._int_setting(settings, "cleanup_workers", 8)
         
         logger.info("=" * 60)
         logger.info("VOD .strm Generator v%s", self.version)
@@ -687,36 +3593,27 @@ class Plugin:
                 "deleted_files": 0
             }
         
-        # Scan for folders with .strm or .nfo files
+        # Scan for folders with .strm files: one scandir per folder, spread over the pool
         logger.info("Scanning for movie folders...")
-        folders_to_delete = []
-        strm_files_found = 0
-        nfo_files_found = 0
+        scan_started = time.perf_counter()
         
         try:
-            for item in os.listdir(root_folder):
-                item_path = os.path.join(root_folder, item)
-                
-                # Only process directories
-                if os.path.isdir(item_path):
-                    # Check if this folder contains .strm or .nfo files
-                    has_plugin_files = False
-                    for file in os.listdir(item_path):
-                        if file.endswith('.strm'):
-                            has_plugin_files = True
-                            strm_files_found += 1
-                        elif file.endswith('.nfo'):
-                            nfo_files_found += 1
-                    
-                    if has_plugin_files:
-                        folders_to_delete.append(item_path)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                scanned = [
+                    (folder, listing)
+                    for folder, listing in zip(*self._scan_folders(root_folder, _scan_movie_folder, executor))
+                    if listing is not None
+                ]
+            metrics.add_time("scan", time.perf_counter() - scan_started)
+            strm_files_found = sum(listing["strm"] for _, listing in scanned)
+            nfo_files_found = sum(listing["nfo"] for _, listing in scanned)
             
-            logger.info("Found %d folders with plugin files", len(folders_to_delete))
+            logger.info("Found %d folders with plugin files", len(scanned))
             logger.info("  .strm files: %d", strm_files_found)
             logger.info("  .nfo files: %d", nfo_files_found)
             logger.info("")
             
-            if len(folders_to_delete) == 0:
+            if len(scanned) == 0:
                 logger.info("No movie folders found. Nothing to delete.")
                 return {
                     "status": "ok",
@@ -728,43 +3625,29 @@ class Plugin:
             # Show what will be deleted
             logger.info("Folders to be deleted:")
             logger.info("-" * 60)
-            for idx, folder in enumerate(folders_to_delete[:10], 1):  # Show first 10
+            for idx, (folder, _) in enumerate(scanned[:10], 1):  # Show first 10
                 logger.info("  [%d] %s", idx, os.path.basename(folder))
             
-            if len(folders_to_delete) > 10:
-                logger.info("  ... and %d more folders", len(folders_to_delete) - 10)
+            if len(scanned) > 10:
+                logger.info("  ... and %d more folders", len(scanned) - 10)
             
             logger.info("")
-            logger.info("Proceeding with deletion...")
+            logger.info("Proceeding with deletion (%d threads)...", workers)
             logger.info("")
             
-            # Delete folders
-            deleted_folders = 0
-            deleted_strm = 0
-            deleted_nfo = 0
-            errors = 0
+            # The scan already listed each folder, so deletion reuses those names
+            deleted_paths, removed, errors = self._delete_folders(
+                [(folder, listing["names"]) for folder, listing in scanned], workers, metrics, logger
+            )
+            deleted_folders = len(deleted_paths)
+            deleted_strm = removed["strm"]
+            deleted_nfo = removed["nfo"]
             
-            for idx, folder_path in enumerate(folders_to_delete, 1):
-                try:
-                    # Count files before deletion
-                    strm_count = sum(1 for f in os.listdir(folder_path) if f.endswith('.strm'))
-                    nfo_count = sum(1 for f in os.listdir(folder_path) if f.endswith('.nfo'))
-                    
-                    # Delete the entire folder
-                    import shutil
-                    shutil.rmtree(folder_path)
-                    
-                    deleted_folders += 1
-                    deleted_strm += strm_count
-                    deleted_nfo += nfo_count
-                    
-                    # Log progress every 50 folders
-                    if idx % 50 == 0 or idx == len(folders_to_delete):
-                        logger.info("Progress: %d/%d folders deleted", idx, len(folders_to_delete))
-                    
-                except Exception as e:
-                    logger.error("Failed to delete %s: %s", folder_path, e)
-                    errors += 1
+            self._forget_in_manifest(root_folder, deleted_paths, logger)
+            # Everything is gone, so the next batch has to start from the beginning
+            # (a cancelled cleanup left folders behind, so the batch keeps its place)
+            if not metrics.cancelled:
+                self._clear_cursor(root_folder, "movies", logger)
             
             logger.info("")
             logger.info("=" * 60)
@@ -781,10 +3664,13 @@ class Plugin:
             if deleted_nfo > 0:
                 summary_msg += f" + {deleted_nfo} .nfo"
             summary_msg += " files)"
+            if metrics.cancelled:
+                summary_msg = f"Cancelled - {summary_msg}"
             
             return {
                 "status": "ok",
                 "message": summary_msg,
+                "cancelled": metrics.cancelled,
                 "deleted_folders": deleted_folders,
                 "deleted_strm": deleted_strm,
                 "deleted_nfo": deleted_nfo,
@@ -798,9 +3684,11 @@ class Plugin:
                 "message": f"Cleanup error: {e}"
             }
     
-    def _cleanup_series(self, settings: Dict[str, Any], logger):
+    def _cleanup_series(self, settings: Dict[str, Any], logger, metrics: Optional[RunMetrics] = None):
         """Clean up all generated series .strm files and folders."""
+        metrics = metrics or RunMetrics("cleanup_series")
         series_root = settings.get("series_root_folder", "/VODS/Series")
+        workers = self._int_setting(settings, "cleanup_workers", 8)
         
         logger.info("=" * 60)
         logger.info("Series Cleanup")
@@ -814,45 +3702,18 @@ class Plugin:
             logger.info("Series root doesn't exist. Nothing to clean up.")
             return {"status": "ok", "message": "Series root doesn't exist", "deleted": 0}
         
-        # Scan for series folders (they contain Season folders)
+        # Scan for series folders (they contain Season folders). Season folders are
+        # only listed once, while deleting, which is also where files are counted.
         logger.info("Scanning for series folders...")
-        folders_to_delete = []
-        strm_count = 0
-        nfo_count = 0
+        scan_started = time.perf_counter()
         
         try:
-            import shutil
-            
-            for item in os.listdir(series_root):
-                item_path = os.path.join(series_root, item)
-                
-                if os.path.isdir(item_path):
-                    # Check if has Season folders or .strm files
-                    has_series_content = False
-                    
-                    for subitem in os.listdir(item_path):
-                        subitem_path = os.path.join(item_path, subitem)
-                        
-                        # Check for Season folders
-                        if os.path.isdir(subitem_path) and subitem.startswith("Season"):
-                            has_series_content = True
-                            # Count files in season folder
-                            for file in os.listdir(subitem_path):
-                                if file.endswith('.strm'):
-                                    strm_count += 1
-                                elif file.endswith('.nfo'):
-                                    nfo_count += 1
-                        
-                        # Count tvshow.nfo
-                        if subitem == "tvshow.nfo":
-                            nfo_count += 1
-                    
-                    if has_series_content:
-                        folders_to_delete.append(item_path)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                folders, found = self._scan_folders(series_root, LibrarySnapshot._series_has_seasons, executor)
+                folders_to_delete = [folder for folder, has_seasons in zip(folders, found) if has_seasons]
+            metrics.add_time("scan", time.perf_counter() - scan_started)
             
             logger.info("Found %d series folders", len(folders_to_delete))
-            logger.info("  .strm files: ~%d", strm_count)
-            logger.info("  .nfo files: ~%d", nfo_count)
             logger.info("")
             
             if len(folders_to_delete) == 0:
@@ -869,36 +3730,41 @@ class Plugin:
                 logger.info("  ... and %d more", len(folders_to_delete) - 10)
             
             logger.info("")
-            logger.info("Proceeding with deletion...")
+            logger.info("Proceeding with deletion (%d threads)...", workers)
             logger.info("")
             
             # Delete series folders
-            deleted = 0
-            errors = 0
+            deleted_paths, removed, errors = self._delete_folders(
+                [(folder, None) for folder in folders_to_delete], workers, metrics, logger
+            )
+            deleted = len(deleted_paths)
             
-            for idx, folder_path in enumerate(folders_to_delete, 1):
-                try:
-                    shutil.rmtree(folder_path)
-                    deleted += 1
-                    
-                    if idx % 10 == 0 or idx == len(folders_to_delete):
-                        logger.info("Progress: %d/%d deleted", idx, len(folders_to_delete))
-                
-                except Exception as e:
-                    logger.error("Failed to delete %s: %s", folder_path, e)
-                    errors += 1
+            self._forget_in_manifest(series_root, deleted_paths, logger)
+            # Everything is gone, so the next batch has to start from the beginning
+            # (a cancelled cleanup left folders behind, so the batch keeps its place)
+            if not metrics.cancelled:
+                self._clear_cursor(series_root, "series", logger)
             
             logger.info("")
             logger.info("=" * 60)
             logger.info("CLEANUP SUMMARY:")
             logger.info("  Series deleted: %d", deleted)
+            logger.info("  .strm deleted: %d", removed["strm"])
+            logger.info("  .nfo deleted: %d", removed["nfo"])
             logger.info("  Errors: %d", errors)
             logger.info("=" * 60)
             
+            summary_msg = f"Deleted {deleted} series folders"
+            if metrics.cancelled:
+                summary_msg = f"Cancelled - {summary_msg}"
+            
             return {
                 "status": "ok",
-                "message": f"Deleted {deleted} series folders",
+                "message": summary_msg,
+                "cancelled": metrics.cancelled,
                 "deleted": deleted,
+                "deleted_strm": removed["strm"],
+                "deleted_nfo": removed["nfo"],
                 "errors": errors
             }
             
@@ -906,144 +3772,636 @@ class Plugin:
             logger.error("Cleanup failed: %s", e)
             return {"status": "error", "message": f"Cleanup error: {e}"}
     
-    def _clean_title(self, title: str) -> str:
-        """Remove language prefixes (EN -, FR -, etc.) from movie titles."""
-        if not title:
-            return title
+    def _scan_folders(self, root_folder: str, scan_folder, executor):
+        """List the root's sub-folders with one scandir and scan each in the pool.
         
-        # Remove common language prefixes: EN -, FR -, US -, etc.
-        cleaned = re.sub(r'^[A-Z]{2,3}\s*-\s*', '', title)
-        return cleaned.strip()
+        Returns (folders, results) in directory order.
+        """
+        with os.scandir(root_folder) as entries:
+            folders = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+        return folders, list(executor.map(scan_folder, folders))
     
-    def _extract_genres(self, category_name: str) -> list:
-        """Extract genre names from category name."""
-        if not category_name:
-            return []
+    def _delete_folders(self, targets: list, workers: int, metrics: RunMetrics, logger):
+        """Delete folders on a bounded thread pool, logging progress as they finish.
+        
+        ``targets`` are (folder, names) pairs; names are the folder's entries when the
+        caller already listed it, or None. Returns (deleted paths, {"strm", "nfo"}
+        counts, errors). Stops submitting new folders once the run is cancelled.
+        """
+        deleted_paths = []
+        removed = {"strm": 0, "nfo": 0}
+        errors = 0
+        total = len(targets)
+        progress_every = max(10, min(1000, total // 20))
+        started = time.perf_counter()
+        metrics.set_total(total, "folders", lambda: len(deleted_paths) + errors)
+        
+        pending = deque()
+        
+        def collect(entry):
+            nonlocal errors
+            folder, future = entry
+            try:
+                counts = future.result()
+            except Exception as e:
+                logger.error("Failed to delete %s: %s", folder, e)
+                errors += 1
+            else:
+                deleted_paths.append(folder)
+                metrics.record_change(folder, "deleted")
+                removed["strm"] += counts["strm"]
+                removed["nfo"] += counts["nfo"]
+            finished = len(deleted_paths) + errors
+            if finished % progress_every == 0 or finished == total:
+                elapsed = time.perf_counter() - started
+                logger.info("Progress: %d/%d folders deleted (%.0f/s)", finished, total,
+                            finished / elapsed if elapsed else 0)
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for folder, names in targets:
+                if metrics.cancelled:
+                    logger.warning("Cancelled after %d of %d folders", len(deleted_paths) + errors, total)
+                    break
+                pending.append((folder, executor.submit(_remove_folder, folder, names)))
+                while len(pending) > workers * 4:
+                    collect(pending.popleft())
+            while pending:
+                collect(pending.popleft())
+        
+        metrics.add_time("delete", time.perf_counter() - started, len(deleted_paths) + errors)
+        return deleted_paths, removed, errors
+    
+    def _reconcile_library(self, settings: Dict[str, Any], logger, metrics: Optional[RunMetrics] = None):
+        """Delete generated movies, series and episodes whose relations are gone from the database."""
+        metrics = metrics or RunMetrics("reconcile_library")
+        root_folder = settings.get("root_folder", "/VODS/Movies")
+        series_root = settings.get("series_root_folder", "/VODS/Series")
+        use_manifest = settings.get("use_manifest", True)
+        workers = self._int_setting(settings, "cleanup_workers", 8)
+        
+        logger.info("")
+        logger.info("Reconciling library with the database:")
+        logger.info("  Movies Root: %s", root_folder)
+        logger.info("  Series Root: %s", series_root)
+        logger.info("  Source of generated files: %s", "manifest" if use_manifest else "filesystem scan")
+        logger.info("")
+        
+        try:
+            from apps.vod.models import M3UMovieRelation, M3USeriesRelation
+        except ImportError as e:
+            logger.error("Failed to import models: %s", e)
+            return {"status": "error", "message": f"Import error: {e}"}
+        
+        try:
+            movies = self._reconcile_movies(M3UMovieRelation, root_folder, use_manifest, workers, metrics, logger)
+            series = self._reconcile_series(M3USeriesRelation, series_root, use_manifest, workers, metrics, logger)
+        except Exception as e:
+            logger.error("Reconcile failed: %s", e)
+            return {"status": "error", "message": f"Reconcile error: {e}"}
+        
+        errors = movies["errors"] + series["errors"]
+        logger.info("")
+        logger.info("=" * 60)
+        logger.info("RECONCILE SUMMARY:")
+        logger.info("  Movies removed:   %d", movies["removed"])
+        logger.info("  Series removed:   %d", series["removed"])
+        logger.info("  Episodes removed: %d", series["episodes_removed"])
+        logger.info("  Errors:           %d", errors)
+        logger.info("=" * 60)
+        
+        summary_msg = (f"Removed {movies['removed']} movies, {series['removed']} series and "
+                       f"{series['episodes_removed']} episodes no longer in Dispatcharr")
+        if metrics.cancelled:
+            summary_msg = f"Cancelled - {summary_msg}"
+        
+        return {
+            "status": "ok",
+            "message": summary_msg,
+            "cancelled": metrics.cancelled,
+            "movies_removed": movies["removed"],
+            "series_removed": series["removed"],
+            "episodes_removed": series["episodes_removed"],
+            "errors": errors
+        }
+    
+    def _plan_changes(self, settings: Dict[str, Any], logger, metrics: Optional[RunMetrics] = None):
+        """Dry run: plan what Generate (All) plus Remove Orphans would do, without writing anything."""
+        metrics = metrics or RunMetrics("plan_changes")
+        root_folder = settings.get("root_folder", "/VODS/Movies")
+        series_root = settings.get("series_root_folder", "/VODS/Series")
+        dispatcharr_url = settings.get("dispatcharr_url", "http://192.168.99.11:9191").rstrip("/")
+        use_manifest = settings.get("use_manifest", True)
+        workers = self._int_setting(settings, "cleanup_workers", 8)
+        
+        logger.info("")
+        logger.info("Planning changes (dry run - nothing is written):")
+        logger.info("  Movies Root: %s", root_folder)
+        logger.info("  Series Root: %s", series_root)
+        logger.info("")
+        
+        try:
+            from apps.vod.models import M3UMovieRelation, M3USeriesRelation
+        except ImportError as e:
+            logger.error("Failed to import models: %s", e)
+            return {"status": "error", "message": f"Import error: {e}"}
+        
+        movies = LibraryPlan()
+        series = LibraryPlan()
+        try:
+            self._plan_movies(M3UMovieRelation, root_folder, dispatcharr_url, settings.get("generate_nfo", True),
+                              use_manifest, workers, settings, movies, metrics, logger)
+            self._plan_series(M3USeriesRelation, series_root, dispatcharr_url, settings.get("generate_series_nfo", True),
+                              use_manifest, workers, settings, series, metrics, logger)
+        except Exception as e:
+            logger.error("Planning failed: %s", e)
+            return {"status": "error", "message": f"Planning error: {e}"}
+        
+        logger.info("")
+        logger.info("=" * 60)
+        logger.info("PLAN:")
+        for label, plan in (("Movies", movies), ("Series", series)):
+            logger.info("  %s:", label)
+            for op in LibraryPlan.OPERATIONS:
+                if plan.counts[op]:
+                    kinds = ", ".join(f"{count} {kind}" for kind, count in sorted(plan.counts[op].items()))
+                    logger.info("    %-7s %s", op, kinds)
+            logger.info("    ~%s to write", _format_size(plan.bytes["create"] + plan.bytes["update"]))
+            for op in ("create", "update", "delete"):
+                for path in plan.samples[op]:
+                    logger.info("    %s: %s", op, path)
+        logger.info("=" * 60)
+        
+        totals = {op: movies.total(op) + series.total(op) for op in LibraryPlan.OPERATIONS}
+        estimated_bytes = sum(plan.bytes["create"] + plan.bytes["update"] for plan in (movies, series))
+        summary_msg = (f"Dry run: {totals['create']} create, {totals['update']} update, "
+                       f"{totals['delete']} delete and {totals['skip']} skip operations "
+                       f"(~{_format_size(estimated_bytes)} to write)")
+        if totals["fetch"]:
+            summary_msg += f"; {totals['fetch']} series still need episodes from their provider"
+        if metrics.cancelled:
+            summary_msg = f"Cancelled - {summary_msg} (partial plan)"
+        
+        return {
+            "status": "ok",
+            "message": summary_msg,
+            "cancelled": metrics.cancelled,
+            "totals": totals,
+            "estimated_bytes": estimated_bytes,
+            "movies": movies.as_dict(),
+            "series": series.as_dict()
+        }
+    
+    def _plan_movies(self, relation_model, root_folder: str, dispatcharr_url: str, generate_nfo: bool,
+                     use_manifest: bool, workers: int, settings: Dict[str, Any], plan: LibraryPlan, metrics, logger):
+        """Add every movie operation of a full generation plus orphan removal to a plan."""
+        exists = os.path.isdir(root_folder)
+        manifest = GenerationManifest.open(root_folder, logger, read_only=True) if use_manifest and exists else None
+        try:
+            # Same skip checks as generating, minus adopting files into the manifest
+            with metrics.timer("snapshot"):
+                snapshot = None if manifest else (
+                    LibrarySnapshot.scan(root_folder, "movie", workers, logger) if exists else LibrarySnapshot()
+                )
+            writer = LibraryWriter(manifest, metrics)
+            query = self._preferred_relations(relation_model.objects.all(), relation_model, "movie", settings)
+            claimed_paths = set()
+            planned = 0
+            with metrics.timer("query"):
+                metrics.set_total(query.count(), "movies", lambda: planned)
+            
+            for relation in self._iter_relations(query, metrics=metrics,
+                                                 fetch=partial(_MOVIE_ROWS.fetch, nfo=generate_nfo)):
+                if metrics.cancelled:
+                    return
+                planned += 1
+                _, _, movie_folder, strm_path = self._movie_paths(relation, root_folder)
+                if strm_path in claimed_paths or self._planned_as_generated(manifest, snapshot, "movie", strm_path):
+                    plan.add(PlanOperation("skip", "movie", strm_path, movie_folder))
+                    continue
+                claimed_paths.add(strm_path)
+                with metrics.timer("render"):
+                    operations = self._plan_movie(relation, movie_folder, strm_path, dispatcharr_url, generate_nfo)
+                self._add_to_plan(plan, writer, operations, metrics)
+            
+            if exists:
+                orphan_folders, orphan_files = self._find_movie_orphans(
+                    relation_model, root_folder, manifest, workers, metrics, logger
+                )
+                for folder in orphan_folders or ():
+                    plan.add(PlanOperation("delete", "folder", folder, folder))
+                for path in orphan_files or ():
+                    plan.add(PlanOperation("delete", "movie", path, os.path.dirname(path)))
+        finally:
+            if manifest:
+                manifest.close()
+    
+    def _plan_series(self, relation_model, series_root: str, dispatcharr_url: str, generate_nfo: bool,
+                     use_manifest: bool, workers: int, settings: Dict[str, Any], plan: LibraryPlan, metrics, logger):
+        """Add every series operation of a full generation plus orphan removal to a plan.
+        
+        Series whose episodes haven't been fetched from the provider yet are
+        planned as "fetch": their files are only known after the (network)
+        fetch, which a dry run doesn't do. Generated series that gained
+        episodes are planned as an update that adds them.
+        """
+        incremental = settings.get("incremental_series", True)
+        exists = os.path.isdir(series_root)
+        manifest = GenerationManifest.open(series_root, logger, read_only=True) if use_manifest and exists else None
+        try:
+            with metrics.timer("snapshot"):
+                snapshot = None if manifest else (
+                    LibrarySnapshot.scan(series_root, "series", workers, logger, count_episodes=incremental)
+                    if exists else LibrarySnapshot()
+                )
+            writer = LibraryWriter(manifest, metrics)
+            query = self._preferred_relations(relation_model.objects.all(), relation_model, "series", settings)
+            claimed_folders = set()
+            page = []
+            unchecked = []
+            planned = 0
+            with metrics.timer("query"):
+                metrics.set_total(query.count(), "series", lambda: planned)
+            
+            for series_rel in self._iter_relations(query, metrics=metrics,
+                                                   fetch=partial(_SERIES_ROWS.fetch, nfo=generate_nfo)):
+                if metrics.cancelled:
+                    return
+                planned += 1
+                series_name, series_folder = self._series_paths(series_rel, series_root)
+                claimed = series_folder in claimed_folders
+                if claimed or self._planned_as_generated(manifest, snapshot, "series", series_folder):
+                    if claimed or not incremental:
+                        plan.add(PlanOperation("skip", "series", series_folder, series_folder))
+                        continue
+                    claimed_folders.add(series_folder)
+                    unchecked.append((series_rel, series_name, series_folder))
+                    if len(unchecked) >= self.series_chunk_size:
+                        self._plan_series_updates(unchecked, manifest, snapshot, dispatcharr_url, generate_nfo,
+                                                  plan, writer, metrics)
+                        unchecked = []
+                    continue
+                claimed_folders.add(series_folder)
+                if not series_rel.episodes_fetched:
+                    plan.add(PlanOperation("fetch", "series", series_folder, series_folder))
+                    continue
+                page.append((series_rel, series_name, series_folder))
+                if len(page) >= self.series_chunk_size:
+                    self._plan_series_page(page, dispatcharr_url, generate_nfo, plan, writer, metrics)
+                    page = []
+            self._plan_series_page(page, dispatcharr_url, generate_nfo, plan, writer, metrics)
+            self._plan_series_updates(unchecked, manifest, snapshot, dispatcharr_url, generate_nfo,
+                                      plan, writer, metrics)
+            
+            if exists:
+                orphan_folders, orphan_episodes = self._find_series_orphans(
+                    relation_model, series_root, manifest, workers, metrics, logger
+                )
+                for folder in orphan_folders or ():
+                    plan.add(PlanOperation("delete", "folder", folder, folder))
+                for path in orphan_episodes or ():
+                    plan.add(PlanOperation("delete", "episode", path, os.path.dirname(path)))
+        finally:
+            if manifest:
+                manifest.close()
+    
+    def _plan_series_page(self, page: list, dispatcharr_url: str, generate_nfo: bool, plan: LibraryPlan,
+                          writer: LibraryWriter, metrics):
+        """Load the episodes of a page of series with one query and add their operations to a plan."""
+        if not page:
+            return
+        with metrics.timer("load"):
+            episodes_by_series = self._load_batch_episodes([series_rel for series_rel, _, _ in page], generate_nfo)
+        for series_rel, series_name, series_folder in page:
+            episodes = episodes_by_series.get((series_rel.m3u_account_id, series_rel.series_id))
+            if not episodes:
+                # Generating would report "No episodes found" and leave it alone
+                plan.add(PlanOperation("skip", "series", series_folder, series_folder))
+                continue
+            with metrics.timer("render"):
+                operations = self._plan_series_files(series_rel, series_name, series_folder, episodes,
+                                                     dispatcharr_url, generate_nfo)
+            self._add_to_plan(plan, writer, operations, metrics)
+    
+    def _plan_series_updates(self, candidates: list, manifest, snapshot, dispatcharr_url: str, generate_nfo: bool,
+                             plan: LibraryPlan, writer: LibraryWriter, metrics):
+        """Add the new episodes of a page of generated series to a plan; unchanged series are skips."""
+        if not candidates:
+            return
+        jobs = self._changed_series(candidates, manifest, snapshot, metrics)
+        changed = {job["series_folder"] for job in jobs}
+        for _, _, series_folder in candidates:
+            if series_folder not in changed:
+                plan.add(PlanOperation("skip", "series", series_folder, series_folder))
+        if not jobs:
+            return
+        # The same load and render steps the pipeline runs for these jobs
+        self._load_stage(jobs, generate_nfo, metrics)
+        for job in jobs:
+            with metrics.timer("render"):
+                self._render_series(job, dispatcharr_url, generate_nfo)
+            self._add_to_plan(plan, writer, job["operations"], metrics)
+    
+    def _add_to_plan(self, plan: LibraryPlan, writer: LibraryWriter, operations: list, metrics):
+        """Turn planned writes into create/update/skip by comparing them with what is there now."""
+        outcomes = {"written": "create", "updated": "update", "unchanged": "skip"}
+        with metrics.timer("compare"):
+            for operation in operations:
+                if operation.content is not None:
+                    op = outcomes[writer.classify(operation.path, operation.content, operation.folder,
+                                                  verify=operation.op == "update")]
+                elif operation.kind == "folder":
+                    op = "skip" if os.path.isdir(operation.path) else "create"
+                else:
+                    op = operation.op
+                plan.add(operation._replace(op=op))
+    
+    def _planned_as_generated(self, manifest, snapshot, kind: str, path: str) -> bool:
+        """Read-only version of the generators' skip checks (nothing is adopted into the manifest)."""
+        if manifest and manifest.has(kind, path):
+            return True
+        if snapshot is not None:
+            return snapshot.has(kind, path)
+        if kind == "series":
+            return LibrarySnapshot._series_has_seasons(path)
+        return os.path.exists(path)
+    
+    def _reconcile_movies(self, relation_model, root_folder: str, use_manifest: bool, workers: int, metrics, logger):
+        """Remove movie .strm files (and their folders) that no relation produces any more."""
+        result = {"removed": 0, "errors": 0}
+        if not os.path.isdir(root_folder):
+            return result
+        
+        manifest = self._existing_manifest(root_folder, logger) if use_manifest else None
+        try:
+            orphan_folders, orphan_files = self._find_movie_orphans(
+                relation_model, root_folder, manifest, workers, metrics, logger
+            )
+            if orphan_folders is None:
+                result["errors"] += 1
+                return result
+            
+            deleted_paths, _, errors = self._delete_folders(
+                [(folder, None) for folder in orphan_folders], workers, metrics, logger
+            )
+            removed_files, file_errors = self._remove_generated_files(orphan_files, metrics, logger)
+            result["removed"] = len(deleted_paths) + len(orphan_files) - file_errors
+            result["errors"] += errors + file_errors
+            
+            if manifest:
+                manifest.forget_folders(deleted_paths)
+                manifest.forget_paths(removed_files)
+        finally:
+            if manifest:
+                manifest.close()
+        return result
+    
+    def _find_movie_orphans(self, relation_model, root_folder: str, manifest, workers: int, metrics, logger):
+        """Return (folders, files) of generated movies no relation produces any more.
+        
+        A folder that no current movie maps to goes entirely; otherwise only its
+        stale .strm files. Returns (None, None) when the database has no movies
+        at all, so an empty query never wipes the library. Manifest rows whose
+        files are gone (orphaned or deleted by hand) are forgotten instead, so
+        the next generation run checks those movies on disk again.
+        """
+        # Every path the database would generate; any relation of a movie maps to the same path
+        expected = set()
+        for relation in self._iter_relations(relation_model.objects.all(), metrics=metrics, fetch=_MOVIE_ROWS.fetch):
+            expected.add(self._movie_paths(relation, root_folder)[3])
+        expected_folders = {os.path.dirname(path) for path in expected}
+        
+        with metrics.timer("scan"):
+            # The disk decides: files generated with the manifest off (or by older
+            # versions) have no rows, so the manifest only adds to what is found
+            on_disk = LibrarySnapshot.scan(root_folder, "movie", workers, logger).movie_files
+            generated = set(on_disk)
+            if manifest:
+                generated.update(path for path, _ in manifest.entries("movie"))
+        
+        orphans = generated - expected
+        logger.info("Movies: %d generated, %d in database, %d orphaned", len(generated), len(expected), len(orphans))
+        if orphans and not expected:
+            logger.warning("The database returned no movies - refusing to delete the whole library "
+                           "(use Clean Up Movies for that)")
+            return None, None
+        
+        gone = generated - on_disk
+        if gone and manifest and not manifest.read_only:
+            manifest.forget_folders(sorted({os.path.dirname(path) for path in gone}))
+            logger.info("Manifest: dropped the rows of %d movies whose files are gone", len(gone))
+        orphans &= on_disk
+        orphan_folders = sorted({os.path.dirname(path) for path in orphans} - expected_folders)
+        orphan_files = sorted(path for path in orphans if os.path.dirname(path) in expected_folders)
+        return orphan_folders, orphan_files
+    
+    def _reconcile_series(self, relation_model, series_root: str, use_manifest: bool, workers: int, metrics, logger):
+        """Remove series folders and single episodes that no relation produces any more."""
+        result = {"removed": 0, "episodes_removed": 0, "errors": 0}
+        if not os.path.isdir(series_root):
+            return result
         
-        # Remove common prefixes (EN -, FR -, US -, etc.)
-        genre_text = re.sub(r'^[A-Z]{2,3}\s*-\s*', '', category_name)
+        manifest = self._existing_manifest(series_root, logger) if use_manifest else None
+        try:
+            orphan_folders, orphan_episodes = self._find_series_orphans(
+                relation_model, series_root, manifest, workers, metrics, logger
+            )
+            if orphan_folders is None:
+                result["errors"] += 1
+                return result
+            
+            deleted_paths, _, errors = self._delete_folders(
+                [(folder, None) for folder in orphan_folders], workers, metrics, logger
+            )
+            removed_files, file_errors = self._remove_generated_files(orphan_episodes, metrics, logger)
+            result["removed"] = len(deleted_paths)
+            result["episodes_removed"] = len(orphan_episodes) - file_errors
+            result["errors"] += errors + file_errors
+            
+            if manifest:
+                manifest.forget_folders(deleted_paths)
+                manifest.forget_paths(removed_files)
+        finally:
+            if manifest:
+                manifest.close()
+        return result
+    
+    def _find_series_orphans(self, relation_model, series_root: str, manifest, workers: int, metrics, logger):
+        """Return (series folders, episode .strm files) no relation produces any more.
         
-        # Remove (movie) or (series) suffix
-        genre_text = re.sub(r'\s*\((movie|series)\)\s*$', '', genre_text, flags=re.IGNORECASE)
+        Returns (None, None) when the database has no series at all. Series with
+        manifest rows for files that are gone lose all their rows, so the next
+        generation run checks them on disk again.
+        """
+        # Expected series folders, and per folder the episode paths its relations produce
+        expected_folders = set()
+        expected_episodes = {}
+        page = []
+        for series_rel in self._iter_relations(relation_model.objects.all(), metrics=metrics, fetch=_SERIES_ROWS.fetch):
+            page.append(series_rel)
+            if len(page) >= self.stream_chunk_size:
+                self._collect_expected_episodes(page, series_root, expected_folders, expected_episodes, metrics)
+                page = []
+        self._collect_expected_episodes(page, series_root, expected_folders, expected_episodes, metrics)
         
-        # Split on common separators
-        genres = re.split(r'[/&,]', genre_text)
+        with metrics.timer("scan"):
+            # As for movies, the scan finds what exists and the manifest only adds to it
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                folders, found = self._scan_folders(series_root, _scan_series_episodes, executor)
+            folders_on_disk = set(folders)
+            generated_folders = {folder for folder, paths in zip(folders, found) if paths is not None}
+            generated_episodes = {
+                (path, folder) for folder, paths in zip(folders, found) for path in (paths or ())
+            }
+            episodes_on_disk = {path for path, _ in generated_episodes}
+            if manifest:
+                manifest_episodes = manifest.entries("episode")
+                generated_episodes.update(manifest_episodes)
+                generated_folders.update(path for path, _ in manifest.entries("series"))
+                generated_folders.update(folder for _, folder in manifest_episodes)
+        
+        orphan_folders = sorted(generated_folders - expected_folders)
+        # Episodes are only pruned in series whose episodes are known; a series that
+        # hasn't been fetched from its provider yet has none in the database
+        orphan_episodes = sorted(
+            path for path, folder in generated_episodes
+            if expected_episodes.get(folder) and path not in expected_episodes[folder]
+        )
+        logger.info("Series: %d generated, %d in database, %d orphaned; %d orphaned episodes in current series",
+                    len(generated_folders), len(expected_folders), len(orphan_folders), len(orphan_episodes))
+        if orphan_folders and not expected_folders:
+            logger.warning("The database returned no series - refusing to delete the whole library "
+                           "(use Clean Up Series for that)")
+            return None, None
         
-        # Clean up each genre
-        cleaned_genres = []
-        for genre in genres:
-            genre = genre.strip()
-            # Capitalize first letter of each word
-            genre = ' '.join(word.capitalize() for word in genre.split())
-            if genre:
-                cleaned_genres.append(genre)
+        gone = {folder for folder in generated_folders if folder not in folders_on_disk}
+        gone.update(folder for path, folder in generated_episodes if path not in episodes_on_disk)
+        if gone and manifest and not manifest.read_only:
+            manifest.forget_folders(sorted(gone))
+            logger.info("Manifest: dropped the rows of %d series with files that are gone", len(gone))
+        orphan_folders = [folder for folder in orphan_folders if folder in folders_on_disk]
+        orphan_episodes = [path for path in orphan_episodes if path in episodes_on_disk]
+        return orphan_folders, orphan_episodes
+    
+    def _collect_expected_episodes(self, series_rels, series_root: str, expected_folders: set,
+                                   expected_episodes: dict, metrics):
+        """Add the folders and episode .strm paths of a page of series relations."""
+        if not series_rels:
+            return
+        with metrics.timer("load"):
+            episodes_by_series = self._load_batch_episodes(series_rels)
+        for series_rel in series_rels:
+            series_name, series_folder = self._series_paths(series_rel, series_root)
+            expected_folders.add(series_folder)
+            paths = expected_episodes.setdefault(series_folder, set())
+            for episode_rel in episodes_by_series.get((series_rel.m3u_account_id, series_rel.series_id), []):
+                paths.add(self._episode_path(series_name, series_folder, episode_rel)[1] + ".strm")
+    
+    def _remove_generated_files(self, strm_paths: list, metrics: RunMetrics, logger):
+        """Delete .strm files with their .nfo; empty Season folders go too.
         
-        return cleaned_genres or ["Unknown"]
+        Returns (removed paths, errors).
+        """
+        removed = []
+        errors = 0
+        for strm_path in strm_paths:
+            nfo_path = strm_path[:-len('.strm')] + '.nfo'
+            try:
+                for path in (strm_path, nfo_path):
+                    try:
+                        os.unlink(path)
+                        removed.append(path)
+                    except FileNotFoundError:
+                        pass
+            except OSError as e:
+                logger.error("Failed to delete %s: %s", strm_path, e)
+                errors += 1
+                continue
+            folder = os.path.dirname(strm_path)
+            if os.path.basename(folder).startswith("Season"):
+                metrics.record_change(os.path.dirname(folder), "modified")
+                try:
+                    os.rmdir(folder)
+                except OSError:
+                    pass  # Still has episodes
+            else:
+                metrics.record_change(folder, "modified")
+        return removed, errors
+    
+    def _existing_manifest(self, root_folder: str, logger) -> Optional[GenerationManifest]:
+        """Open the root folder's manifest for writing only if one already exists."""
+        if not os.path.exists(os.path.join(root_folder, MANIFEST_FILENAME)):
+            return None
+        return GenerationManifest.open(root_folder, logger)
+    
+    def _forget_in_manifest(self, root_folder: str, folders: list, logger):
+        """Remove deleted folders from the root folder's manifest, if one exists."""
+        manifest = self._existing_manifest(root_folder, logger) if folders else None
+        if manifest:
+            manifest.forget_folders(folders)
+            manifest.close()
+            logger.info("Manifest updated: %d folders removed", len(folders))
+    
+    def _clean_title(self, title: str) -> str:
+        """Remove language prefixes (EN -, FR -, etc.) from movie titles."""
+        if not title:
+            return title
+        return _cached_clean_title(title)
     
     def _generate_tvshow_nfo(self, series, category_name: str) -> str:
         """Generate tvshow.nfo XML content for a series."""
         # Extract basic info (clean language prefix)
-        raw_title = series.name or "Unknown"
-        title = self._clean_title(raw_title)
+        title = self._clean_title(series.name or "Unknown")
         year = series.year or ""
         plot = series.description or ""
         
-        # Extract genres from category
-        genres = self._extract_genres(category_name)
-        
-        # Build XML
-        xml_lines = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>']
-        xml_lines.append('<tvshow>')
-        xml_lines.append(f'    <title>{self._xml_escape(title)}</title>')
-        
+        nfo = f'{_XML_DECLARATION}\n<tvshow>\n    <title>{_escape_xml(title)}</title>'
         if year:
-            xml_lines.append(f'    <year>{year}</year>')
-        
-        for genre in genres:
-            xml_lines.append(f'    <genre>{self._xml_escape(genre)}</genre>')
-        
+            nfo += f'\n    <year>{year}</year>'
+        nfo += _cached_genre_elements(category_name)
         if plot:
-            xml_lines.append(f'    <plot>{self._xml_escape(plot)}</plot>')
-        
-        xml_lines.append('</tvshow>')
-        
-        return '\n'.join(xml_lines)
+            nfo += f'\n    <plot>{_escape_xml(plot)}</plot>'
+        return nfo + '\n</tvshow>'
     
     def _generate_episode_nfo(self, episode) -> str:
         """Generate episode.nfo XML content for an episode."""
         # Extract episode info (clean language prefix)
         raw_title = episode.name or ""
         title = self._clean_title(raw_title) if raw_title else "Episode"
-        season_num = episode.season_number or 0
-        episode_num = episode.episode_number or 0
         plot = episode.description or ""
         
-        # Build XML
-        xml_lines = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>']
-        xml_lines.append('<episodedetails>')
-        xml_lines.append(f'    <title>{self._xml_escape(title)}</title>')
-        xml_lines.append(f'    <season>{season_num}</season>')
-        xml_lines.append(f'    <episode>{episode_num}</episode>')
-        
+        nfo = (
+            f'{_XML_DECLARATION}\n<episodedetails>\n'
+            f'    <title>{_escape_xml(title)}</title>\n'
+            f'    <season>{episode.season_number or 0}</season>\n'
+            f'    <episode>{episode.episode_number or 0}</episode>'
+        )
         if plot:
-            xml_lines.append(f'    <plot>{self._xml_escape(plot)}</plot>')
-        
-        xml_lines.append('</episodedetails>')
-        
-        return '\n'.join(xml_lines)
+            nfo += f'\n    <plot>{_escape_xml(plot)}</plot>'
+        return nfo + '\n</episodedetails>'
     
     def _generate_nfo(self, movie, category_name: str) -> str:
         """Generate NFO XML content for a movie."""
         # Extract basic info (clean language prefix)
-        raw_title = movie.name or "Unknown"
-        title = self._clean_title(raw_title)
+        title = self._clean_title(movie.name or "Unknown")
         year = movie.year or ""
         plot = movie.description or ""
         rating = movie.rating or ""
         tmdb_id = movie.tmdb_id or ""
         imdb_id = movie.imdb_id or ""
         
-        # Extract genres from category
-        genres = self._extract_genres(category_name)
-        
-        # Build XML
-        xml_lines = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>']
-        xml_lines.append('<movie>')
-        xml_lines.append(f'    <title>{self._xml_escape(title)}</title>')
-        
+        nfo = f'{_XML_DECLARATION}\n<movie>\n    <title>{_escape_xml(title)}</title>'
         if year:
-            xml_lines.append(f'    <year>{year}</year>')
-        
-        for genre in genres:
-            xml_lines.append(f'    <genre>{self._xml_escape(genre)}</genre>')
-        
+            nfo += f'\n    <year>{year}</year>'
+        nfo += _cached_genre_elements(category_name)
         if plot:
-            xml_lines.append(f'    <plot>{self._xml_escape(plot)}</plot>')
-        
+            nfo += f'\n    <plot>{_escape_xml(plot)}</plot>'
         if rating:
-            xml_lines.append(f'    <rating>{rating}</rating>')
-        
+            nfo += f'\n    <rating>{rating}</rating>'
         if tmdb_id:
-            xml_lines.append(f'    <tmdbid>{tmdb_id}</tmdbid>')
-        
+            nfo += f'\n    <tmdbid>{tmdb_id}</tmdbid>'
         if imdb_id:
-            xml_lines.append(f'    <imdbid>{imdb_id}</imdbid>')
-        
-        xml_lines.append('</movie>')
-        
-        return '\n'.join(xml_lines)
-    
-    def _xml_escape(self, text: str) -> str:
-        """Escape special XML characters."""
-        if not text:
-            return ""
-        text = str(text)
-        text = text.replace('&', '&amp;')
-        text = text.replace('<', '&lt;')
-        text = text.replace('>', '&gt;')
-        text = text.replace('"', '&quot;')
-        text = text.replace("'", '&apos;')
-        return text
+            nfo += f'\n    <imdbid>{imdb_id}</imdbid>'
+        return nfo + '\n</movie>'
     
     def _sanitize_filename(self, name: str) -> str:
         """Sanitize filename by removing invalid characters."""
@@ -1051,10 +4409,10 @@ class Plugin:
             return "Unknown"
         
         # Remove invalid characters for Windows/Linux filesystems
-        name = re.sub(r'[<>:"/\\|?*\x00-\x1f]', '', name)
+        name = _INVALID_FILENAME_RE.sub('', name)
         
         # Replace multiple spaces with single space
-        name = re.sub(r'\s+', ' ', name)
+        name = _WHITESPACE_RE.sub(' ', name)
         
         # Trim and limit length
         name = name.strip()[:200]